@@ -0,0 +1,184 @@
+"""
+HTTP helpers for the REST API: conditional GET, compression and streaming.
+
+:func:`conditional` wraps a resource method with ETag handling. The ETag is
+computed from a cheap "version" query before the view runs, so a client whose
+``If-None-Match`` still matches gets a ``304`` without the real query ever
+being executed.
+
+Responses are compressed with brotli (when the optional ``brotli`` package is
+installed) or gzip, according to ``Accept-Encoding``. :func:`stream_ndjson`
+produces a chunked, incrementally compressed NDJSON body from a row iterator.
+
+The helpers take an optional werkzeug request so the async catalog API
+(async_api.py) can share them; by default they use Flask's ``request``.
+"""
+
+import functools
+import gzip
+import hashlib
+import hmac
+import json
+import zlib
+
+from flask import current_app, request, stream_with_context
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+MIN_COMPRESS_SIZE = 512
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def negotiate_encoding(req=None):
+    """Pick the best content-coding the client accepts, or None."""
+    accepted = (req or request).accept_encodings
+    candidates = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0
+    for encoding in candidates:
+        quality = accepted[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def parse_ids(value, limit):
+    """``"3,1,3"`` -> ``[3, 1]``; ValueError for junk or more than ``limit`` ids."""
+    try:
+        ids = [int(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        ids = None
+    if not ids:
+        raise ValueError('ids must be a comma-separated list of integers')
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > limit:
+        raise ValueError(f'At most {limit} ids per request')
+    return ids
+
+
+def require_api_token(view):
+    """Only let through requests with ``Authorization: Bearer <API_WRITE_TOKEN>``."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get('API_WRITE_TOKEN')
+        if not token:
+            return {'message': 'The write API is disabled; set API_WRITE_TOKEN'}, 403
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(given.encode(), token.encode()):
+            return {'message': 'Missing or invalid API token'}, 401
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def make_etag(*parts):
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def compress_body(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body)
+    return gzip.compress(body, compresslevel=6)
+
+
+def compress_response(response, encoding):
+    if (encoding is None or response.is_streamed or response.status_code != 200
+            or 'Content-Encoding' in response.headers):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_COMPRESS_SIZE:
+        return response
+    response.set_data(compress_body(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def conditional(version):
+    """ETag/``If-None-Match`` support plus compression for a GET handler.
+
+    ``version`` is called with the view's keyword arguments and returns a
+    value that changes whenever the response would; it is combined with
+    the normalized query string into a strong ETag.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            encoding = negotiate_encoding()
+            query = sorted(request.args.items(multi=True))
+            etag = make_etag(request.endpoint, version(**kwargs), query, wants_ndjson())
+            if encoding:
+                # Each content-coding is a separate representation
+                etag = f'{etag}-{encoding}'
+
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                response = compress_response(response, encoding)
+
+            response.set_etag(etag)
+            response.vary.add('Accept-Encoding')
+            # Let clients keep a copy but always revalidate it
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def chunk_compressor(encoding):
+    """``(compress, flush)`` functions for incremental compression."""
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        return compressor.process, compressor.finish
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # 31 = gzip container
+    return compressor.compress, compressor.flush
+
+
+def _compressed_chunks(chunks, encoding):
+    compress, flush = chunk_compressor(encoding)
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield flush()
+
+
+def encode_ndjson(rows):
+    return ''.join(json.dumps(row, separators=(',', ':')) + '\n' for row in rows).encode()
+
+
+def stream_ndjson(rows, batch_size=500):
+    """Stream ``rows`` (dicts) as NDJSON, compressed if the client allows it."""
+    encoding = negotiate_encoding()
+
+    def generate():
+        buffer = []
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= batch_size:
+                yield encode_ndjson(buffer)
+                buffer = []
+        if buffer:
+            yield encode_ndjson(buffer)
+
+    body = generate()
+    if encoding:
+        body = _compressed_chunks(body, encoding)
+
+    response = current_app.response_class(stream_with_context(body), mimetype=NDJSON_MIMETYPE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def wants_ndjson(req=None):
+    req = req or request
+    if req.args.get('format') == 'ndjson':
+        return True
+    accept = req.accept_mimetypes
+    return accept[NDJSON_MIMETYPE] > accept['application/json']
@@ -1,38 +1,107 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Blueprint, Flask, current_app, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from models import db, User, Product, CartItem, Order, OrderItem, ProductReview, Wishlist
+from models import db, User, Product, ProductReview, Wishlist, CatalogVersion, CATALOG_VERSION_ID
+from pagination import paginate_products, InvalidCursor
+from search_index import get_backend as get_search_backend
+from queries import wishlist_items_for, reviews_for_product, user_product_flags
+from orders import place_order, EmptyCartError, OutOfStockError
+from inventory import apply_product_updates, BatchTooLarge
+from cart_store import cart_store
+from reservations import stock_holds, InsufficientStock
+from jobs import job_queue, queue_stats
+from instrumentation import instrumentation, require_metrics_token
+from user_cache import user_cache
+from passwords import passwords, HashingBusy
+from ratelimit import rate_limiter
+from rankings import rankings, RANKINGS
+from recommendations import recommendations
+from database import init_database, read_replica
+from cache import cache, cached, CATALOG_TAG, CATEGORIES_TAG, RATINGS_TAG, product_tag, category_tag
+from api_http import conditional, parse_ids, require_api_token, stream_ndjson, wants_ndjson
+from categories import category_tree
+from facets import facet_counts, catalog_facet_counts, pinned_facet_counts, price_bucket, rating_bucket, FACET_PARAMS, FACET_TITLES
 from flask_restful import Api, Resource
 from flask_cors import CORS
-from datetime import datetime
 import os
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ecommerce.db'
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+bp = Blueprint('shop', __name__)
 
-# Initialize database
-db.init_app(app)
-
-# Initialize login manager
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
+login_manager.login_view = 'shop.login'
+
+# RESTful API
+api = Api(bp)
 
-# Initialize RESTful API
-api = Api(app)
-CORS(app)  # Enable CORS for frontend frameworks
+@bp.app_context_processor
+def inject_cart_summary():
+    # Called from the navbar, so pages that never render it pay nothing
+    def cart_summary():
+        if not current_user.is_authenticated:
+            return 0, 0.0
+        return cart_store.summary(current_user.id)
+    return {'cart_summary': cart_summary}
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return user_cache.get(int(user_id))
+
+HOME_RANKING_SIZE = 5
+RELATED_ON_PAGE = 4
+
+def _page_size():
+    limit = request.args.get('limit', current_app.config['PRODUCTS_PER_PAGE'], type=int)
+    return max(1, min(limit, current_app.config['MAX_PAGE_SIZE']))
+
+def _rating_tags():
+    if request.args.get('sort') == 'rating' or request.args.get('min_rating'):
+        return {RATINGS_TAG}
+    return set()
+
+def _listing_tags(**kwargs):
+    return {CATALOG_TAG} | _rating_tags()
+
+MAX_CATEGORY_TAGS = 50
+
+def _search_tags(**kwargs):
+    # A category filter limits what the page can show to that category and
+    # its subcategories; very large subtrees just depend on the whole catalog
+    category = request.args.get('category')
+    if not category:
+        return {CATALOG_TAG} | _rating_tags()
+    tags = {category_tag(category), CATEGORIES_TAG}
+    node = category_tree.find(category)
+    if node is not None:
+        subtree = category_tree.descendant_ids(node.id)
+        if len(subtree) > MAX_CATEGORY_TAGS:
+            tags.add(CATALOG_TAG)
+        else:
+            tags.update(category_tag(cid) for cid in subtree)
+        tags.add(category_tag(node.name))
+    return tags | _rating_tags()
+
+def _product_tags(product_id, **kwargs):
+    return {product_tag(product_id), CATEGORIES_TAG}
 
-@app.route('/')
+@bp.route('/')
+@cached(_listing_tags)
 def home():
-    products = Product.query.all()
-    return render_template('index.html', products=products)
+    sort_by = request.args.get('sort', 'newest')
+    try:
+        page = paginate_products(Product.query, sort=sort_by,
+                                 cursor=request.args.get('cursor'),
+                                 limit=_page_size())
+    except InvalidCursor:
+        return redirect(url_for('.home'))
+    categories = catalog_facet_counts(['category'])['category']
+    # Merchandising strips, on the first page only
+    bestsellers = trending = []
+    if not request.args.get('cursor'):
+        bestsellers = rankings.top('bestsellers', limit=HOME_RANKING_SIZE)
+        trending = rankings.top('trending', limit=HOME_RANKING_SIZE)
+    return render_template('index.html', products=page.items, page=page, categories=categories,
+                           bestsellers=bestsellers, trending=trending)
 
-@app.route('/login', methods=['GET', 'POST'])
+@bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -40,15 +109,19 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            # Bring hashes made with older settings up to date
+            if passwords.needs_rehash(user.password_hash):
+                user.set_password(password)
+                db.session.commit()
             login_user(user)
             flash('Logged in successfully!', 'success')
-            return redirect(url_for('home'))
+            return redirect(url_for('.home'))
         else:
             flash('Invalid username or password', 'danger')
     
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@bp.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form.get('username')
@@ -57,11 +130,11 @@ def register():
         
         if User.query.filter_by(username=username).first():
             flash('Username already exists', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('.register'))
         
         if User.query.filter_by(email=email).first():
             flash('Email already exists', 'danger')
-            return redirect(url_for('register'))
+            return redirect(url_for('.register'))
         
         user = User(username=username, email=email)
         user.set_password(password)
@@ -69,158 +142,204 @@ def register():
         db.session.commit()
         
         flash('Registration successful! Please login.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('.login'))
     
     return render_template('register.html')
 
-@app.route('/logout')
+@bp.errorhandler(HashingBusy)
+def hashing_busy(e):
+    flash('We are handling a lot of sign-ins right now. Please try again in a moment.', 'warning')
+    template = 'register.html' if request.endpoint == 'shop.register' else 'login.html'
+    return render_template(template), 503, {'Retry-After': '2'}
+
+@bp.route('/logout')
 @login_required
 def logout():
     logout_user()
     flash('Logged out successfully!', 'success')
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
-@app.route('/cart')
+@bp.route('/cart')
 @login_required
 def cart():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
+    cart_items = cart_store.lines(current_user.id)
     total = sum(item.get_total() for item in cart_items)
     return render_template('cart.html', cart_items=cart_items, total=total)
 
-@app.route('/add_to_cart/<int:product_id>', methods=['POST'])
+@bp.route('/add_to_cart/<int:product_id>', methods=['POST'])
 @login_required
 def add_to_cart(product_id):
-    product = Product.query.get_or_404(product_id)
+    Product.query.get_or_404(product_id)
     quantity = int(request.form.get('quantity', 1))
     
-    if quantity > product.stock:
+    # Hold the units now so they can't sell out before checkout
+    try:
+        if quantity < 1:
+            raise InsufficientStock(product_id, 0)
+        stock_holds.hold(current_user.id, product_id, quantity)
+    except InsufficientStock:
         flash('Not enough stock available', 'danger')
-        return redirect(url_for('home'))
+        return redirect(url_for('.home'))
     
-    cart_item = CartItem.query.filter_by(
-        user_id=current_user.id,
-        product_id=product_id
-    ).first()
-    
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        cart_item = CartItem(
-            user_id=current_user.id,
-            product_id=product_id,
-            quantity=quantity
-        )
-        db.session.add(cart_item)
-    
-    db.session.commit()
+    cart_store.add(current_user.id, product_id, quantity)
     flash('Product added to cart!', 'success')
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
-@app.route('/remove_from_cart/<int:cart_item_id>')
+@bp.route('/remove_from_cart/<int:product_id>')
 @login_required
-def remove_from_cart(cart_item_id):
-    cart_item = CartItem.query.get_or_404(cart_item_id)
-    if cart_item.user_id != current_user.id:
-        flash('Unauthorized action', 'danger')
-        return redirect(url_for('cart'))
-    
-    db.session.delete(cart_item)
-    db.session.commit()
+def remove_from_cart(product_id):
+    stock_holds.release(current_user.id, product_id)
+    cart_store.remove(current_user.id, product_id)
     flash('Product removed from cart!', 'success')
-    return redirect(url_for('cart'))
+    return redirect(url_for('.cart'))
 
-@app.route('/checkout')
+@bp.route('/checkout')
 @login_required
 def checkout():
-    cart_items = CartItem.query.filter_by(user_id=current_user.id).all()
-    if not cart_items:
-        flash('Your cart is empty!', 'warning')
-        return redirect(url_for('cart'))
+    try:
+        place_order(current_user.id)
+    except EmptyCartError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('.cart'))
+    except OutOfStockError as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('.cart'))
     
-    total = sum(item.get_total() for item in cart_items)
-    
-    # Create order
-    order = Order(
-        user_id=current_user.id,
-        total_amount=total
-    )
-    db.session.add(order)
-    
-    # Create order items and update stock
-    for cart_item in cart_items:
-        if cart_item.quantity > cart_item.product.stock:
-            flash('Not enough stock available', 'danger')
-            return redirect(url_for('cart'))
-        
-        order_item = OrderItem(
-            order_id=order.id,
-            product_id=cart_item.product_id,
-            quantity=cart_item.quantity,
-            price=cart_item.product.price
-        )
-        db.session.add(order_item)
-        
-        # Update stock
-        cart_item.product.stock -= cart_item.quantity
-    
-    # Clear cart
-    for cart_item in cart_items:
-        db.session.delete(cart_item)
-    
-    db.session.commit()
     flash('Order placed successfully!', 'success')
-    return redirect(url_for('home'))
+    return redirect(url_for('.home'))
 
 # Search route with filters
-@app.route('/search')
+@bp.app_template_global()
+def facet_url(facet, value):
+    """Current search URL with ``facet`` toggled to ``value``."""
+    args = request.args.to_dict()
+    # A different result set starts from its first page
+    args.pop('cursor', None)
+    args.pop('page', None)
+    param = FACET_PARAMS[facet]
+    if value.selected:
+        args.pop(param, None)
+    else:
+        args[param] = value.value
+    return url_for('.search', **args)
+
+bp.add_app_template_global(FACET_TITLES, 'FACET_TITLES')
+
+def _search_page_url(**position):
+    """Current search URL at another page (``cursor=`` or, for relevance, ``page=``)."""
+    args = {k: v for k, v in request.args.to_dict().items() if k not in ('cursor', 'page')}
+    args.update((k, v) for k, v in position.items() if v is not None)
+    return url_for('.search', **args)
+
+@bp.route('/search')
+@read_replica
+@cached(_search_tags)
 def search():
     query = request.args.get('q', '')
     category = request.args.get('category', '')
+    brand = request.args.get('brand', '')
     min_price = request.args.get('min_price', type=float)
     max_price = request.args.get('max_price', type=float)
+    price_range = request.args.get('price_bucket', type=int)
+    min_rating = request.args.get('min_rating', type=float)
+    rating = request.args.get('rating', type=int)
+    featured = request.args.get('featured', type=int)
     sort_by = request.args.get('sort', 'name')
     
     products = Product.query
     
     if query:
-        products = products.filter(Product.name.contains(query) | 
-                                 Product.description.contains(query))
+        products = get_search_backend().apply(products, query)
     
+    # Filters grouped by the facet they belong to
+    filters = {}
     if category:
-        products = products.filter(Product.category == category)
+        filters.setdefault('category', []).append(category_tree.product_filter(category))
+    
+    if brand:
+        filters.setdefault('brand', []).append(Product.brand == brand)
     
     if min_price:
-        products = products.filter(Product.price >= min_price)
+        filters.setdefault('price', []).append(Product.price >= min_price)
     
     if max_price:
-        products = products.filter(Product.price <= max_price)
-    
-    # Sort products
-    if sort_by == 'price_asc':
-        products = products.order_by(Product.price.asc())
-    elif sort_by == 'price_desc':
-        products = products.order_by(Product.price.desc())
-    elif sort_by == 'name':
-        products = products.order_by(Product.name.asc())
-    
-    products = products.all()
+        filters.setdefault('price', []).append(Product.price <= max_price)
+    
+    if price_range is not None:
+        filters.setdefault('price', []).append(price_bucket() == price_range)
+    
+    if min_rating:
+        filters.setdefault('rating', []).append(Product.rating_avg >= min_rating)
+    
+    if rating is not None:
+        filters.setdefault('rating', []).append(rating_bucket() == rating)
+    
+    if featured is not None:
+        filters.setdefault('featured', []).append(Product.is_featured == bool(featured))
+    
+    selected = {'category': category, 'brand': brand, 'price': price_range,
+                'rating': rating, 'featured': featured}
+    # Filters that are exactly "facet = value" (a category also takes in its subcategories)
+    exact = {'brand': brand or None, 'price': price_range, 'rating': rating,
+             'featured': None if featured is None else int(bool(featured))}
+    pinned = None
+    if not query and len(filters) == 1:
+        (name, conditions), = filters.items()
+        if len(conditions) == 1 and exact.get(name) is not None:
+            pinned = pinned_facet_counts(name, exact[name], selected=selected)
+    if pinned is not None:
+        facets, total = pinned
+    elif query or filters:
+        facets = facet_counts(products, filters, selected=selected)
+    else:
+        facets = catalog_facet_counts(selected=selected)
+    
+    filtered = Product.query
+    for conditions in filters.values():
+        products = products.filter(*conditions)
+        filtered = filtered.filter(*conditions)
+    
+    if pinned is None:
+        total = db.session.execute(products.with_entities(db.func.count(Product.id)).order_by(None).statement).scalar()
+    
+    # One page of results: by relevance from the search index, otherwise keyset-paginated
+    limit = _page_size()
+    if query and sort_by == 'relevance':
+        number = max(request.args.get('page', 1, type=int), 1)
+        items = get_search_backend().ranked(filtered, query, (number - 1) * limit, limit + 1)
+        prev_url = _search_page_url(page=number - 1) if number > 1 else None
+        next_url = _search_page_url(page=number + 1) if len(items) > limit else None
+        items = items[:limit]
+    else:
+        try:
+            page = paginate_products(products, sort=sort_by, cursor=request.args.get('cursor'), limit=limit)
+        except InvalidCursor:
+            return redirect(_search_page_url())
+        items = page.items
+        prev_url = _search_page_url(cursor=page.prev_cursor) if page.has_prev else None
+        next_url = _search_page_url(cursor=page.next_cursor) if page.has_next else None
     
     return render_template('search_results.html', 
-                         products=products, 
+                         products=items, 
+                         total=total,
+                         prev_url=prev_url,
+                         next_url=next_url,
+                         facets=facets,
                          query=query, 
                          category=category,
                          min_price=min_price,
                          max_price=max_price,
+                         min_rating=min_rating,
                          sort_by=sort_by)
 
 # Wishlist routes
-@app.route('/wishlist')
+@bp.route('/wishlist')
 @login_required
 def wishlist():
-    wishlist_items = Wishlist.query.filter_by(user_id=current_user.id).all()
+    wishlist_items = wishlist_items_for(current_user.id)
     return render_template('wishlist.html', wishlist_items=wishlist_items)
 
-@app.route('/add_to_wishlist/<int:product_id>', methods=['POST'])
+@bp.route('/add_to_wishlist/<int:product_id>', methods=['POST'])
 @login_required
 def add_to_wishlist(product_id):
     product = Product.query.get_or_404(product_id)
@@ -236,7 +355,7 @@ def add_to_wishlist(product_id):
     
     return jsonify({'success': True, 'message': 'Added to wishlist'})
 
-@app.route('/remove_from_wishlist/<int:product_id>', methods=['POST'])
+@bp.route('/remove_from_wishlist/<int:product_id>', methods=['POST'])
 @login_required
 def remove_from_wishlist(product_id):
     wishlist_item = Wishlist.query.filter_by(user_id=current_user.id, product_id=product_id).first()
@@ -248,7 +367,7 @@ def remove_from_wishlist(product_id):
     return jsonify({'success': False, 'message': 'Product not in wishlist'})
 
 # Product review routes
-@app.route('/add_review/<int:product_id>', methods=['POST'])
+@bp.route('/add_review/<int:product_id>', methods=['POST'])
 @login_required
 def add_review(product_id):
     product = Product.query.get_or_404(product_id)
@@ -257,7 +376,7 @@ def add_review(product_id):
     existing_review = ProductReview.query.filter_by(user_id=current_user.id, product_id=product_id).first()
     if existing_review:
         flash('You have already reviewed this product', 'warning')
-        return redirect(url_for('product_detail', product_id=product_id))
+        return redirect(url_for('.product_detail', product_id=product_id))
     
     rating = int(request.form.get('rating'))
     title = request.form.get('title', '')
@@ -265,7 +384,7 @@ def add_review(product_id):
     
     if rating < 1 or rating > 5:
         flash('Rating must be between 1 and 5 stars', 'danger')
-        return redirect(url_for('product_detail', product_id=product_id))
+        return redirect(url_for('.product_detail', product_id=product_id))
     
     review = ProductReview(
         user_id=current_user.id,
@@ -279,79 +398,231 @@ def add_review(product_id):
     db.session.commit()
     
     flash('Review added successfully!', 'success')
-    return redirect(url_for('product_detail', product_id=product_id))
+    return redirect(url_for('.product_detail', product_id=product_id))
 
 # Enhanced product detail route
-@app.route('/product/<int:product_id>')
+@bp.route('/product/<int:product_id>')
+@cached(_product_tags)
 def product_detail(product_id):
     product = Product.query.get_or_404(product_id)
-    reviews = ProductReview.query.filter_by(product_id=product_id).order_by(ProductReview.created_at.desc()).all()
+    reviews = reviews_for_product(product_id)
     
-    # Check if user has this in wishlist
+    # Per-user flags, from one query per request
     in_wishlist = False
-    user_review = None
+    reviewed = False
     if current_user.is_authenticated:
-        in_wishlist = Wishlist.query.filter_by(user_id=current_user.id, product_id=product_id).first() is not None
-        user_review = ProductReview.query.filter_by(user_id=current_user.id, product_id=product_id).first()
+        wishlisted, reviewed_ids = user_product_flags(current_user.id)
+        in_wishlist = product_id in wishlisted
+        reviewed = product_id in reviewed_ids
     
     return render_template('product_detail.html', 
                          product=product, 
+                         breadcrumbs=category_tree.path(product.category_id),
                          reviews=reviews,
                          in_wishlist=in_wishlist,
-                         user_review=user_review)
+                         reviewed=reviewed,
+                         related=recommendations.related_products(product_id, limit=RELATED_ON_PAGE))
 
 # Update cart quantity
-@app.route('/update_cart/<int:cart_item_id>', methods=['POST'])
+@bp.route('/update_cart/<int:product_id>', methods=['POST'])
 @login_required
-def update_cart(cart_item_id):
-    cart_item = CartItem.query.get_or_404(cart_item_id)
-    if cart_item.user_id != current_user.id:
-        return jsonify({'success': False, 'message': 'Unauthorized'})
-    
-    new_quantity = int(request.form.get('quantity', 1))
-    
-    if new_quantity <= 0:
-        db.session.delete(cart_item)
-    elif new_quantity > cart_item.product.stock:
+def update_cart(product_id):
+    new_quantity = request.form.get('quantity', type=int)
+    if new_quantity is None or new_quantity < 0:
+        return jsonify({'success': False, 'message': 'Quantity must be a whole number of 0 or more'}), 400
+    if (product_id not in cart_store.items(current_user.id)
+            or db.session.get(Product, product_id) is None):
+        return jsonify({'success': False, 'message': 'Product is not in your cart'}), 404
+    
+    try:
+        stock_holds.set(current_user.id, product_id, new_quantity)
+    except InsufficientStock:
         return jsonify({'success': False, 'message': 'Not enough stock'})
-    else:
-        cart_item.quantity = new_quantity
     
-    db.session.commit()
+    cart_store.set(current_user.id, product_id, new_quantity)
     return jsonify({'success': True, 'message': 'Cart updated'})
 
-# Search route with filters
+PRODUCT_API_FIELDS = ('id', 'name', 'description', 'price', 'stock', 'image_url', 'category')
+
+def serialize_product(product):
+    return {field: getattr(product, field) for field in PRODUCT_API_FIELDS}
+
+def serialize_lookup(products, ids):
+    # Found products in the order asked for, plus the ids that don't exist
+    found = {product.id: product for product in products}
+    return {'products': [serialize_product(found[i]) for i in ids if i in found],
+            'missing': [i for i in ids if i not in found]}
+
+# Shared with the async catalog API (async_api.py)
+def catalog_version_query():
+    # Bumped with every commit that invalidates CATALOG_TAG (see cache.py)
+    return db.select(CatalogVersion.version).where(CatalogVersion.id == CATALOG_VERSION_ID)
+
+def product_version_query(product_id):
+    return db.select(Product.updated_at).where(Product.id == product_id)
+
+def catalog_export_query():
+    columns = [getattr(Product, field) for field in PRODUCT_API_FIELDS]
+    return db.select(*columns).order_by(Product.id).execution_options(yield_per=1000)
+
+def _catalog_version(**kwargs):
+    return db.session.execute(catalog_version_query()).scalar()
+
+def _product_version(product_id, **kwargs):
+    return db.session.execute(product_version_query(product_id)).scalar()
+
+def _stream_catalog():
+    rows = db.session.execute(catalog_export_query())
+    return stream_ndjson(row._asdict() for row in rows)
+
 class ProductListAPI(Resource):
+    method_decorators = [cached(_listing_tags, anonymous_only=False, vary=('Accept',)),
+                         conditional(_catalog_version),
+                         read_replica]
+
     def get(self):
-        products = Product.query.all()
-        return [{
-            'id': p.id,
-            'name': p.name,
-            'description': p.description,
-            'price': p.price,
-            'stock': p.stock,
-            'image_url': p.image_url,
-            'category': p.category
-        } for p in products]
+        # Batch lookup (?ids=1,2,3) in a single IN query
+        if request.args.get('ids') is not None:
+            try:
+                ids = parse_ids(request.args['ids'], current_app.config['MAX_PAGE_SIZE'])
+            except ValueError as e:
+                return {'message': str(e)}, 400
+            return serialize_lookup(Product.query.filter(Product.id.in_(ids)), ids)
+        
+        # Full catalog export, streamed from a server-side cursor
+        if wants_ndjson():
+            return _stream_catalog()
+        
+        try:
+            page = paginate_products(Product.query,
+                                     sort=request.args.get('sort', 'newest'),
+                                     cursor=request.args.get('cursor'),
+                                     limit=_page_size())
+        except InvalidCursor as e:
+            return {'message': str(e)}, 400
+        return {
+            'products': [serialize_product(p) for p in page.items],
+            'sort': page.sort,
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor
+        }
 
 class ProductAPI(Resource):
+    method_decorators = [cached(_product_tags, anonymous_only=False),
+                         conditional(_product_version),
+                         read_replica]
+
     def get(self, product_id):
         product = Product.query.get_or_404(product_id)
-        return {
-            'id': product.id,
-            'name': product.name,
-            'description': product.description,
-            'price': product.price,
-            'stock': product.stock,
-            'image_url': product.image_url,
-            'category': product.category
-        }
+        return serialize_product(product)
+
+class ProductRankingAPI(Resource):
+    method_decorators = [read_replica]
+
+    def get(self, ranking):
+        if ranking not in RANKINGS:
+            return {'message': f"Unknown ranking; use one of: {', '.join(RANKINGS)}"}, 404
+        category_id = request.args.get('category_id', type=int)
+        if category_id is not None and category_tree.get(category_id) is None:
+            return {'message': 'Unknown category'}, 404
+        limit = max(1, min(request.args.get('limit', 10, type=int), rankings.size))
+        top = rankings.top(ranking, category_id=category_id, limit=limit)
+        return {'ranking': ranking,
+                'category_id': category_id,
+                'products': [dict(serialize_product(product), score=round(score, 3)) for product, score in top]}
+
+class ProductRelatedAPI(Resource):
+    method_decorators = [read_replica]
+
+    def get(self, product_id):
+        limit = max(1, min(request.args.get('limit', 10, type=int), recommendations.size))
+        ranked = recommendations.related(product_id, limit)
+        # The product and its neighbours in one IN query
+        found = {p.id: p for p in Product.query.filter(Product.id.in_([product_id] + [pid for pid, _ in ranked]))}
+        if product_id not in found:
+            return {'message': 'Product not found'}, 404
+        return {'product_id': product_id,
+                'products': [dict(serialize_product(found[pid]), score=round(score, 4))
+                             for pid, score in ranked if pid in found]}
+
+class ProductBatchAPI(Resource):
+    method_decorators = [require_api_token]
+
+    def patch(self):
+        # A list of {"id", "price", "stock"} items, bare or as {"items": [...]}
+        items = request.get_json(silent=True)
+        if isinstance(items, dict):
+            items = items.get('items')
+        if not isinstance(items, list):
+            return {'message': 'Expected a JSON list of items or {"items": [...]}'}, 400
+        try:
+            results = apply_product_updates(items, current_app.config['API_BATCH_MAX'])
+        except BatchTooLarge as e:
+            return {'message': str(e)}, 413
+        return {'results': results,
+                'updated': sum(result['status'] == 'updated' for result in results)}
+
+    post = patch
 
 # Register API routes
 api.add_resource(ProductListAPI, '/api/products')
 api.add_resource(ProductAPI, '/api/products/<int:product_id>')
+api.add_resource(ProductBatchAPI, '/api/products:batch')
+api.add_resource(ProductRankingAPI, '/api/rankings/<string:ranking>')
+api.add_resource(ProductRelatedAPI, '/api/products/<int:product_id>/related')
+
+# Job queue depth and lag
+@bp.route('/metrics/jobs')
+@require_metrics_token
+def job_metrics():
+    return jsonify(queue_stats())
+
+# Liveness: the process is up and serving
+@bp.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# Readiness: every configured database answers
+@bp.route('/readyz')
+def readyz():
+    checks = {}
+    for name, engine in db.engines.items():
+        try:
+            with engine.connect() as conn:
+                conn.execute(db.text('SELECT 1'))
+            checks[name or 'default'] = 'ok'
+        except Exception as e:
+            checks[name or 'default'] = repr(e)
+    ready = all(result == 'ok' for result in checks.values())
+    return jsonify({'status': 'ready' if ready else 'unavailable', 'checks': checks}), 200 if ready else 503
+
+def create_app(config=None):
+    """Build the application; ``config`` is a config object or import path."""
+    app = Flask(__name__)
+    app.config.from_object(config or os.environ.get('ECOMMERCE_CONFIG', 'config.Config'))
+
+    # Initialize database
+    db.init_app(app)
+    init_database(app)
+    instrumentation.init_app(app)
+    cache.init_app(app)
+    cart_store.init_app(app)
+    stock_holds.init_app(app)
+    job_queue.init_app(app)
+    user_cache.init_app(app)
+    passwords.init_app(app)
+    rate_limiter.init_app(app)
+    rankings.init_app(app)
+    recommendations.init_app(app)
+
+    login_manager.init_app(app)
+    app.register_blueprint(bp)
+    CORS(app)  # Enable CORS for frontend frameworks
+    return app
 
 if __name__ == '__main__':
+    # Development server; see serve.py for production
+    app = create_app()
     with app.app_context():
         db.create_all()
-    app.run(debug=True, port=5002)
\ No newline at end of file
+    app.run(debug=True, port=5002)
@@ -0,0 +1,261 @@
+"""
+Async read path for the catalog API.
+
+``create_async_app()`` builds an ASGI application that serves the same
+read-only endpoints as the Flask resources in app.py::
+
+    GET /api/products            keyset-paginated listing, ?ids= lookup or the NDJSON export
+    GET /api/products/<id>
+    GET /api/products/<id>/related
+
+It returns the same JSON, cursors, ETags and compression, but runs on
+SQLAlchemy's asyncio engine (aiosqlite for SQLite, asyncpg for PostgreSQL).
+A request that is waiting on the database holds a coroutine instead of a
+thread, so one process keeps many catalog reads in flight. Run it under any
+ASGI server and route ``/api/products`` to it::
+
+    pip install aiosqlite uvicorn
+    uvicorn --factory async_api:create_async_app --port 8001 --workers 4
+
+Reads go to the replica when ``DATABASE_REPLICA_URL`` is set. The response
+cache isn't consulted; unchanged resources are still answered with ``304``
+from the version query alone. ``python benchmark.py --compare-async``
+measures this path against the sync one.
+"""
+
+import json
+import re
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine
+from werkzeug.datastructures import Headers
+from werkzeug.http import quote_etag
+from werkzeug.sansio.request import Request
+
+from api_http import (MIN_COMPRESS_SIZE, NDJSON_MIMETYPE, chunk_compressor, compress_body, encode_ndjson,
+                      make_etag, negotiate_encoding, parse_ids, wants_ndjson)
+from app import (PRODUCT_API_FIELDS, catalog_export_query, catalog_version_query, create_app,
+                 product_version_query, serialize_lookup, serialize_product)
+from config import engine_options
+from database import apply_sqlite_pragmas
+from models import db, Product
+from pagination import InvalidCursor, Keyset
+from recommendations import recommendations
+
+ASYNC_DRIVERS = {'sqlite': 'aiosqlite', 'postgresql': 'asyncpg', 'mysql': 'aiomysql'}
+
+# Endpoint names of the sync resources, so both paths hand out the same ETags
+LIST_ENDPOINT = 'shop.productlistapi'
+DETAIL_ENDPOINT = 'shop.productapi'
+DETAIL_PATH = re.compile(r'/api/products/(\d+)')
+RELATED_PATH = re.compile(r'/api/products/(\d+)/related')
+
+NOT_FOUND = ('The requested URL was not found on the server. If you entered the URL manually '
+             'please check your spelling and try again.')
+EXPORT_BATCH = 500
+
+PRODUCT_COLUMNS = [getattr(Product, field) for field in PRODUCT_API_FIELDS]
+
+
+def async_url(url):
+    """The asyncio-driver equivalent of a sync engine URL."""
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f'No asyncio driver known for {backend!r} databases')
+    return url.set(drivername=f'{backend}+{ASYNC_DRIVERS[backend]}')
+
+
+class Response:
+    def __init__(self, body=b'', status=200, mimetype='application/json'):
+        self.body = body
+        self.status = status
+        self.headers = Headers()
+        if mimetype:
+            self.headers['Content-Type'] = mimetype
+
+
+def json_response(data, status=200):
+    return Response(json.dumps(data, sort_keys=True, separators=(',', ':')).encode() + b'\n', status)
+
+
+def _request(scope):
+    headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope['headers']])
+    client = scope.get('client') or (None,)
+    return Request(scope['method'], scope.get('scheme', 'http'), scope.get('server'), scope.get('root_path', ''),
+                   scope['path'], scope['query_string'], headers, client[0])
+
+
+async def _catalog_version(conn):
+    return (await conn.execute(catalog_version_query())).scalar()
+
+
+async def _product_version(conn, product_id):
+    return (await conn.execute(product_version_query(product_id))).scalar()
+
+
+class CatalogAPI:
+    def __init__(self, engine, config):
+        self.engine = engine
+        self.per_page = config['PRODUCTS_PER_PAGE']
+        self.max_page_size = config['MAX_PAGE_SIZE']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            response = await self.dispatch(_request(scope))
+            await self._send(response, scope['method'] == 'HEAD', send)
+
+    async def dispatch(self, request):
+        if request.path == '/api/products':
+            route = (LIST_ENDPOINT, _catalog_version, self.product_list, {})
+        elif (match := DETAIL_PATH.fullmatch(request.path)):
+            route = (DETAIL_ENDPOINT, _product_version, self.product, {'product_id': int(match[1])})
+        elif (match := RELATED_PATH.fullmatch(request.path)):
+            # Neighbours change with rebuilds, not with the product; no ETag, as in app.py
+            route = (None, None, self.related, {'product_id': int(match[1])})
+        else:
+            return json_response({'message': NOT_FOUND}, 404)
+        if request.method not in ('GET', 'HEAD'):
+            response = json_response({'message': 'The method is not allowed for the requested URL.'}, 405)
+            response.headers['Allow'] = 'GET, HEAD'
+            return response
+        async with self.engine.connect() as conn:
+            return await self._conditional(conn, request, *route)
+
+    async def _conditional(self, conn, request, endpoint, version, view, kwargs):
+        if version is None:
+            return await view(conn, request, encoding=None, **kwargs)
+        # Same ETag and compression rules as api_http.conditional
+        encoding = negotiate_encoding(request)
+        query = sorted(request.args.items(multi=True))
+        etag = make_etag(endpoint, await version(conn, **kwargs), query, wants_ndjson(request))
+        if encoding:
+            etag = f'{etag}-{encoding}'
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304, mimetype=None)
+        else:
+            response = await view(conn, request, encoding=encoding, **kwargs)
+            if response.status != 200:
+                return response
+            if encoding and isinstance(response.body, bytes) and len(response.body) >= MIN_COMPRESS_SIZE:
+                response.body = compress_body(response.body, encoding)
+                response.headers['Content-Encoding'] = encoding
+
+        response.headers['ETag'] = quote_etag(etag)
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    async def product_list(self, conn, request, encoding):
+        if request.args.get('ids') is not None:
+            try:
+                ids = parse_ids(request.args['ids'], self.max_page_size)
+            except ValueError as e:
+                return json_response({'message': str(e)}, 400)
+            rows = (await conn.execute(select(*PRODUCT_COLUMNS).where(Product.id.in_(ids)))).all()
+            return json_response(serialize_lookup(rows, ids))
+
+        # Full catalog export, streamed from a server-side cursor
+        if wants_ndjson(request):
+            response = Response(self._export(encoding), mimetype=NDJSON_MIMETYPE)
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+            return response
+
+        try:
+            keyset = Keyset(request.args.get('sort', 'newest'), request.args.get('cursor'))
+        except InvalidCursor as e:
+            return json_response({'message': str(e)}, 400)
+        limit = request.args.get('limit', self.per_page, type=int)
+        limit = max(1, min(limit, self.max_page_size))
+
+        columns = list(PRODUCT_COLUMNS)
+        if keyset.column.key not in PRODUCT_API_FIELDS:
+            columns.append(keyset.column)
+        rows = (await conn.execute(keyset.apply(select(*columns), limit))).all()
+        page = keyset.page(rows, limit)
+        return json_response({
+            'products': [serialize_product(row) for row in page.items],
+            'sort': page.sort,
+            'next_cursor': page.next_cursor,
+            'prev_cursor': page.prev_cursor
+        })
+
+    async def product(self, conn, request, encoding, product_id):
+        row = (await conn.execute(select(*PRODUCT_COLUMNS).where(Product.id == product_id))).first()
+        if row is None:
+            return json_response({'message': NOT_FOUND}, 404)
+        return json_response(serialize_product(row))
+
+    async def related(self, conn, request, encoding, product_id):
+        limit = max(1, min(request.args.get('limit', 10, type=int), recommendations.size))
+        ranked = recommendations.related(product_id, limit)
+        ids = [product_id] + [pid for pid, _ in ranked]
+        found = {row.id: row for row in (await conn.execute(select(*PRODUCT_COLUMNS).where(Product.id.in_(ids))))}
+        if product_id not in found:
+            return json_response({'message': 'Product not found'}, 404)
+        return json_response({'product_id': product_id,
+                              'products': [dict(serialize_product(found[pid]), score=round(score, 4))
+                                           for pid, score in ranked if pid in found]})
+
+    async def _export(self, encoding):
+        compress = flush = None
+        if encoding:
+            compress, flush = chunk_compressor(encoding)
+        # Its own connection: the body is sent after dispatch() has returned
+        async with self.engine.connect() as conn:
+            result = await conn.stream(catalog_export_query())
+            async for rows in result.partitions(EXPORT_BATCH):
+                data = encode_ndjson(row._asdict() for row in rows)
+                if compress is not None:
+                    data = compress(data)
+                if data:
+                    yield data
+        if flush is not None:
+            yield flush()
+
+    async def _send(self, response, head, send):
+        headers = [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in response.headers.items()]
+        headers.append((b'access-control-allow-origin', b'*'))
+        body = response.body
+        if isinstance(body, bytes):
+            headers.append((b'content-length', str(len(body)).encode()))
+            await send({'type': 'http.response.start', 'status': response.status, 'headers': headers})
+            await send({'type': 'http.response.body', 'body': b'' if head else body})
+            return
+
+        await send({'type': 'http.response.start', 'status': response.status, 'headers': headers})
+        try:
+            if not head:
+                async for chunk in body:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            await body.aclose()
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+def create_async_app(config=None):
+    """Build the ASGI catalog API from the same configuration as ``create_app``."""
+    app = create_app(config)
+    with app.app_context():
+        # Flask-SQLAlchemy has already resolved relative SQLite paths
+        # against the instance folder; read from the replica if there is one
+        url = (db.engines.get('replica') or db.engine).url
+    url = async_url(url)
+    engine = create_async_engine(url, **engine_options(url.render_as_string(hide_password=False)))
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    if url.get_backend_name() == 'sqlite' and pragmas:
+        apply_sqlite_pragmas(engine.sync_engine, pragmas)
+    return CatalogAPI(engine, app.config)
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Recompute the product_sales counters behind the best-seller and trending
+rankings from the order_item table.
+
+Run this after bulk-loading orders or upgrading an older database
+(``python migrate.py upgrade`` creates the table); new orders are counted
+as they are placed.
+"""
+
+from app import create_app
+from rankings import rebuild_sales
+
+def backfill_rankings():
+    with create_app().app_context():
+        products = rebuild_sales()
+        print(f'✅ Sales counters rebuilt for {products} products')
+
+if __name__ == '__main__':
+    backfill_rankings()
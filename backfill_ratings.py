@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+"""
+Recompute the denormalized review aggregates on products
+(rating_sum, rating_count, rating_avg) from the product_reviews table.
+
+Run this any time the aggregates may have drifted, e.g. after bulk-loading
+reviews. Older databases need ``python migrate.py upgrade`` first to add
+the columns.
+"""
+
+from app import create_app
+from models import backfill_rating_aggregates
+
+def backfill_ratings():
+    with create_app().app_context():
+        updated = backfill_rating_aggregates()
+        print(f'✅ Rating aggregates backfilled for {updated} products')
+
+if __name__ == '__main__':
+    backfill_ratings()
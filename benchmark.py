@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+Storefront benchmark.
+
+Seeds a database of the requested size (with generate_data.py), then runs
+virtual users against the app for a fixed time and reports latency
+percentiles and throughput per route:
+
+    python benchmark.py --products 100000 --users 20 --duration 30
+    python benchmark.py --mode server --users 50           # real WSGI server over HTTP
+    python benchmark.py --url http://127.0.0.1:8000        # e.g. serve.py on benchmark.db
+    python benchmark.py --save-baseline bench.json         # record a baseline
+    python benchmark.py --baseline bench.json --threshold 0.2   # exit 1 on a >20% p95 regression
+    python benchmark.py --compare-async --users 100       # sync vs. async catalog API (async_api.py)
+    python benchmark.py --login-storm 32                   # catalog latency while 32 clients log in
+
+Each virtual user loops over weighted scenarios: browse (home page, a product
+page, the product API), search, add-to-cart and checkout. ``--mode client``
+drives the app in-process through Flask's test client; ``--mode server``
+starts a threaded Werkzeug server and talks to it over HTTP, and ``--url``
+targets a server that is already running. The seeded database is reused on
+later runs unless ``--reseed`` is given.
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib import error as urlerror
+from urllib import request as urlrequest
+from urllib.parse import urlencode
+
+SCENARIOS = {'browse': 50, 'search': 25, 'add_to_cart': 15, 'checkout': 10}
+SEARCH_TERMS = ['lamp', 'laptop', 'premium', 'wireless', 'mug', 'smart', 'novel', 'eco', 'jeans', 'head']
+PASSWORD = 'password123'
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the storefront routes')
+    parser.add_argument('--database', default=f"sqlite:///{os.path.abspath('benchmark.db')}",
+                        help='database URL to seed and benchmark against')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--accounts', type=int, default=1000, help='seeded user accounts')
+    parser.add_argument('--reseed', action='store_true', help='drop and regenerate the data')
+    parser.add_argument('--mode', choices=['client', 'server'], default='client')
+    parser.add_argument('--url', help='benchmark an already running server (e.g. serve.py) on the same database')
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds to run')
+    parser.add_argument('--warmup', type=float, default=2.0, help='seconds excluded from the results')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help='comma-separated scenarios to run (%(default)s)')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--compare-async', action='store_true',
+                        help='compare the sync and async catalog API at --users concurrent reads')
+    parser.add_argument('--login-storm', type=int, default=0, metavar='LOGINS',
+                        help='measure catalog latency alone and with LOGINS clients logging in nonstop, '
+                             'hashing inline and then in the password pool')
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed relative p95 slowdown against the baseline')
+    return parser.parse_args()
+
+
+def seed(args, app):
+    from models import db, Product, User
+    import generate_data
+
+    with app.app_context():
+        db.create_all()
+        have = db.session.query(Product).count()
+        if have >= args.products and db.session.query(User).count() >= args.accounts and not args.reseed:
+            print(f'Using existing data ({have} products)')
+            return
+        generate_data.reset_data()
+        print(f'Seeding {args.products} products, {args.accounts} users...')
+        generate_data.generate(argparse.Namespace(
+            users=args.accounts, categories=max(args.products // 2000, 10), products=args.products,
+            reviews=args.products * 3, wishlists=args.accounts, carts=0, orders=args.products // 5,
+            batch_size=10000, seed=42, password_mode='fast',
+        ))
+
+
+def catalog(app):
+    from models import db, Product, User
+    with app.app_context():
+        product_ids = [pid for (pid,) in db.session.query(Product.id).filter(Product.stock > 0)]
+        usernames = [name for (name,) in db.session.query(User.username)]
+    return product_ids, usernames
+
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        response = self.client.open(path, method=method, data=data)
+        response.get_data()
+        return response.status_code
+
+
+class _NoRedirect(urlrequest.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPSession:
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urlrequest.build_opener(urlrequest.HTTPCookieProcessor(CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urlencode(data).encode() if data is not None else None
+        try:
+            with self.opener.open(urlrequest.Request(self.base_url + path, data=body, method=method)) as response:
+                response.read()
+                return response.status
+        except urlerror.HTTPError as e:
+            e.read()
+            return e.code
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.recording = False
+        self._lock = threading.Lock()
+
+    def record(self, label, elapsed, status):
+        if self.recording:
+            with self._lock:
+                self.samples.setdefault(label, []).append(elapsed)
+                if status is None or status >= 500:
+                    self.errors[label] = self.errors.get(label, 0) + 1
+
+    def timed(self, label, session, method, path, data=None):
+        started = time.perf_counter()
+        try:
+            status = session.request(method, path, data)
+        except Exception:
+            status = None
+        self.record(label, time.perf_counter() - started, status)
+        return status
+
+
+class VirtualUser:
+    def __init__(self, make_session, recorder, rng, product_ids, username):
+        self.make_session = make_session
+        self.recorder = recorder
+        self.rng = rng
+        self.product_ids = product_ids
+        self.username = username
+        self.anonymous = make_session()
+        self.shopper = None
+
+    def _logged_in(self):
+        if self.shopper is None:
+            self.shopper = self.make_session()
+            self.recorder.timed('login', self.shopper, 'POST', '/login',
+                                {'username': self.username, 'password': PASSWORD})
+        return self.shopper
+
+    def browse(self):
+        self.recorder.timed('home', self.anonymous, 'GET', '/')
+        self.recorder.timed('product_detail', self.anonymous, 'GET',
+                            f'/product/{self.rng.choice(self.product_ids)}')
+        self.recorder.timed('api_products', self.anonymous, 'GET', '/api/products?limit=24')
+
+    def search(self):
+        params = {'q': self.rng.choice(SEARCH_TERMS), 'sort': self.rng.choice(['relevance', 'price_asc'])}
+        self.recorder.timed('search', self.anonymous, 'GET', '/search?' + urlencode(params))
+
+    def add_to_cart(self):
+        self.recorder.timed('add_to_cart', self._logged_in(), 'POST',
+                            f'/add_to_cart/{self.rng.choice(self.product_ids)}', {'quantity': 1})
+
+    def checkout(self):
+        self.add_to_cart()
+        self.recorder.timed('checkout', self._logged_in(), 'GET', '/checkout')
+
+
+def run(args, app):
+    product_ids, usernames = catalog(app)
+    if not product_ids or not usernames:
+        sys.exit('No products or users to benchmark with')
+
+    server = None
+    if args.url:
+        make_session = lambda: HTTPSession(args.url.rstrip('/'))
+    elif args.mode == 'server':
+        from werkzeug.serving import WSGIRequestHandler, make_server
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_request(self, *args, **kwargs):
+                pass
+
+        server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base_url = f'http://127.0.0.1:{server.server_port}'
+        make_session = lambda: HTTPSession(base_url)
+    else:
+        make_session = lambda: TestClientSession(app)
+
+    names = [name for name in args.scenarios.split(',') if name]
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        sys.exit(f'Unknown scenarios: {", ".join(sorted(unknown))}')
+    weights = [SCENARIOS[name] for name in names]
+
+    recorder = Recorder()
+    deadline = time.perf_counter() + args.warmup + args.duration
+    master = random.Random(args.seed)
+    users = [VirtualUser(make_session, recorder, random.Random(master.random()),
+                         product_ids, usernames[i % len(usernames)]) for i in range(args.users)]
+
+    def loop(user):
+        while time.perf_counter() < deadline:
+            getattr(user, user.rng.choices(names, weights)[0])()
+
+    threads = [threading.Thread(target=loop, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    recorder.recording = True
+    measured_from = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - measured_from
+    if server is not None:
+        server.shutdown()
+    return summarize(recorder, elapsed)
+
+
+def catalog_reads(rng, product_ids):
+    """A random catalog API read: ``(label, path)``."""
+    if rng.random() < 0.5:
+        return 'api_products', '/api/products?' + urlencode({'limit': 24, 'sort': rng.choice(
+            ['newest', 'price_asc', 'rating'])})
+    return 'api_product', f'/api/products/{rng.choice(product_ids)}'
+
+
+async def asgi_get(app, path):
+    """Call an ASGI app in-process; returns the response status."""
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+             'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+             'root_path': '', 'headers': [(b'host', b'localhost')], 'server': ('localhost', 80),
+             'client': ('127.0.0.1', 0)}
+    status = None
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+
+    await app(scope, receive, send)
+    return status
+
+
+def compare_async(args, app):
+    """Catalog reads at ``--users`` in flight: sync resources on threads vs. async_api on one event loop."""
+    import asyncio
+    from async_api import create_async_app
+
+    product_ids, _ = catalog(app)
+    recorder, async_recorder = Recorder(), Recorder()
+
+    # Sync: one thread per in-flight request
+    deadline = time.perf_counter() + args.warmup + args.duration
+    master = random.Random(args.seed)
+
+    def loop(rng):
+        session = TestClientSession(app)
+        while time.perf_counter() < deadline:
+            label, path = catalog_reads(rng, product_ids)
+            recorder.timed(f'sync {label}', session, 'GET', path)
+
+    threads = [threading.Thread(target=loop, args=(random.Random(master.random()),)) for _ in range(args.users)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.warmup)
+    recorder.recording = True
+    measured_from = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    sync_elapsed = time.perf_counter() - measured_from
+
+    # Async: one task per in-flight request, all on this thread
+    async_app = create_async_app()
+
+    async def task(rng, deadline):
+        while time.perf_counter() < deadline:
+            label, path = catalog_reads(rng, product_ids)
+            started = time.perf_counter()
+            try:
+                status = await asgi_get(async_app, path)
+            except Exception:
+                status = None
+            async_recorder.record(f'async {label}', time.perf_counter() - started, status)
+
+    async def run_tasks():
+        deadline = time.perf_counter() + args.warmup + args.duration
+        tasks = [asyncio.create_task(task(random.Random(master.random()), deadline)) for _ in range(args.users)]
+        await asyncio.sleep(args.warmup)
+        async_recorder.recording = True
+        started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+        await async_app.engine.dispose()
+        return elapsed
+
+    async_elapsed = asyncio.run(run_tasks())
+    return {**summarize(recorder, sync_elapsed), **summarize(async_recorder, async_elapsed)}
+
+
+def login_storm(args, app):
+    """Catalog reads from ``--users`` threads: alone, then next to ``--login-storm`` login loops."""
+    from generate_data import FIXTURE_PASSWORD
+    from models import db, User
+    from passwords import passwords
+
+    product_ids, usernames = catalog(app)
+    usernames = usernames[:args.login_storm]
+    # Hash the login accounts with the current settings up front, so every
+    # phase measures plain verifies rather than first-login rehashes
+    with app.app_context():
+        db.session.query(User).filter(User.username.in_(usernames)).update(
+            {User.password_hash: passwords.hash(FIXTURE_PASSWORD)}, synchronize_session=False)
+        db.session.commit()
+
+    master = random.Random(args.seed)
+    pool_workers = passwords.workers
+    routes = {}
+    for phase, workers, logins in (('idle', pool_workers, 0), ('inline', 0, args.login_storm),
+                                   ('pool', pool_workers, args.login_storm)):
+        passwords.shutdown()
+        passwords.workers = workers
+        recorder = Recorder()
+        deadline = time.perf_counter() + args.warmup + args.duration
+
+        def read(rng):
+            session = TestClientSession(app)
+            while time.perf_counter() < deadline:
+                label, path = catalog_reads(rng, product_ids)
+                recorder.timed(f'{phase} {label}', session, 'GET', path)
+
+        def log_in(username):
+            session = TestClientSession(app)
+            while time.perf_counter() < deadline:
+                recorder.timed(f'{phase} login', session, 'POST', '/login',
+                               {'username': username, 'password': FIXTURE_PASSWORD})
+
+        threads = [threading.Thread(target=read, args=(random.Random(master.random()),))
+                   for _ in range(args.users)]
+        threads += [threading.Thread(target=log_in, args=(usernames[i % len(usernames)],)) for i in range(logins)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.warmup)
+        recorder.recording = True
+        measured_from = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        routes.update(summarize(recorder, time.perf_counter() - measured_from))
+    passwords.shutdown()
+    passwords.workers = pool_workers
+    return routes
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(recorder, elapsed):
+    routes = {}
+    for label, values in sorted(recorder.samples.items()):
+        values.sort()
+        routes[label] = {
+            'count': len(values),
+            'errors': recorder.errors.get(label, 0),
+            'rps': len(values) / elapsed,
+            'p50': percentile(values, 0.50) * 1000,
+            'p95': percentile(values, 0.95) * 1000,
+            'p99': percentile(values, 0.99) * 1000,
+        }
+    return routes
+
+
+def report(routes, baseline=None, threshold=0.2):
+    header = f"{'route':<20}{'count':>8}{'errors':>8}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    if baseline:
+        header += f"{'base p95':>10}{'change':>9}"
+    print(header)
+    print('-' * len(header))
+    regressions = []
+    for label, r in routes.items():
+        line = (f"{label:<20}{r['count']:>8}{r['errors']:>8}{r['rps']:>9.1f}"
+                f"{r['p50']:>9.1f}{r['p95']:>9.1f}{r['p99']:>9.1f}")
+        base = (baseline or {}).get(label)
+        if base:
+            change = (r['p95'] - base['p95']) / base['p95'] if base['p95'] else 0.0
+            flag = ''
+            if change > threshold:
+                flag = '  REGRESSION'
+                regressions.append(label)
+            line += f"{base['p95']:>10.1f}{change:>+9.0%}{flag}"
+        print(line)
+    return regressions
+
+
+def main():
+    args = parse_args()
+    # config.py reads the environment when it's imported
+    os.environ['DATABASE_URL'] = args.database
+    # Virtual users all come from one address; measure the app, not the limiter
+    os.environ['RATE_LIMIT_ENABLED'] = 'false'
+    if args.compare_async or args.login_storm:
+        # Compare database round trips, not response cache hits
+        os.environ['CACHE_BACKEND'] = 'null'
+    from app import create_app
+    app = create_app()
+    seed(args, app)
+
+    if args.compare_async:
+        print(f'Comparing sync and async catalog reads, {args.users} in flight, {args.duration:.0f}s each...')
+        routes = compare_async(args, app)
+    elif args.login_storm:
+        print(f'Catalog reads from {args.users} clients, alone and with {args.login_storm} clients logging in, '
+              f'{args.duration:.0f}s each...')
+        routes = login_storm(args, app)
+    else:
+        print(f'Running {args.users} virtual users for {args.duration:.0f}s '
+              f'({args.url or args.mode + " mode"})...')
+        routes = run(args, app)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['routes']
+    regressions = report(routes, baseline, args.threshold)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump({'args': {k: v for k, v in vars(args).items()
+                                if k not in ('save_baseline', 'baseline')},
+                       'routes': routes}, f, indent=2)
+        print(f'Baseline written to {args.save_baseline}')
+    if regressions:
+        print(f"p95 regressed by more than {args.threshold:.0%} on: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
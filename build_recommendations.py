@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Build the "customers also bought" neighbours (see recommendations.py).
+
+    python build_recommendations.py                # from the database
+    python build_recommendations.py --if-changed   # no-op unless orders/wishlists changed (for cron)
+    python build_recommendations.py --synthetic --products 1000000 --lines 10000000
+
+``--synthetic`` benchmarks the build without a database: it generates
+order lines with skewed product popularity, then reports load/build time,
+peak memory, the output size and the per-lookup latency of the memory-mapped
+result. It writes to a temporary file unless ``--output`` is given.
+
+Needs ``pip install numpy scipy``.
+"""
+
+import argparse
+import os
+import resource
+import sys
+import tempfile
+import time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build item-item recommendations')
+    parser.add_argument('--output', help='defaults to RECOMMENDATIONS_PATH')
+    parser.add_argument('--top', type=int, help='neighbours kept per product (default RECOMMENDATIONS_SIZE)')
+    parser.add_argument('--if-changed', action='store_true',
+                        help='skip the build when no order lines or wishlist entries changed since the last one')
+    parser.add_argument('--synthetic', action='store_true', help='benchmark on generated data instead')
+    parser.add_argument('--products', type=int, default=100_000)
+    parser.add_argument('--lines', type=int, default=1_000_000, help='synthetic order lines')
+    parser.add_argument('--lines-per-user', type=float, default=5.0)
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def synthetic_interactions(args):
+    import numpy as np
+
+    rng = np.random.default_rng(args.seed)
+    users = rng.integers(0, max(int(args.lines / args.lines_per_user), 1), args.lines)
+    # Cubing a uniform sample makes low ids far more popular: a long tail
+    products = (rng.random(args.lines) ** 3 * args.products).astype(np.int64) + 1
+    return users, products, np.ones(args.lines, dtype=np.float32), args.products + 1
+
+
+def build(args, load):
+    from recommendations import build_similar
+
+    started = time.perf_counter()
+    users, products, weights, n_rows = load()
+    loaded = time.perf_counter()
+    similar = build_similar(users, products, weights, n_rows, args.top)
+    built = time.perf_counter()
+    return similar, {
+        'products': n_rows - 1,
+        'interactions': len(users),
+        'top': args.top,
+        'load_seconds': round(loaded - started, 2),
+        'build_seconds': round(built - loaded, 2),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }
+
+
+def benchmark(args):
+    import numpy as np
+    from recommendations import Recommendations, write_similar
+
+    print(f'Synthetic build: {args.products:,} products, {args.lines:,} order lines, top {args.top}...')
+    similar, stats = build(args, lambda: synthetic_interactions(args))
+    output = args.output or os.path.join(tempfile.mkdtemp(), 'related.npy')
+    write_similar(output, similar)
+    covered = int((similar['id'][:, 0] > 0).sum())
+    del similar
+
+    reader = Recommendations()
+    reader.path, reader.size = output, args.top
+    rng = np.random.default_rng(args.seed)
+    ids = rng.integers(1, args.products + 1, 100_000).tolist()
+    started = time.perf_counter()
+    for product_id in ids:
+        reader.related(product_id)
+    lookup_us = (time.perf_counter() - started) / len(ids) * 1e6
+
+    print(f"  load (generate)   {stats['load_seconds']:>10.2f} s")
+    print(f"  build             {stats['build_seconds']:>10.2f} s")
+    print(f"  peak RSS          {stats['peak_rss_mb']:>10.1f} MB")
+    print(f"  output            {os.path.getsize(output) / 1024 / 1024:>10.1f} MB  ({output})")
+    print(f"  with neighbours   {covered:>10,} products")
+    print(f"  related() lookup  {lookup_us:>10.2f} µs")
+    if not args.output:
+        os.remove(output)
+
+
+def main():
+    args = parse_args()
+    if args.synthetic:
+        args.top = args.top or 20
+        benchmark(args)
+        return
+
+    from app import create_app
+    from recommendations import interaction_watermark, load_interactions, read_meta, recommendations, write_similar
+
+    with create_app().app_context():
+        output = args.output or recommendations.path
+        args.top = args.top or recommendations.size
+        watermark = interaction_watermark()
+        previous = read_meta(output)
+        if args.if_changed and previous and previous.get('watermark') == watermark \
+                and previous.get('top') == args.top and os.path.exists(output):
+            print('No new order lines or wishlist entries since the last build; nothing to do')
+            return
+        similar, stats = build(args, load_interactions)
+    write_similar(output, similar, dict(stats, watermark=watermark, built_at=time.strftime('%Y-%m-%dT%H:%M:%S')))
+    print(f"✅ Neighbours for {stats['products']:,} products from {stats['interactions']:,} interactions "
+          f"in {stats['load_seconds'] + stats['build_seconds']:.1f}s (peak {stats['peak_rss_mb']:.0f} MB) -> {output}")
+
+
+if __name__ == '__main__':
+    main()
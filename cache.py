@@ -0,0 +1,441 @@
+"""
+Response caching for catalog pages, with tag-based invalidation.
+
+Views opt in with :func:`cached`, passing a function that returns the tags a
+response depends on (``product:<id>``, ``category:<name>``, ``catalog`` ...).
+When a ``Product``, ``ProductReview`` or ``Category`` change is committed, exactly the tags
+it affects are invalidated from a session ``after_commit`` hook. Code that
+changes products with bulk SQL (e.g. checkout's stock UPDATE) reports the
+tags itself through :func:`tag_session`. A transaction that invalidates
+``catalog`` also bumps :class:`models.CatalogVersion`, the catalog API's ETag.
+
+Backends:
+
+* ``memory`` - in-process LRU bounded by entry count and a byte budget, with TTL.
+* ``redis``  - anything speaking the small subset of the Redis API used here
+               (get/set/delete/sadd/smembers/expire). :class:`LocalRedis` is an
+               in-process stand-in; a real ``redis.Redis`` client works too.
+
+HTML pages are only served from cache to anonymous visitors, since they embed
+per-user state (the navbar, ``in_wishlist``, the user's own review ...).
+"""
+
+import functools
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request, session
+from flask_login import current_user
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import bump_catalog_version, Category, Product, ProductReview
+
+CATALOG_TAG = 'catalog'
+RATINGS_TAG = 'ratings'
+CATEGORIES_TAG = 'categories'
+
+
+def product_tag(product_id):
+    return f'product:{product_id}'
+
+
+def category_tag(category):
+    return f'category:{category}'
+
+
+def product_tags(product):
+    """Tags touched by a change to ``product``'s listing data."""
+    tags = {CATALOG_TAG, product_tag(product.id)}
+    if product.category:
+        tags.add(category_tag(product.category))
+    if product.category_id is not None:
+        tags.add(category_tag(product.category_id))
+    return tags
+
+
+class CachedResponse:
+    __slots__ = ('body', 'status', 'mimetype', 'headers')
+
+    def __init__(self, body, status, mimetype, headers=None):
+        self.body = body
+        self.status = status
+        self.mimetype = mimetype
+        self.headers = headers or {}
+
+    @property
+    def size(self):
+        return len(self.body) + 256
+
+
+class MemoryCache:
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}                # tag -> set of keys
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _drop(self, key):
+        expires_at, value, tags = self._entries.pop(key)
+        self._bytes -= value.size
+        for tag in tags:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl, tags=()):
+        if value.size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (time.monotonic() + ttl, value, frozenset(tags))
+            self._bytes += value.size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                self._drop(next(iter(self._entries)))
+
+    def invalidate_tags(self, tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _to_bytes(value):
+    return value if isinstance(value, bytes) else str(value).encode()
+
+
+class LocalRedis:
+    """In-process stand-in for the Redis commands used by :class:`RedisCache`
+    and the cart store."""
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._lock = threading.Lock()
+
+    def _live(self, name):
+        expires_at = self._expiry.get(name)
+        if expires_at is not None and expires_at < time.monotonic():
+            self._data.pop(name, None)
+            self._expiry.pop(name, None)
+        return self._data.get(name)
+
+    def get(self, name):
+        with self._lock:
+            value = self._live(name)
+            return value if isinstance(value, bytes) else None
+
+    def set(self, name, value, ex=None):
+        with self._lock:
+            self._data[name] = value
+            if ex:
+                self._expiry[name] = time.monotonic() + ex
+            else:
+                self._expiry.pop(name, None)
+            return True
+
+    def delete(self, *names):
+        with self._lock:
+            removed = 0
+            for name in names:
+                if self._live(name) is not None:
+                    removed += 1
+                self._data.pop(name, None)
+                self._expiry.pop(name, None)
+            return removed
+
+    def sadd(self, name, *values):
+        with self._lock:
+            members = self._live(name)
+            if not isinstance(members, set):
+                members = self._data[name] = set()
+            before = len(members)
+            members.update(_to_bytes(v) for v in values)
+            return len(members) - before
+
+    def smembers(self, name):
+        with self._lock:
+            members = self._live(name)
+            return set(members) if isinstance(members, set) else set()
+
+    def srem(self, name, *values):
+        with self._lock:
+            members = self._live(name)
+            if not isinstance(members, set):
+                return 0
+            before = len(members)
+            members.difference_update(_to_bytes(v) for v in values)
+            return before - len(members)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            value = int(self._live(name) or 0) + amount
+            self._data[name] = str(value).encode()
+            return value
+
+    # Hashes; fields and values are stored as bytes, like Redis returns them
+    def _hash(self, name, create=False):
+        fields = self._live(name)
+        if not isinstance(fields, dict):
+            if not create:
+                return {}
+            fields = self._data[name] = {}
+        return fields
+
+    def hgetall(self, name):
+        with self._lock:
+            return dict(self._hash(name))
+
+    def hset(self, name, key=None, value=None, mapping=None):
+        with self._lock:
+            fields = self._hash(name, create=True)
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = 0
+            for k, v in items.items():
+                k = _to_bytes(k)
+                added += k not in fields
+                fields[k] = _to_bytes(v)
+            return added
+
+    def hsetnx(self, name, key, value):
+        with self._lock:
+            fields = self._hash(name, create=True)
+            key = _to_bytes(key)
+            if key in fields:
+                return False
+            fields[key] = _to_bytes(value)
+            return True
+
+    def hincrby(self, name, key, amount=1):
+        with self._lock:
+            fields = self._hash(name, create=True)
+            key = _to_bytes(key)
+            value = int(fields.get(key, 0)) + amount
+            fields[key] = str(value).encode()
+            return value
+
+    def hdel(self, name, *keys):
+        with self._lock:
+            fields = self._hash(name)
+            removed = 0
+            for key in keys:
+                if fields.pop(_to_bytes(key), None) is not None:
+                    removed += 1
+            return removed
+
+    def expire(self, name, seconds):
+        with self._lock:
+            if self._live(name) is None:
+                return False
+            self._expiry[name] = time.monotonic() + seconds
+            return True
+
+    def flushdb(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+            return True
+
+
+class RedisCache:
+    def __init__(self, client, prefix='cache:', tag_ttl=24 * 3600):
+        self.client = client
+        self.prefix = prefix
+        self.tag_ttl = tag_ttl
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl, tags=()):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+        for tag in tags:
+            tag_key = f'{self.prefix}tag:{tag}'
+            self.client.sadd(tag_key, key)
+            # Tag sets must outlive every entry they point at
+            self.client.expire(tag_key, max(ttl, self.tag_ttl))
+
+    def invalidate_tags(self, tags):
+        for tag in tags:
+            tag_key = f'{self.prefix}tag:{tag}'
+            keys = [self.prefix + k.decode() if isinstance(k, bytes) else self.prefix + k
+                    for k in self.client.smembers(tag_key)]
+            self.client.delete(tag_key, *keys)
+
+    def clear(self):
+        self.client.flushdb()
+
+
+class ResponseCache:
+    def __init__(self, app=None):
+        self.backend = None
+        self.default_ttl = 60
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_BACKEND', 'memory')
+        app.config.setdefault('CACHE_DEFAULT_TTL', 60)
+        app.config.setdefault('CACHE_MAX_ENTRIES', 10000)
+        app.config.setdefault('CACHE_MAX_BYTES', 64 * 1024 * 1024)
+        app.config.setdefault('CACHE_REDIS_URL', None)
+
+        self.default_ttl = app.config['CACHE_DEFAULT_TTL']
+        name = app.config['CACHE_BACKEND']
+        if name == 'memory':
+            self.backend = MemoryCache(app.config['CACHE_MAX_ENTRIES'], app.config['CACHE_MAX_BYTES'])
+        elif name == 'redis':
+            if app.config['CACHE_REDIS_URL']:
+                import redis
+                client = redis.Redis.from_url(app.config['CACHE_REDIS_URL'])
+            else:
+                client = LocalRedis()
+            self.backend = RedisCache(client)
+        elif name == 'null':
+            self.backend = None
+        else:
+            raise ValueError(f'Unknown CACHE_BACKEND {name!r}')
+        app.extensions['response_cache'] = self
+
+    def invalidate(self, tags):
+        if self.backend is not None and tags:
+            self.backend.invalidate_tags(tags)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+cache = ResponseCache()
+
+
+def request_cache_key(vary=()):
+    """Route plus normalized query string; empty params don't split the key."""
+    args = sorted((k, tuple(v for v in values if v))
+                  for k, values in request.args.lists() if any(values))
+    view_args = sorted((request.view_args or {}).items())
+    headers = [request.headers.get(name, '') for name in vary]
+    return repr((request.endpoint, view_args, args, headers))
+
+
+def cached(tags, ttl=None, anonymous_only=True, vary=()):
+    """Cache successful GET responses of a view.
+
+    ``tags`` is called with the view's keyword arguments and returns the tags
+    the response depends on. ``vary`` names request headers that select
+    between different representations and so belong in the key.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            backend = cache.backend
+            if (backend is None or request.method != 'GET'
+                    or (anonymous_only and current_user.is_authenticated)
+                    or session.get('_flashes')):
+                return view(*args, **kwargs)
+
+            key = request_cache_key(vary)
+            hit = backend.get(key)
+            if hit is not None:
+                response = current_app.response_class(hit.body, status=hit.status, mimetype=hit.mimetype)
+                response.headers.update(hit.headers)
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = current_app.make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                headers = {k: v for k, v in response.headers.items()
+                           if k not in ('Content-Length', 'Content-Type', 'Set-Cookie')}
+                backend.set(key, CachedResponse(response.get_data(), response.status_code,
+                                                response.mimetype, headers),
+                            ttl or cache.default_ttl, tags(**kwargs))
+                response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def tag_session(session, tags):
+    """Invalidate ``tags`` when ``session`` next commits."""
+    session.info.setdefault('cache_tags', set()).update(tags)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_cache_tags(session, flush_context):
+    tags = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Product):
+            tags |= product_tags(obj)
+            # A category change also affects the old category's pages
+            state = inspect(obj)
+            for old in (state.attrs.category.history.deleted or ()) + \
+                    (state.attrs.category_id.history.deleted or ()):
+                if old:
+                    tags.add(category_tag(old))
+        elif isinstance(obj, ProductReview):
+            # The rating it moves is counted by the rating facet of every
+            # listing showing the product, not only by rating-sorted pages
+            product_ids = {obj.product_id} | set(inspect(obj).attrs.product_id.history.deleted or ())
+            for product_id in product_ids:
+                product = session.get(Product, product_id)
+                tags |= product_tags(product) if product is not None else {CATALOG_TAG, product_tag(product_id)}
+            tags.add(RATINGS_TAG)
+        elif isinstance(obj, Category):
+            tags.add(CATEGORIES_TAG)
+    if tags:
+        tag_session(session, tags)
+    _version_catalog(session)
+
+
+@event.listens_for(Session, 'before_commit')
+def _version_catalog(session):
+    # Once per transaction that drops the catalog tag, from whichever of the
+    # flush (ORM changes) or the commit (tags from tag_session) sees it first
+    if CATALOG_TAG in session.info.get('cache_tags', ()) and not session.info.get('catalog_versioned'):
+        session.info['catalog_versioned'] = True
+        bump_catalog_version(session.connection())
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_cache_tags(session):
+    session.info.pop('catalog_versioned', None)
+    tags = session.info.pop('cache_tags', None)
+    if tags:
+        cache.invalidate(tags)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_cache_tags(session):
+    session.info.pop('catalog_versioned', None)
+    session.info.pop('cache_tags', None)
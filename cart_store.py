@@ -0,0 +1,406 @@
+"""
+Shopping cart storage.
+
+Carts are read and written through :data:`cart_store`, which hands off to one
+of two backends selected by ``CART_BACKEND``:
+
+* ``database``       - ``cart_item`` rows, each change a single upsert/delete
+                       committed right away.
+* ``memory``/``redis`` - one hash per user (``product_id -> quantity``) in a
+                       Redis-protocol client; :class:`cache.LocalRedis` is the
+                       in-process stand-in, a real ``redis.Redis`` is used when
+                       ``CART_REDIS_URL`` is set. Changed carts are written
+                       behind to ``cart_item`` every ``CART_FLUSH_INTERVAL``
+                       seconds by a background thread, and a cart missing from
+                       the hash store is loaded back from there.
+
+The in-process store is per worker; run several workers against ``redis``
+(or ``database``) so every request sees the same cart.
+
+Cart totals are cached in the hash together with the cart's version and a
+global price generation, which is bumped whenever a product price change is
+committed, so the navbar summary doesn't need a product query per page.
+"""
+
+import atexit
+import logging
+import threading
+import time
+
+from sqlalchemy import bindparam, delete, event, func, inspect, select
+from sqlalchemy.orm import Session
+
+from cache import LocalRedis
+from database import upsert_insert
+from models import db, CartItem, Product
+from queries import cart_items_for
+
+log = logging.getLogger(__name__)
+
+# Reserved hash fields; product ids are always numeric
+LOADED = b'_loaded'
+VERSION = b'_v'
+TOTAL = b'_total'
+
+
+class CartLine:
+    """A cart row with its product, shaped like ``CartItem`` for templates."""
+    __slots__ = ('product', 'quantity')
+
+    def __init__(self, product, quantity):
+        self.product = product
+        self.quantity = quantity
+
+    @property
+    def product_id(self):
+        return self.product.id
+
+    def get_total(self):
+        return self.product.price * self.quantity
+
+
+def _upsert(rows, increment=False):
+    """Insert ``cart_item`` rows, updating the quantity of existing lines.
+
+    Returns False when the dialect has no ``ON CONFLICT`` support.
+    """
+    insert = upsert_insert(db.session.get_bind().dialect.name)
+    if insert is None:
+        return False
+    statement = insert(CartItem).values(rows)
+    quantity = statement.excluded.quantity
+    if increment:
+        quantity = CartItem.quantity + quantity
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[CartItem.user_id, CartItem.product_id],
+        set_={'quantity': quantity},
+    ))
+    return True
+
+
+def _write_quantity(user_id, product_id, quantity, increment=False):
+    if _upsert([{'user_id': user_id, 'product_id': product_id, 'quantity': quantity}], increment):
+        return
+    item = CartItem.query.filter_by(user_id=user_id, product_id=product_id).first()
+    if item is None:
+        db.session.add(CartItem(user_id=user_id, product_id=product_id, quantity=quantity))
+    else:
+        item.quantity = item.quantity + quantity if increment else quantity
+
+
+def _consume_rows(user_id, quantities):
+    """Take ordered quantities off the persisted cart in one executemany; caller commits."""
+    if not quantities:
+        return
+    cart_items = CartItem.__table__
+    db.session.execute(
+        cart_items.update()
+        .where(cart_items.c.user_id == user_id, cart_items.c.product_id == bindparam('c_product'))
+        .values(quantity=cart_items.c.quantity - bindparam('c_quantity')),
+        [{'c_product': pid, 'c_quantity': q} for pid, q in quantities.items()],
+    )
+    db.session.execute(delete(CartItem).where(CartItem.user_id == user_id, CartItem.quantity <= 0))
+
+
+def _products_by_id(product_ids):
+    if not product_ids:
+        return {}
+    return {p.id: p for p in Product.query.filter(Product.id.in_(list(product_ids)))}
+
+
+def _after_commit(session, callback):
+    session.info.setdefault('cart_callbacks', []).append(callback)
+
+
+class DatabaseCartBackend:
+    name = 'database'
+
+    def items(self, user_id):
+        rows = db.session.execute(
+            select(CartItem.product_id, CartItem.quantity)
+            .where(CartItem.user_id == user_id)
+            .order_by(CartItem.created_at, CartItem.id)
+        )
+        return {product_id: quantity for product_id, quantity in rows}
+
+    def lines(self, user_id):
+        return cart_items_for(user_id)
+
+    def add(self, user_id, product_id, quantity):
+        _write_quantity(user_id, product_id, quantity, increment=True)
+        db.session.commit()
+
+    def set(self, user_id, product_id, quantity):
+        if quantity <= 0:
+            db.session.execute(delete(CartItem).where(CartItem.user_id == user_id,
+                                                      CartItem.product_id == product_id))
+        else:
+            _write_quantity(user_id, product_id, quantity)
+        db.session.commit()
+
+    def consume(self, user_id, quantities):
+        _consume_rows(user_id, quantities)
+
+    def summary(self, user_id):
+        count, total = db.session.execute(
+            select(func.coalesce(func.sum(CartItem.quantity), 0),
+                   func.coalesce(func.sum(CartItem.quantity * Product.price), 0))
+            .join(Product, Product.id == CartItem.product_id)
+            .where(CartItem.user_id == user_id)
+        ).one()
+        return int(count), float(total)
+
+    def flush(self):
+        pass
+
+    def prices_changed(self):
+        pass
+
+
+class HashCartBackend:
+    """Carts as Redis hashes, written behind to ``cart_item``."""
+    name = 'redis'
+
+    def __init__(self, client, app=None, prefix='cart:', ttl=7 * 24 * 3600, flush_interval=2.0):
+        self.client = client
+        self.app = app
+        self.prefix = prefix
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._flusher = None
+        self._flusher_lock = threading.Lock()
+
+    def _key(self, user_id):
+        return f'{self.prefix}{user_id}'
+
+    @property
+    def _dirty_key(self):
+        return f'{self.prefix}dirty'
+
+    @property
+    def _prices_key(self):
+        return f'{self.prefix}prices'
+
+    def _fields(self, user_id):
+        """The user's hash, loading it from ``cart_item`` on a miss."""
+        key = self._key(user_id)
+        fields = self.client.hgetall(key)
+        if LOADED in fields:
+            return fields
+        # hsetnx so a concurrent add that lands mid-load isn't overwritten
+        for product_id, quantity in DatabaseCartBackend().items(user_id).items():
+            self.client.hsetnx(key, product_id, quantity)
+        self.client.hsetnx(key, LOADED, 1)
+        self.client.expire(key, self.ttl)
+        return self.client.hgetall(key)
+
+    @staticmethod
+    def _quantities(fields):
+        quantities = {}
+        for field, value in fields.items():
+            field = field.decode() if isinstance(field, bytes) else str(field)
+            if field.isdigit() and int(value) > 0:
+                quantities[int(field)] = int(value)
+        return quantities
+
+    def _changed(self, user_id):
+        key = self._key(user_id)
+        self.client.hincrby(key, VERSION, 1)
+        self.client.expire(key, self.ttl)
+        self.client.sadd(self._dirty_key, user_id)
+        self._start_flusher()
+
+    def items(self, user_id):
+        return self._quantities(self._fields(user_id))
+
+    def lines(self, user_id):
+        quantities = self.items(user_id)
+        products = _products_by_id(quantities)
+        return [CartLine(products[pid], q) for pid, q in quantities.items() if pid in products]
+
+    def add(self, user_id, product_id, quantity):
+        self._fields(user_id)
+        self.client.hincrby(self._key(user_id), product_id, quantity)
+        self._changed(user_id)
+
+    def set(self, user_id, product_id, quantity):
+        self._fields(user_id)
+        if quantity <= 0:
+            self.client.hdel(self._key(user_id), product_id)
+        else:
+            self.client.hset(self._key(user_id), product_id, quantity)
+        self._changed(user_id)
+
+    def consume(self, user_id, quantities):
+        # The persisted copy changes with the order; the hash once it commits
+        _consume_rows(user_id, quantities)
+
+        def apply():
+            key = self._key(user_id)
+            for product_id, quantity in quantities.items():
+                if self.client.hincrby(key, product_id, -quantity) <= 0:
+                    self.client.hdel(key, product_id)
+            self._changed(user_id)
+        _after_commit(db.session, apply)
+
+    def summary(self, user_id):
+        fields = self._fields(user_id)
+        quantities = self._quantities(fields)
+        if not quantities:
+            return 0, 0.0
+        count = sum(quantities.values())
+
+        stamp = f"{int(self.client.get(self._prices_key) or 0)}:{int(fields.get(VERSION, 0))}"
+        cached = fields.get(TOTAL)
+        if cached is not None:
+            cached = cached.decode() if isinstance(cached, bytes) else cached
+            cached_stamp, _, total = cached.rpartition(':')
+            if cached_stamp == stamp:
+                return count, float(total)
+
+        prices = dict(db.session.execute(
+            select(Product.id, Product.price).where(Product.id.in_(list(quantities)))
+        ).all())
+        total = sum(prices[pid] * q for pid, q in quantities.items() if pid in prices)
+        self.client.hset(self._key(user_id), TOTAL, f'{stamp}:{total!r}')
+        return count, total
+
+    def prices_changed(self):
+        self.client.incr(self._prices_key)
+
+    def flush(self):
+        """Write every changed cart through to ``cart_item``."""
+        for raw in self.client.smembers(self._dirty_key):
+            # Un-mark first: a change made while we write marks it again
+            self.client.srem(self._dirty_key, raw)
+            user_id = int(raw)
+            fields = self.client.hgetall(self._key(user_id))
+            if LOADED not in fields:
+                continue
+            quantities = self._quantities(fields)
+            try:
+                db.session.execute(delete(CartItem).where(
+                    CartItem.user_id == user_id,
+                    CartItem.product_id.notin_(list(quantities)),
+                ))
+                rows = [{'user_id': user_id, 'product_id': pid, 'quantity': q}
+                        for pid, q in quantities.items()]
+                if rows and not _upsert(rows):
+                    for row in rows:
+                        _write_quantity(**row)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                self.client.sadd(self._dirty_key, user_id)
+                raise
+
+    def _run_flusher(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                log.exception('cart write-behind failed; retrying')
+
+    def _start_flusher(self):
+        if self._flusher is not None or self.app is None:
+            return
+        with self._flusher_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._run_flusher, name='cart-flusher', daemon=True)
+                self._flusher.start()
+                atexit.register(self._final_flush)
+
+    def _final_flush(self):
+        with self.app.app_context():
+            self.flush()
+
+
+class CartStore:
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CART_BACKEND', 'database')
+        app.config.setdefault('CART_REDIS_URL', None)
+        app.config.setdefault('CART_FLUSH_INTERVAL', 2.0)
+        app.config.setdefault('CART_TTL', 7 * 24 * 3600)
+
+        name = app.config['CART_BACKEND']
+        if name == 'database':
+            self.backend = DatabaseCartBackend()
+        elif name in ('memory', 'redis'):
+            if name == 'redis' and app.config['CART_REDIS_URL']:
+                import redis
+                client = redis.Redis.from_url(app.config['CART_REDIS_URL'])
+            else:
+                client = LocalRedis()
+            self.backend = HashCartBackend(client, app, ttl=app.config['CART_TTL'],
+                                           flush_interval=app.config['CART_FLUSH_INTERVAL'])
+        else:
+            raise ValueError(f'Unknown CART_BACKEND {name!r}')
+        app.extensions['cart_store'] = self
+
+    def items(self, user_id):
+        """``{product_id: quantity}`` for the user's cart."""
+        return self.backend.items(user_id)
+
+    def lines(self, user_id):
+        """Cart lines with their products loaded, for rendering."""
+        return self.backend.lines(user_id)
+
+    def add(self, user_id, product_id, quantity=1):
+        self.backend.add(user_id, product_id, quantity)
+
+    def set(self, user_id, product_id, quantity):
+        """Set a line's quantity; zero or less removes it."""
+        self.backend.set(user_id, product_id, quantity)
+
+    def remove(self, user_id, product_id):
+        self.backend.set(user_id, product_id, 0)
+
+    def consume(self, user_id, quantities):
+        """Remove ordered quantities as part of the current checkout transaction."""
+        self.backend.consume(user_id, quantities)
+
+    def summary(self, user_id):
+        """``(item count, total price)`` of the user's cart."""
+        return self.backend.summary(user_id)
+
+    def flush(self):
+        self.backend.flush()
+
+
+cart_store = CartStore()
+
+
+def _prices_changed():
+    if cart_store.backend is not None:
+        cart_store.backend.prices_changed()
+
+
+def notify_price_change(session):
+    """Drop cached cart totals once ``session`` commits; for bulk SQL price updates."""
+    _after_commit(session, _prices_changed)
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_price_changes(session, flush_context):
+    for obj in session.dirty:
+        if isinstance(obj, Product) and inspect(obj).attrs.price.history.has_changes():
+            _after_commit(session, _prices_changed)
+            break
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_cart_callbacks(session):
+    for callback in session.info.pop('cart_callbacks', ()):
+        callback()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_cart_callbacks(session):
+    session.info.pop('cart_callbacks', None)
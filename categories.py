@@ -0,0 +1,215 @@
+"""
+In-memory category tree.
+
+``Category`` rows form a tree through ``parent_id``. Walking it with the lazy
+``children`` relationship costs one query per node, so :class:`CategoryTree`
+loads every category in a single query and precomputes a nested-set
+numbering: categories are laid out in depth-first order and each one records
+the slice ``[left, right)`` its subtree occupies. A subtree is then a list
+slice, and "products in this category or below" one ``category_id IN (...)``
+query on the indexed column.
+
+Category changes committed through the ORM are applied to the loaded rows
+from a session hook and only the numbering is recomputed, without going back
+to the database. Other processes pick changes up when their copy is reloaded
+after ``CATEGORY_TREE_TTL`` seconds.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, or_, select
+from sqlalchemy.orm import Session
+
+from models import db, Category, Product
+
+
+class CategoryNode:
+    __slots__ = ('id', 'name', 'slug', 'parent_id', 'depth', 'left', 'right')
+
+    def __init__(self, id, name, slug, parent_id, depth, left):
+        self.id = id
+        self.name = name
+        self.slug = slug
+        self.parent_id = parent_id
+        self.depth = depth
+        self.left = left
+        self.right = left + 1
+
+    @property
+    def key(self):
+        """Value used for the ``category`` search parameter."""
+        return self.slug or self.name
+
+    def __repr__(self):
+        return f'<CategoryNode {self.id} {self.name!r} [{self.left}, {self.right})>'
+
+
+class _Snapshot:
+    """One immutable numbering of the tree; swapped in whole on rebuild."""
+
+    def __init__(self, rows):
+        children = defaultdict(list)
+        roots = []
+        for cid, (name, slug, parent_id) in rows.items():
+            if parent_id in rows and parent_id != cid:
+                children[parent_id].append(cid)
+            else:
+                roots.append(cid)
+        sort_key = lambda cid: (rows[cid][0].lower(), cid)
+        roots.sort(key=sort_key)
+        for ids in children.values():
+            ids.sort(key=sort_key)
+
+        self.nodes = {}
+        self.order = []
+        # Categories caught in a parent_id cycle are unreachable from the
+        # roots; they're appended as roots of their own
+        for start in roots + sorted(rows, key=sort_key):
+            if start in self.nodes:
+                continue
+            stack = [(start, None, 0)]
+            while stack:
+                cid, parent_id, depth = stack.pop()
+                if cid in self.nodes:
+                    continue
+                name, slug, _ = rows[cid]
+                self.nodes[cid] = CategoryNode(cid, name, slug, parent_id, depth, len(self.order))
+                self.order.append(cid)
+                for child in reversed(children.get(cid, ())):
+                    if child not in self.nodes:
+                        stack.append((child, cid, depth + 1))
+
+        # Subtree sizes, children before parents
+        for cid in reversed(self.order):
+            node = self.nodes[cid]
+            if node.parent_id is not None:
+                self.nodes[node.parent_id].right += node.right - node.left
+
+        self.children = defaultdict(list)
+        for cid in self.order:
+            node = self.nodes[cid]
+            self.children[node.parent_id].append(node)
+
+        self.by_slug = {n.slug: n for n in self.nodes.values() if n.slug}
+        self.by_name = {}
+        for cid in self.order:
+            self.by_name.setdefault(self.nodes[cid].name, self.nodes[cid])
+
+
+class CategoryTree:
+    def __init__(self):
+        self._rows = None        # id -> (name, slug, parent_id)
+        self._snapshot = _Snapshot({})
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _ttl(self):
+        from flask import current_app
+        return current_app.config.get('CATEGORY_TREE_TTL', 300)
+
+    def _current(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self._ttl():
+            self.reload()
+        return self._snapshot
+
+    def reload(self):
+        rows = db.session.execute(select(Category.id, Category.name, Category.slug, Category.parent_id))
+        rows = {row.id: (row.name, row.slug, row.parent_id) for row in rows}
+        with self._lock:
+            self._rows = rows
+            self._snapshot = _Snapshot(rows)
+            self._loaded_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._rows = None
+            self._loaded_at = None
+
+    def apply(self, changes):
+        """Apply committed ``{id: (name, slug, parent_id) or None}`` changes."""
+        with self._lock:
+            if self._rows is None:
+                return
+            rows = dict(self._rows)
+            for cid, row in changes.items():
+                if row is None:
+                    rows.pop(cid, None)
+                else:
+                    rows[cid] = row
+            self._rows = rows
+            self._snapshot = _Snapshot(rows)
+
+    def get(self, category_id):
+        return self._current().nodes.get(category_id)
+
+    def find(self, key):
+        """Look a category up by slug, then by name."""
+        snapshot = self._current()
+        return snapshot.by_slug.get(key) or snapshot.by_name.get(key)
+
+    def roots(self):
+        return list(self._current().children.get(None, ()))
+
+    def children(self, category_id):
+        return list(self._current().children.get(category_id, ()))
+
+    def path(self, category_id):
+        """Ancestors of the category followed by the category itself."""
+        snapshot = self._current()
+        path = []
+        node = snapshot.nodes.get(category_id)
+        while node is not None:
+            path.append(node)
+            node = snapshot.nodes.get(node.parent_id)
+        path.reverse()
+        return path
+
+    def descendant_ids(self, category_id, include_self=True):
+        snapshot = self._current()
+        node = snapshot.nodes.get(category_id)
+        if node is None:
+            return []
+        start = node.left if include_self else node.left + 1
+        return snapshot.order[start:node.right]
+
+    def product_filter(self, key):
+        """Condition matching products in category ``key`` or any subcategory.
+
+        Products that predate ``category_id`` only carry the category name,
+        so that is matched as well.
+        """
+        node = self.find(key)
+        if node is None:
+            return Product.category == key
+        return or_(Product.category_id.in_(self.descendant_ids(node.id)),
+                   Product.category == node.name)
+
+
+category_tree = CategoryTree()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_category_changes(session, flush_context):
+    changes = {}
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Category):
+            changes[obj.id] = (obj.name, obj.slug, obj.parent_id)
+    for obj in session.deleted:
+        if isinstance(obj, Category):
+            changes[obj.id] = None
+    if changes:
+        session.info.setdefault('category_changes', {}).update(changes)
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_category_changes(session):
+    changes = session.info.pop('category_changes', None)
+    if changes:
+        category_tree.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_category_changes(session):
+    session.info.pop('category_changes', None)
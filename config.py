@@ -0,0 +1,157 @@
+"""
+Application configuration.
+
+Everything deployment-specific can be overridden from the environment
+(or a ``.env`` file), e.g.::
+
+    DATABASE_URL=postgresql://shop@db/shop
+    DATABASE_REPLICA_URL=postgresql://shop@db-replica/shop
+    DB_POOL_SIZE=20
+"""
+
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def _env_bool(name, default):
+    return os.environ.get(name, str(default)).lower() in ('1', 'true', 'yes', 'on')
+
+
+def _env_limits(name, default):
+    """``endpoint=limit`` pairs separated by commas, on top of ``default``."""
+    limits = dict(default)
+    for pair in filter(None, os.environ.get(name, '').split(',')):
+        endpoint, _, limit = pair.partition('=')
+        limits[endpoint.strip()] = limit.strip() or None
+    return limits
+
+
+def engine_options(uri):
+    """Engine kwargs for ``uri``; pool tuning only applies to server databases."""
+    if uri.startswith('sqlite'):
+        return {}
+    return {
+        'pool_size': _env_int('DB_POOL_SIZE', 10),
+        'max_overflow': _env_int('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': _env_int('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': _env_int('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': _env_bool('DB_POOL_PRE_PING', True),
+    }
+
+
+class Config:
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-here')
+
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///ecommerce.db')
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Optional read replica used by read-only routes (see database.read_replica)
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    SQLALCHEMY_BINDS = {
+        'replica': {'url': DATABASE_REPLICA_URL, **engine_options(DATABASE_REPLICA_URL)}
+    } if DATABASE_REPLICA_URL else {}
+
+    # Applied to every SQLite connection as PRAGMAs
+    SQLITE_PRAGMAS = {
+        'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': _env_int('SQLITE_BUSY_TIMEOUT_MS', 5000),
+        'mmap_size': _env_int('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': _env_int('SQLITE_CACHE_SIZE', -64000),  # negative = KiB
+    }
+
+    PRODUCTS_PER_PAGE = 24
+    MAX_PAGE_SIZE = 100  # also the most ids one ?ids= lookup may ask for
+
+    # Bulk price/stock writes (PATCH /api/products:batch); disabled without a token
+    API_WRITE_TOKEN = os.environ.get('API_WRITE_TOKEN')
+    API_BATCH_MAX = _env_int('API_BATCH_MAX', 500)
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'fts5')  # falls back to 'memory' without FTS5
+    # Seconds before a worker reloads the category tree to see other workers' edits
+    CATEGORY_TREE_TTL = _env_int('CATEGORY_TREE_TTL', 300)
+
+    # Response cache: 'memory', 'redis' (CACHE_REDIS_URL, or an in-process stand-in) or 'null'
+    CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'memory')
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_DEFAULT_TTL = _env_int('CACHE_DEFAULT_TTL', 60)
+    CACHE_MAX_ENTRIES = _env_int('CACHE_MAX_ENTRIES', 10000)
+    CACHE_MAX_BYTES = _env_int('CACHE_MAX_BYTES', 64 * 1024 * 1024)
+
+    # Cart store: 'database', or 'memory'/'redis' hashes written behind to cart_item
+    CART_BACKEND = os.environ.get('CART_BACKEND', 'database')
+    CART_REDIS_URL = os.environ.get('CART_REDIS_URL')
+    CART_FLUSH_INTERVAL = float(os.environ.get('CART_FLUSH_INTERVAL', 2.0))
+    CART_TTL = _env_int('CART_TTL', 7 * 24 * 3600)
+
+    # Add-to-cart stock holds (seconds; 0 disables) and their expiry sweeper
+    RESERVATION_TTL = _env_int('RESERVATION_TTL', 15 * 60)
+    RESERVATION_SWEEP_INTERVAL = _env_int('RESERVATION_SWEEP_INTERVAL', 30)
+    RESERVATION_SWEEP_BATCH = _env_int('RESERVATION_SWEEP_BATCH', 500)
+
+    # Background jobs: threads per web process (0 = only `python worker.py` runs jobs)
+    JOB_WORKERS = _env_int('JOB_WORKERS', 2)
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 1.0))
+    JOB_RETRY_BASE = float(os.environ.get('JOB_RETRY_BASE', 2.0))
+    JOB_LOCK_TIMEOUT = _env_int('JOB_LOCK_TIMEOUT', 300)
+    JOB_RETENTION = _env_int('JOB_RETENTION', 24 * 3600)
+
+    # load_user cache of user rows (entries; 0 disables) and how long another worker's edit can go unseen
+    USER_CACHE_SIZE = _env_int('USER_CACHE_SIZE', 10000)
+    USER_CACHE_TTL = _env_int('USER_CACHE_TTL', 60)
+
+    # Password hashing: Werkzeug method string, hashing processes per server
+    # process (0 = in the request thread), most hashes in flight or waiting,
+    # and seconds a login waits for a slot before getting a 503
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = _env_int('PASSWORD_HASH_WORKERS', 1)
+    PASSWORD_HASH_QUEUE = _env_int('PASSWORD_HASH_QUEUE', 16)
+    PASSWORD_HASH_TIMEOUT = _env_int('PASSWORD_HASH_TIMEOUT', 5)
+
+    # Best sellers / trending: products kept per ranking, seconds before another
+    # worker's sales show up, and the trending half-life in seconds
+    RANKINGS_SIZE = _env_int('RANKINGS_SIZE', 50)
+    RANKINGS_TTL = _env_int('RANKINGS_TTL', 60)
+    RANKINGS_TREND_HALF_LIFE = _env_int('RANKINGS_TREND_HALF_LIFE', 3 * 24 * 3600)
+
+    # "Customers also bought": the file build_recommendations.py writes
+    # (default instance/related.npy), neighbours kept per product, and seconds
+    # between checks for a rebuilt file
+    RECOMMENDATIONS_PATH = os.environ.get('RECOMMENDATIONS_PATH')
+    RECOMMENDATIONS_SIZE = _env_int('RECOMMENDATIONS_SIZE', 20)
+    RECOMMENDATIONS_RELOAD = _env_int('RECOMMENDATIONS_RELOAD', 60)
+
+    # Token-bucket limits per endpoint and user (or IP when logged out), e.g.
+    # RATE_LIMITS='shop.search=30/minute,shop.login=' (empty = unlimited).
+    # Backend: 'memory' (per process) or 'redis' (RATE_LIMIT_REDIS_URL)
+    RATE_LIMIT_ENABLED = _env_bool('RATE_LIMIT_ENABLED', True)
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+    RATE_LIMIT_REDIS_URL = os.environ.get('RATE_LIMIT_REDIS_URL')
+    RATE_LIMIT_MAX_KEYS = _env_int('RATE_LIMIT_MAX_KEYS', 100000)
+    RATE_LIMIT_DEFAULT = os.environ.get('RATE_LIMIT_DEFAULT', '600/minute')
+    RATE_LIMITS = _env_limits('RATE_LIMITS', {
+        'shop.search': '60/minute',
+        'shop.productlistapi': '120/minute',
+        'shop.productapi': '300/minute',
+        'shop.productbatchapi': '60/minute',
+        'shop.add_to_cart': '30/minute',
+        'shop.update_cart': '60/minute',
+        'shop.add_review': '10/minute',
+        'shop.login': '10/minute',
+        'shop.register': '5/minute',
+    })
+
+    # Request/SQL metrics at /metrics; Server-Timing headers are opt-in.
+    # /metrics and /metrics/jobs answer 404 until METRICS_TOKEN is set, then
+    # need it as a bearer token
+    INSTRUMENTATION = _env_bool('INSTRUMENTATION', True)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    SERVER_TIMING = _env_bool('SERVER_TIMING', False)
+    N_PLUS_ONE_THRESHOLD = _env_int('N_PLUS_ONE_THRESHOLD', 5)
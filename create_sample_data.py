@@ -2,9 +2,10 @@
 """
 Sample data initialization script for E-commerce application
 Run this script to populate the database with sample data
+(for large load-testing datasets use generate_data.py instead)
 """
 
-from app import app
+from app import create_app
 from models import db, User, Product, Category, ProductImage, ProductReview
 from datetime import datetime, timedelta
 import random
@@ -12,7 +13,7 @@ import random
 def create_sample_data():
     """Create sample data for the e-commerce application"""
     
-    with app.app_context():
+    with create_app().app_context():
         # Create tables
         db.create_all()
         
@@ -257,13 +258,14 @@ def create_sample_data():
         ]
         
         # Add reviews for some products
+        reviewed = set()
         for product in random.sample(products, 8):
             num_reviews = random.randint(1, 4)
             for _ in range(num_reviews):
                 user = random.choice(users)
                 # Avoid duplicate reviews from same user
-                existing_review = ProductReview.query.filter_by(user_id=user.id, product_id=product.id).first()
-                if not existing_review:
+                if (user.id, product.id) not in reviewed:
+                    reviewed.add((user.id, product.id))
                     review = ProductReview(
                         user_id=user.id,
                         product_id=product.id,
@@ -0,0 +1,95 @@
+"""
+Engine tuning and read-replica routing.
+
+``init_database(app)`` is called once after ``db.init_app(app)``; it applies
+``SQLITE_PRAGMAS`` to every new SQLite connection (WAL, busy timeout, mmap ...).
+
+Views decorated with :func:`read_replica` send their reads to the ``replica``
+bind when one is configured. Writes, flushes and anything outside such a view
+always go to the primary.
+
+:func:`upsert_insert` gives the ``INSERT ... ON CONFLICT`` construct for
+dialects that have one.
+
+Pooled connections must not be shared between processes, so after a fork
+(serve.py, gunicorn ``--preload``) the child drops the pools it inherited and
+opens its own connections.
+"""
+
+import contextvars
+import functools
+import os
+import weakref
+
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql.dml import UpdateBase
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+
+_engines = weakref.WeakSet()
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _use_replica.get() and not self._flushing \
+                and not isinstance(clause, UpdateBase):
+            replica = self._db.engines.get('replica')
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(view):
+    """Route the view's queries to the read replica, if there is one."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = _use_replica.set(True)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            _use_replica.reset(token)
+    return wrapper
+
+
+def upsert_insert(dialect_name):
+    """The dialect's ``insert`` with ``on_conflict_do_update``, or None."""
+    if dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert
+
+
+def apply_sqlite_pragmas(engine, pragmas):
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+
+
+def _dispose_after_fork():
+    # close=False: the parent's connections stay usable by the parent
+    for engine in list(_engines):
+        engine.dispose(close=False)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+
+def init_database(app):
+    from models import db
+
+    pragmas = app.config.get('SQLITE_PRAGMAS') or {}
+    with app.app_context():
+        for engine in db.engines.values():
+            _engines.add(engine)
+            if engine.dialect.name == 'sqlite' and pragmas:
+                apply_sqlite_pragmas(engine, pragmas)
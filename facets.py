@@ -0,0 +1,353 @@
+"""
+Facet counts for product listings.
+
+Filtered listings count all facets in one statement: a ``UNION ALL`` of one
+``GROUP BY`` branch per facet. Each branch applies every active filter except
+its own (disjunctive faceting), so picking a brand still shows how many
+results the other brands would have.
+
+The unfiltered catalog (home page sidebar, bare /search) reads from
+``product_facet_counts`` instead, a summary table that SQLite triggers on
+``products`` keep up to date, so its cost doesn't grow with the catalog.
+The same triggers maintain ``product_facet_pairs``: for every facet value
+``by_facet = by_value``, how many of its products have each value of every
+other facet. A listing narrowed by one facet value alone (a single click in
+the sidebar) is answered from the two tables by :func:`pinned_facet_counts`.
+"""
+
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import DDL, Integer, String, bindparam, case, cast, event, func, literal, text, union_all
+
+from models import db, Product
+
+# Upper bounds of the price buckets; the last bucket is open-ended
+PRICE_BUCKETS = [25, 50, 100, 250, 500, 1000]
+
+
+def price_bucket_label(index):
+    low = PRICE_BUCKETS[index - 1] if index > 0 else 0
+    if index >= len(PRICE_BUCKETS):
+        return f'${low}+'
+    return f'${low} - ${PRICE_BUCKETS[index]}'
+
+
+def price_bucket():
+    return case(*[(Product.price < bound, i) for i, bound in enumerate(PRICE_BUCKETS)],
+                else_=len(PRICE_BUCKETS))
+
+
+def rating_bucket():
+    # Average rating rounded down; 0 means no reviews yet
+    return cast(Product.rating_avg, Integer)
+
+
+FACETS = OrderedDict([
+    ('category', lambda: Product.category),
+    ('brand', lambda: Product.brand),
+    ('price', price_bucket),
+    ('featured', lambda: cast(Product.is_featured, Integer)),
+    ('rating', rating_bucket),
+])
+
+
+# Query-string parameter that filters on each facet
+FACET_PARAMS = {
+    'category': 'category',
+    'brand': 'brand',
+    'price': 'price_bucket',
+    'featured': 'featured',
+    'rating': 'rating',
+}
+
+FACET_TITLES = {
+    'category': 'Category',
+    'brand': 'Brand',
+    'price': 'Price',
+    'featured': 'Featured',
+    'rating': 'Rating',
+}
+
+
+class FacetValue:
+    __slots__ = ('value', 'count', 'label', 'selected')
+
+    def __init__(self, value, count, label, selected=False):
+        self.value = value
+        self.count = count
+        self.label = label
+        self.selected = selected
+
+
+def _label(facet, value):
+    if facet == 'price':
+        return price_bucket_label(int(value))
+    if facet == 'featured':
+        return 'Featured' if int(value) else 'Regular'
+    if facet == 'rating':
+        stars = int(value)
+        if stars == 0:
+            return 'Not yet rated'
+        return '5★' if stars >= 5 else f'{stars}★ - {stars}.9★'
+    return value
+
+
+def _as_text(value):
+    return '' if value is None else str(value)
+
+
+def _collect(rows, facets, selected):
+    result = OrderedDict((name, []) for name in facets)
+    for facet, value, count in rows:
+        if value in (None, '') or not count:
+            continue
+        result[facet].append(FacetValue(value, count, _label(facet, value),
+                                        selected=_as_text(selected.get(facet)) == value))
+
+    for name, values in result.items():
+        if name in ('price', 'rating'):
+            values.sort(key=lambda v: int(v.value), reverse=(name == 'rating'))
+        else:
+            values.sort(key=lambda v: (-v.count, v.label))
+    return result
+
+
+def facet_counts(base_query, filters=None, facets=None, selected=None):
+    """Count products per facet value in a single query.
+
+    ``base_query`` is a ``Product`` query that already carries the
+    restrictions shared by every facet (e.g. the text match). ``filters``
+    maps facet name -> list of SQL conditions owned by that facet; they're
+    applied to every branch except the facet's own. Returns an ordered
+    mapping of facet name -> list of :class:`FacetValue`.
+    """
+    filters = filters or {}
+    facets = list(facets or FACETS)
+    selected = selected or {}
+
+    branches = []
+    for name in facets:
+        expr = FACETS[name]()
+        query = base_query.with_entities(
+            literal(name).label('facet'),
+            cast(expr, String).label('value'),
+            func.count(Product.id).label('n'),
+        ).order_by(None)
+        for owner, conditions in filters.items():
+            if owner != name:
+                query = query.filter(*conditions)
+        branches.append(query.filter(expr.isnot(None)).group_by(expr).statement)
+
+    if not branches:
+        return _collect([], facets, selected)
+    statement = branches[0] if len(branches) == 1 else union_all(*branches)
+    return _collect(db.session.execute(statement), facets, selected)
+
+
+# Summary table maintenance. Each facet's value is written out as SQL over the
+# trigger's NEW/OLD row and must match the FACETS expressions above.
+SUMMARY_COLUMNS = {
+    'category': 'category',
+    'brand': 'brand',
+    'price': 'price',
+    'featured': 'is_featured',
+    'rating': 'rating_avg',
+}
+
+
+def _summary_expr(facet, row):
+    if facet == 'price':
+        whens = ' '.join(f'WHEN {row}.price < {bound} THEN {i}' for i, bound in enumerate(PRICE_BUCKETS))
+        return f'(CASE {whens} ELSE {len(PRICE_BUCKETS)} END)'
+    if facet in ('featured', 'rating'):
+        return f'CAST({row}.{SUMMARY_COLUMNS[facet]} AS INTEGER)'
+    return f'{row}.{SUMMARY_COLUMNS[facet]}'
+
+
+def _increment(facet, row):
+    expr = _summary_expr(facet, row)
+    return (f"INSERT INTO product_facet_counts (facet, value, n) "
+            f"SELECT '{facet}', CAST({expr} AS TEXT), 1 WHERE {expr} IS NOT NULL "
+            f"ON CONFLICT (facet, value) DO UPDATE SET n = n + 1;")
+
+
+def _decrement(facet, row):
+    expr = _summary_expr(facet, row)
+    return (f"UPDATE product_facet_counts SET n = n - 1 "
+            f"WHERE facet = '{facet}' AND value = CAST({expr} AS TEXT);")
+
+
+# Ordered (by_facet, facet) pairs kept in product_facet_pairs
+FACET_PAIRS = [(by, facet) for by in FACETS for facet in FACETS if by != facet]
+
+
+def _pair_values(by, facet, row):
+    by_expr, expr = _summary_expr(by, row), _summary_expr(facet, row)
+    return (f"'{by}', CAST({by_expr} AS TEXT), '{facet}', CAST({expr} AS TEXT)",
+            f'{by_expr} IS NOT NULL AND {expr} IS NOT NULL')
+
+
+def _increment_pairs(row):
+    statements = []
+    for by, facet in FACET_PAIRS:
+        values, present = _pair_values(by, facet, row)
+        statements.append(
+            f"INSERT INTO product_facet_pairs (by_facet, by_value, facet, value, n) "
+            f"SELECT {values}, 1 WHERE {present} "
+            f"ON CONFLICT (by_facet, by_value, facet, value) DO UPDATE SET n = n + 1;")
+    return ' '.join(statements)
+
+
+def _decrement_pairs(row):
+    statements = []
+    for by, facet in FACET_PAIRS:
+        statements.append(
+            f"UPDATE product_facet_pairs SET n = n - 1 "
+            f"WHERE by_facet = '{by}' AND by_value = CAST({_summary_expr(by, row)} AS TEXT) "
+            f"AND facet = '{facet}' AND value = CAST({_summary_expr(facet, row)} AS TEXT);")
+    return ' '.join(statements)
+
+
+def _summary_setup():
+    statements = [
+        'CREATE TABLE IF NOT EXISTS product_facet_counts ('
+        'facet VARCHAR(20) NOT NULL, value VARCHAR(200) NOT NULL, n INTEGER NOT NULL, '
+        'PRIMARY KEY (facet, value))',
+        'CREATE TABLE IF NOT EXISTS product_facet_pairs ('
+        'by_facet VARCHAR(20) NOT NULL, by_value VARCHAR(200) NOT NULL, '
+        'facet VARCHAR(20) NOT NULL, value VARCHAR(200) NOT NULL, n INTEGER NOT NULL, '
+        'PRIMARY KEY (by_facet, by_value, facet, value))',
+        'CREATE TRIGGER IF NOT EXISTS products_facets_ai AFTER INSERT ON products BEGIN '
+        + ' '.join(_increment(f, 'new') for f in FACETS) + ' END',
+        'CREATE TRIGGER IF NOT EXISTS products_facets_ad AFTER DELETE ON products BEGIN '
+        + ' '.join(_decrement(f, 'old') for f in FACETS) + ' END',
+    ]
+    for facet, column in SUMMARY_COLUMNS.items():
+        statements.append(
+            f'CREATE TRIGGER IF NOT EXISTS products_facets_au_{facet} '
+            f'AFTER UPDATE OF {column} ON products '
+            f'WHEN {_summary_expr(facet, "old")} IS NOT {_summary_expr(facet, "new")} BEGIN '
+            f'{_decrement(facet, "old")} {_increment(facet, "new")} END'
+        )
+    # A pair involves two columns, so one trigger moves all of a row's pairs
+    # at once; per-column triggers would count a two-column update twice
+    changed = ' OR '.join(f'{_summary_expr(f, "old")} IS NOT {_summary_expr(f, "new")}' for f in FACETS)
+    statements += [
+        'CREATE TRIGGER IF NOT EXISTS products_facet_pairs_ai AFTER INSERT ON products BEGIN '
+        f'{_increment_pairs("new")} END',
+        'CREATE TRIGGER IF NOT EXISTS products_facet_pairs_ad AFTER DELETE ON products BEGIN '
+        f'{_decrement_pairs("old")} END',
+        f'CREATE TRIGGER IF NOT EXISTS products_facet_pairs_au '
+        f'AFTER UPDATE OF {", ".join(SUMMARY_COLUMNS.values())} ON products WHEN {changed} BEGIN '
+        f'{_decrement_pairs("old")} {_increment_pairs("new")} END',
+    ]
+    return statements
+
+
+SUMMARY_SETUP = _summary_setup()
+SUMMARY_TRIGGERS = ['products_facets_ai', 'products_facets_ad'] + \
+    [f'products_facets_au_{facet}' for facet in SUMMARY_COLUMNS] + \
+    ['products_facet_pairs_ai', 'products_facet_pairs_ad', 'products_facet_pairs_au']
+SUMMARY_TABLES = ['product_facet_counts', 'product_facet_pairs']
+
+
+def _rebuild_pairs(conn):
+    conn.exec_driver_sql('DELETE FROM product_facet_pairs')
+    for by, facet in FACET_PAIRS:
+        values, present = _pair_values(by, facet, 'products')
+        conn.exec_driver_sql(
+            f"INSERT INTO product_facet_pairs (by_facet, by_value, facet, value, n) "
+            f"SELECT {values}, COUNT(*) FROM products WHERE {present} GROUP BY 2, 4"
+        )
+
+
+def rebuild_summary(conn):
+    """Recount ``product_facet_counts`` and ``product_facet_pairs`` from scratch."""
+    conn.exec_driver_sql('DELETE FROM product_facet_counts')
+    for facet in FACETS:
+        expr = _summary_expr(facet, 'products')
+        conn.exec_driver_sql(
+            f"INSERT INTO product_facet_counts (facet, value, n) "
+            f"SELECT '{facet}', CAST({expr} AS TEXT), COUNT(*) FROM products "
+            f"WHERE {expr} IS NOT NULL GROUP BY 2"
+        )
+    _rebuild_pairs(conn)
+
+
+def install_summary(conn):
+    existing = {name for (name,) in conn.exec_driver_sql(
+        "SELECT name FROM sqlite_master WHERE type='table' AND name IN ('product_facet_counts', 'product_facet_pairs')"
+    )}
+    for statement in SUMMARY_SETUP:
+        conn.exec_driver_sql(statement)
+    if 'product_facet_counts' not in existing:
+        rebuild_summary(conn)
+    elif 'product_facet_pairs' not in existing:
+        _rebuild_pairs(conn)
+
+
+_summary_ready = set()
+_summary_lock = threading.Lock()
+
+
+def _ensure_summary():
+    engine = db.engine
+    if engine.url not in _summary_ready:
+        with _summary_lock:
+            if engine.url not in _summary_ready:
+                with engine.begin() as conn:
+                    install_summary(conn)
+                _summary_ready.add(engine.url)
+
+
+def catalog_facet_counts(facets=None, selected=None):
+    """Facet counts for the whole, unfiltered catalog."""
+    facets = list(facets or FACETS)
+    selected = selected or {}
+    if db.engine.dialect.name != 'sqlite':
+        return facet_counts(Product.query, facets=facets, selected=selected)
+
+    _ensure_summary()
+    rows = db.session.execute(
+        text('SELECT facet, value, n FROM product_facet_counts WHERE n > 0 AND facet IN :facets')
+        .bindparams(bindparam('facets', expanding=True)),
+        {'facets': facets},
+    )
+    return _collect(rows, facets, selected)
+
+
+def pinned_facet_counts(facet, value, facets=None, selected=None):
+    """Facet counts and the total for the catalog narrowed to ``facet = value`` alone.
+
+    Returns ``(counts, total)`` like :func:`facet_counts` plus the number of
+    matching products, both read from the summary tables, or None when the
+    database has none. ``facet``'s own counts are the catalog's, as in a
+    disjunctive :func:`facet_counts`.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return None
+    facets = list(facets or FACETS)
+    selected = selected or {}
+    value = _as_text(value)
+
+    _ensure_summary()
+    rows = db.session.execute(
+        text('SELECT facet, value, n FROM product_facet_counts WHERE facet = :by AND n > 0 '
+             'UNION ALL '
+             'SELECT facet, value, n FROM product_facet_pairs '
+             'WHERE by_facet = :by AND by_value = :by_value AND facet IN :facets AND n > 0')
+        .bindparams(bindparam('facets', expanding=True)),
+        {'by': facet, 'by_value': value, 'facets': facets},
+    ).all()
+    total = next((n for name, row_value, n in rows if name == facet and row_value == value), 0)
+    if facet not in facets:
+        rows = [row for row in rows if row[0] != facet]
+    return _collect(rows, facets, selected), total
+
+
+for _statement in SUMMARY_SETUP:
+    event.listen(Product.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _table in SUMMARY_TABLES:
+    event.listen(Product.__table__, 'before_drop',
+                 DDL(f'DROP TABLE IF EXISTS {_table}').execute_if(dialect='sqlite'))
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Synthetic data generator for load testing.
+
+Unlike create_sample_data.py (a small curated catalog), this writes rows with
+batched Core ``INSERT`` executemany calls, assigns primary keys itself and
+dedups with per-user in-memory sets, so it scales to millions of rows:
+
+    python generate_data.py --products 1000000 --reviews 10000000 --users 50000
+
+Output is fully determined by ``--seed``. Passwords use a single cheap hash
+shared by every generated user unless ``--password-mode secure`` is given.
+"""
+
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, inspect, select
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from models import (db, User, Category, Product, ProductReview, Wishlist,
+                    CartItem, Order, OrderItem, ProductSales, Reservation, Job, bump_catalog_version)
+from rankings import rebuild_sales
+from search_index import FTS5Backend
+import facets
+
+FIXTURE_PASSWORD = 'password123'
+
+ADJECTIVES = ['Premium', 'Classic', 'Wireless', 'Smart', 'Compact', 'Deluxe', 'Eco', 'Ultra',
+              'Portable', 'Vintage', 'Modern', 'Rugged', 'Organic', 'Pro', 'Mini', 'Essential']
+NOUNS = ['Headphones', 'Laptop', 'T-Shirt', 'Jeans', 'Novel', 'Mug', 'Lamp', 'Yoga Mat',
+         'Backpack', 'Watch', 'Camera', 'Sneakers', 'Blender', 'Desk', 'Speaker', 'Jacket',
+         'Notebook', 'Kettle', 'Bicycle', 'Tent']
+BRANDS = ['SoundMax', 'TechPhone', 'CompuTech', 'StyleWear', 'DenimCo', 'TechBooks',
+          'HomeStyle', 'LightCraft', 'FitGear', 'FlexFit', 'Nordic', 'Acme']
+ROOT_CATEGORIES = ['Electronics', 'Clothing', 'Books', 'Home', 'Sports', 'Toys', 'Garden', 'Beauty']
+REVIEW_TITLES = ['Excellent Purchase!', 'Highly Recommended', 'Great Quality', 'Good value',
+                 'Not bad', 'Could be better', 'Disappointed', 'Love It!']
+REVIEW_COMMENTS = ['Exactly what I was looking for.', 'Fast shipping and well packaged.',
+                   'Does the job.', 'Would buy again.', 'Quality could be better.',
+                   'Better than expected.']
+
+
+class Loader:
+    def __init__(self, engine, batch_size, verbose=True):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.verbose = verbose
+
+    def next_id(self, model):
+        with self.engine.connect() as conn:
+            return (conn.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+    def load(self, model, rows):
+        """Insert ``rows`` (an iterable of dicts) in executemany batches."""
+        table = model.__table__
+        started = time.perf_counter()
+        total = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                total += self.insert(table, batch)
+                batch = []
+        if batch:
+            total += self.insert(table, batch)
+        if self.verbose:
+            elapsed = time.perf_counter() - started
+            rate = total / elapsed if elapsed else total
+            print(f'   - {total:>10,} {table.name} in {elapsed:6.1f}s ({rate:,.0f} rows/s)')
+        return total
+
+    def insert(self, table, batch):
+        with self.engine.begin() as conn:
+            conn.execute(table.insert(), batch)
+        return len(batch)
+
+
+def fixture_password_hash(mode):
+    if mode == 'secure':
+        return generate_password_hash(FIXTURE_PASSWORD)
+    # One iteration: fine for throwaway fixtures, useless for anything real
+    return generate_password_hash(FIXTURE_PASSWORD, method='pbkdf2:sha256:1')
+
+
+def _timestamp(rng, now, max_days):
+    return now - timedelta(seconds=rng.randrange(max_days * 86400))
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+    loader = Loader(db.engine, args.batch_size)
+
+    # Bulk loading is much faster without the per-row FTS and facet-count
+    # triggers; both are rebuilt in one pass at the end instead
+    tables = inspect(db.engine).get_table_names()
+    fts = 'products_fts' in tables
+    facet_summary = 'product_facet_counts' in tables
+    triggers = ['products_fts_ai', 'products_fts_ad', 'products_fts_au'] + facets.SUMMARY_TRIGGERS
+    if fts or facet_summary:
+        with db.engine.begin() as conn:
+            for trigger in triggers:
+                conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {trigger}')
+
+    # Users
+    first_user = loader.next_id(User)
+    password_hash = fixture_password_hash(args.password_mode)
+    user_ids = range(first_user, first_user + args.users)
+    loader.load(User, ({
+        'id': uid,
+        'username': f'user{uid}',
+        'email': f'user{uid}@example.com',
+        'password_hash': password_hash,
+        'first_name': f'First{uid}',
+        'last_name': f'Last{uid}',
+        'created_at': _timestamp(rng, now, 365),
+    } for uid in user_ids))
+
+    # Categories: a few roots, the rest spread underneath them
+    first_category = loader.next_id(Category)
+    categories = []
+    for i in range(args.categories):
+        cid = first_category + i
+        if i < len(ROOT_CATEGORIES) or not categories:
+            name, parent_id = ROOT_CATEGORIES[i % len(ROOT_CATEGORIES)], None
+        else:
+            parent = categories[rng.randrange(len(categories))]
+            name, parent_id = f"{parent['name']} {i}", parent['id']
+        categories.append({'id': cid, 'name': name, 'slug': f'category-{cid}',
+                           'parent_id': parent_id, 'created_at': now})
+    loader.load(Category, categories)
+
+    # Products
+    first_product = loader.next_id(Product)
+    product_ids = range(first_product, first_product + args.products)
+    prices = {}
+
+    def products():
+        for pid in product_ids:
+            category = categories[rng.randrange(len(categories))] if categories else None
+            name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {pid}'
+            price = round(rng.uniform(2, 2000), 2)
+            prices[pid] = price
+            created = _timestamp(rng, now, 730)
+            yield {
+                'id': pid,
+                'name': name,
+                'description': f'{name} by {rng.choice(BRANDS)}. {rng.choice(REVIEW_COMMENTS)}',
+                'price': price,
+                'stock': rng.randrange(0, 500),
+                'category': category['name'].split(' ')[0] if category else None,
+                'category_id': category['id'] if category else None,
+                'brand': rng.choice(BRANDS),
+                'sku': f'SKU-{pid}',
+                'is_featured': rng.random() < 0.02,
+                'discount_percentage': rng.choice([0, 0, 0, 5, 10, 15, 20, 30]),
+                'created_at': created,
+                'updated_at': created,
+                'rating_sum': 0,
+                'rating_count': 0,
+                'rating_avg': 0,
+            }
+    loader.load(Product, products())
+
+    # Reviews: each user reviews a distinct sample of products
+    rating_sum, rating_count = {}, {}
+
+    def per_user_samples(total, cap):
+        if not user_ids or not product_ids or total <= 0:
+            return
+        per_user, extra = divmod(total, len(user_ids))
+        for n, uid in enumerate(user_ids):
+            k = min(per_user + (1 if n < extra else 0), cap, len(product_ids))
+            if k:
+                yield uid, rng.sample(product_ids, k)
+
+    def reviews():
+        rid = loader.next_id(ProductReview)
+        for uid, sampled in per_user_samples(args.reviews, len(product_ids)):
+            for pid in sampled:
+                rating = rng.choices((1, 2, 3, 4, 5), weights=(5, 5, 15, 35, 40))[0]
+                rating_sum[pid] = rating_sum.get(pid, 0) + rating
+                rating_count[pid] = rating_count.get(pid, 0) + 1
+                yield {
+                    'id': rid,
+                    'product_id': pid,
+                    'user_id': uid,
+                    'rating': rating,
+                    'title': rng.choice(REVIEW_TITLES),
+                    'comment': rng.choice(REVIEW_COMMENTS),
+                    'is_verified': rng.random() < 0.5,
+                    'helpful_count': rng.randrange(0, 20),
+                    'created_at': _timestamp(rng, now, 365),
+                    'updated_at': now,
+                }
+                rid += 1
+    loader.load(ProductReview, reviews())
+
+    # Bulk inserts bypass the review listeners, so write the aggregates directly
+    if rating_count:
+        products_table = Product.__table__
+        stmt = (products_table.update()
+                .where(products_table.c.id == db.bindparam('pid'))
+                .values(rating_sum=db.bindparam('rsum'), rating_count=db.bindparam('rcount'),
+                        rating_avg=db.bindparam('ravg')))
+        items = list(rating_count.items())
+        for start in range(0, len(items), args.batch_size):
+            with db.engine.begin() as conn:
+                conn.execute(stmt, [{'pid': pid, 'rsum': rating_sum[pid], 'rcount': count,
+                                     'ravg': rating_sum[pid] / count}
+                                    for pid, count in items[start:start + args.batch_size]])
+
+    # Wishlists and carts: a handful of distinct products per user
+    def user_products(model, total, cap, extra):
+        next_id = loader.next_id(model)
+        for uid, sampled in per_user_samples(total, cap):
+            for pid in sampled:
+                row = {'id': next_id, 'user_id': uid, 'product_id': pid,
+                       'created_at': _timestamp(rng, now, 60)}
+                row.update(extra())
+                yield row
+                next_id += 1
+    loader.load(Wishlist, user_products(Wishlist, args.wishlists, 50, dict))
+    loader.load(CartItem, user_products(CartItem, args.carts, 20,
+                                        lambda: {'quantity': rng.randint(1, 3)}))
+
+    # Orders with 1-5 lines each
+    if args.orders and user_ids and product_ids:
+        first_order = loader.next_id(Order)
+        first_item = loader.next_id(OrderItem)
+        order_rows, item_rows = [], []
+
+        def flush():
+            loader.insert(Order.__table__, order_rows)
+            if item_rows:
+                loader.insert(OrderItem.__table__, item_rows)
+            order_rows.clear()
+            item_rows.clear()
+
+        started = time.perf_counter()
+        item_id = first_item
+        for oid in range(first_order, first_order + args.orders):
+            created = _timestamp(rng, now, 365)
+            total = 0.0
+            for pid in rng.sample(product_ids, min(rng.randint(1, 5), len(product_ids))):
+                quantity = rng.randint(1, 3)
+                price = prices.get(pid, 10.0)
+                total += price * quantity
+                item_rows.append({'id': item_id, 'order_id': oid, 'product_id': pid,
+                                  'quantity': quantity, 'price': price, 'created_at': created})
+                item_id += 1
+            order_rows.append({'id': oid, 'user_id': rng.choice(user_ids), 'total_amount': round(total, 2),
+                               'status': rng.choice(['pending', 'confirmed', 'fulfilled']),
+                               'created_at': created})
+            if len(item_rows) >= args.batch_size:
+                flush()
+        if order_rows:
+            flush()
+        elapsed = time.perf_counter() - started
+        print(f'   - {args.orders:>10,} order ({item_id - first_item:,} order_item) in {elapsed:6.1f}s')
+
+    if fts:
+        started = time.perf_counter()
+        with db.engine.begin() as conn:
+            FTS5Backend().install(conn)
+            conn.exec_driver_sql("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        print(f'   - rebuilt search index in {time.perf_counter() - started:6.1f}s')
+
+    if facet_summary:
+        started = time.perf_counter()
+        with db.engine.begin() as conn:
+            facets.install_summary(conn)
+            facets.rebuild_summary(conn)
+        print(f'   - rebuilt facet counts in {time.perf_counter() - started:6.1f}s')
+
+    if args.orders and 'product_sales' in tables:
+        started = time.perf_counter()
+        rebuild_sales()
+        print(f'   - rebuilt sales rankings in {time.perf_counter() - started:6.1f}s')
+
+
+def reset_data():
+    # Children first so foreign keys are never left dangling
+    for model in (Job, ProductSales, OrderItem, Order, Reservation, CartItem, Wishlist, ProductReview, Product, Category, User):
+        db.session.query(model).delete()
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic e-commerce data for load testing')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--categories', type=int, default=50)
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--reviews', type=int, default=50000)
+    parser.add_argument('--wishlists', type=int, default=5000)
+    parser.add_argument('--carts', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--password-mode', choices=['fast', 'secure'], default='fast',
+                        help="'fast' shares one single-iteration hash across all users")
+    parser.add_argument('--reset', action='store_true', help='delete existing data first')
+    args = parser.parse_args()
+
+    with create_app().app_context():
+        db.create_all()
+        if args.reset:
+            reset_data()
+        started = time.perf_counter()
+        print('📦 Generating data:')
+        generate(args)
+        # The bulk loads bypass the session hooks; retire ETags issued for the old catalog
+        with db.engine.begin() as conn:
+            bump_catalog_version(conn)
+        print(f'✅ Done in {time.perf_counter() - started:.1f}s '
+              f'(users log in with password {FIXTURE_PASSWORD!r})')
+
+
+if __name__ == '__main__':
+    main()
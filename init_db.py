@@ -1,8 +1,8 @@
-from app import app
+from app import create_app
 from models import db, Product, User
 
 def init_db():
-    with app.app_context():
+    with create_app().app_context():
         # Create all tables
         db.create_all()
         
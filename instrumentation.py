@@ -0,0 +1,298 @@
+"""
+Request and SQL instrumentation.
+
+``instrumentation.init_app(app)`` times every request and, within it, every
+SQL statement (``before/after_cursor_execute`` on all engines) and template
+render. Per route it records:
+
+* ``http_request_duration_seconds``  - latency histogram
+* ``http_requests_total``            - by status code
+* ``sql_statements_per_request``     - histogram of statement counts
+* ``sql_duration_seconds_total``     - time spent in the database
+* ``template_render_seconds``        - histogram of render time
+* ``sql_repeated_statements_total``  - likely N+1 patterns: the same SQL run
+                                       ``N_PLUS_ONE_THRESHOLD`` or more times
+                                       in one request (each is also logged
+                                       once per process)
+
+Everything is served in the Prometheus text format at ``/metrics``, together
+with the job queue gauges. Values are per process; with several workers each
+one has to be scraped. The metrics endpoints only exist once ``METRICS_TOKEN``
+is set, and scrapers must send ``Authorization: Bearer <METRICS_TOKEN>``. ``SERVER_TIMING = True`` also adds a ``Server-Timing``
+header (app, db and template time) that browser dev tools can show.
+"""
+
+import bisect
+import functools
+import hmac
+import logging
+import threading
+import time
+from collections import Counter as Tally
+
+from flask import abort, before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+log = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.label_names = name, help, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield self.name, _labels(self.label_names, labels), value
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *labels, value):
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labels, (list(b), s, n)) for labels, (b, s, n) in self._values.items())
+        for labels, (buckets, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, buckets):
+                cumulative += n
+                yield (f'{self.name}_bucket',
+                       _labels(self.label_names, labels, [('le', _number(bound))]), cumulative)
+            yield f'{self.name}_bucket', _labels(self.label_names, labels, [('le', '+Inf')]), count
+            yield f'{self.name}_sum', _labels(self.label_names, labels), total
+            yield f'{self.name}_count', _labels(self.label_names, labels), count
+
+
+class Gauge:
+    """A value read from ``callback`` at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, callback, labels=()):
+        self.name, self.help, self.callback, self.label_names = name, help, callback, tuple(labels)
+
+    def samples(self):
+        for labels, value in self.callback():
+            yield self.name, _labels(self.label_names, labels), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception:
+                log.exception('collecting %s failed', metric.name)
+                continue
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(f'{name}{labels} {_number(value)}' for name, labels, value in samples)
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_latency = registry.add(Histogram(
+    'http_request_duration_seconds', 'Request latency by route', ('route', 'method')))
+request_count = registry.add(Counter(
+    'http_requests_total', 'Requests by route and status', ('route', 'method', 'status')))
+statements_per_request = registry.add(Histogram(
+    'sql_statements_per_request', 'SQL statements issued per request', ('route',), STATEMENT_BUCKETS))
+sql_time = registry.add(Counter(
+    'sql_duration_seconds_total', 'Time spent executing SQL', ('route',)))
+render_time = registry.add(Histogram(
+    'template_render_seconds', 'Template render time per request', ('route',)))
+repeated_statements = registry.add(Counter(
+    'sql_repeated_statements_total', 'Statements repeated within one request (likely N+1)', ('route',)))
+
+
+class RequestProfile:
+    __slots__ = ('started', 'sql_count', 'sql_seconds', 'statements', 'render_seconds', 'render_stack')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_seconds = 0.0
+        self.statements = Tally()
+        self.render_seconds = 0.0
+        self.render_stack = []
+
+
+def current_profile():
+    if has_request_context():
+        return g.get('_profile')
+    return None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['_query_started'].pop()
+    profile = current_profile()
+    if profile is not None:
+        profile.sql_count += 1
+        profile.sql_seconds += time.perf_counter() - started
+        profile.statements[statement] += 1
+
+
+def _handle_error(context):
+    stack = context.connection.info.get('_query_started') if context.connection is not None else None
+    if stack:
+        stack.pop()
+
+
+def _before_render(app, template, context, **extra):
+    profile = current_profile()
+    if profile is not None:
+        profile.render_stack.append(time.perf_counter())
+
+
+def _after_render(app, template, context, **extra):
+    profile = current_profile()
+    if profile is not None and profile.render_stack:
+        started = profile.render_stack.pop()
+        # Only the outermost render counts; includes are part of it
+        if not profile.render_stack:
+            profile.render_seconds += time.perf_counter() - started
+
+
+def require_metrics_token(view):
+    """404 unless ``METRICS_TOKEN`` is set, 401 without ``Authorization: Bearer <METRICS_TOKEN>``."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        token = current_app.config.get('METRICS_TOKEN')
+        if not token:
+            abort(404)
+        scheme, _, given = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(given.encode(), token.encode()):
+            abort(401)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+class Instrumentation:
+    def __init__(self, app=None):
+        self._reported = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INSTRUMENTATION', True)
+        app.config.setdefault('SERVER_TIMING', False)
+        app.config.setdefault('N_PLUS_ONE_THRESHOLD', 5)
+        app.extensions['instrumentation'] = self
+        if not app.config['INSTRUMENTATION']:
+            return
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+            event.listen(Engine, 'handle_error', _handle_error)
+        before_render_template.connect(_before_render, app)
+        template_rendered.connect(_after_render, app)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.add_url_rule('/metrics', 'metrics', require_metrics_token(self.metrics_view))
+
+    def _start(self):
+        g._profile = RequestProfile()
+
+    def _finish(self, response):
+        profile = g.pop('_profile', None)
+        if profile is None:
+            return response
+        elapsed = time.perf_counter() - profile.started
+        route = request.endpoint or 'unmatched'
+        method = request.method
+
+        request_latency.observe(route, method, value=elapsed)
+        request_count.inc(route, method, str(response.status_code))
+        statements_per_request.observe(route, value=profile.sql_count)
+        sql_time.inc(route, amount=profile.sql_seconds)
+        if profile.render_seconds:
+            render_time.observe(route, value=profile.render_seconds)
+
+        threshold = current_app.config['N_PLUS_ONE_THRESHOLD']
+        for statement, count in profile.statements.items():
+            if count >= threshold:
+                repeated_statements.inc(route)
+                self._report(route, statement, count)
+
+        if current_app.config['SERVER_TIMING']:
+            response.headers.add('Server-Timing', ', '.join([
+                f'app;dur={elapsed * 1000:.1f}',
+                f'db;dur={profile.sql_seconds * 1000:.1f};desc="{profile.sql_count} queries"',
+                f'tpl;dur={profile.render_seconds * 1000:.1f}',
+            ]))
+        return response
+
+    def _report(self, route, statement, count):
+        key = (route, statement)
+        with self._lock:
+            if key in self._reported:
+                return
+            self._reported.add(key)
+        log.warning('possible N+1 in %s: statement ran %d times in one request: %s',
+                    route, count, ' '.join(statement.split())[:200])
+
+    def metrics_view(self):
+        return current_app.response_class(registry.render(),
+                                          mimetype='text/plain; version=0.0.4')
+
+
+instrumentation = Instrumentation()
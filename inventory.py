@@ -0,0 +1,111 @@
+"""
+Bulk price and stock updates for inventory sync.
+
+:func:`apply_product_updates` takes a list of ``{"id", "price", "stock"}``
+items (either field may be left out) and applies every valid one with a
+single executemany UPDATE in one transaction. Each item gets its own result,
+so one bad row doesn't sink the batch::
+
+    {"id": 7, "status": "updated"}
+    {"id": 8, "status": "not_found"}
+    {"id": 9, "status": "invalid", "message": "stock must be a non-negative integer"}
+
+``stock`` is the on-hand count. Units currently held in carts (see
+``reservations``) are off the shelf already, so they are subtracted before
+the product's available ``stock`` is written.
+"""
+
+from sqlalchemy import bindparam, func, select
+
+from cache import product_tags, tag_session
+from cart_store import notify_price_change
+from models import db, Product, Reservation
+
+products = Product.__table__
+
+FIELDS = {'id', 'price', 'stock'}
+
+
+class BatchTooLarge(ValueError):
+    def __init__(self, limit):
+        self.limit = limit
+        super().__init__(f'A batch can have at most {limit} items')
+
+
+def _validate(item):
+    """The item's ``(id, price, stock)``, or raise ValueError."""
+    if not isinstance(item, dict):
+        raise ValueError('item must be an object')
+    unknown = set(item) - FIELDS
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+    product_id, price, stock = item.get('id'), item.get('price'), item.get('stock')
+    if not isinstance(product_id, int) or isinstance(product_id, bool):
+        raise ValueError('id must be an integer')
+    if price is None and stock is None:
+        raise ValueError('nothing to update: give price and/or stock')
+    if price is not None and (isinstance(price, bool) or not isinstance(price, (int, float)) or price < 0):
+        raise ValueError('price must be a non-negative number')
+    if stock is not None and (isinstance(stock, bool) or not isinstance(stock, int) or stock < 0):
+        raise ValueError('stock must be a non-negative integer')
+    return product_id, price, stock
+
+
+def apply_product_updates(items, max_items):
+    """Apply ``items`` in one transaction; returns one result per item, in order."""
+    if len(items) > max_items:
+        raise BatchTooLarge(max_items)
+
+    results = []
+    updates = {}
+    for item in items:
+        try:
+            product_id, price, stock = _validate(item)
+        except ValueError as e:
+            product_id = item.get('id') if isinstance(item, dict) else None
+            results.append({'id': product_id, 'status': 'invalid', 'message': str(e)})
+            continue
+        if product_id in updates:
+            results.append({'id': product_id, 'status': 'invalid', 'message': 'duplicate id in batch'})
+            continue
+        updates[product_id] = (price, stock)
+        results.append({'id': product_id, 'status': 'updated'})
+
+    if updates:
+        rows = db.session.execute(
+            select(products.c.id, products.c.price, products.c.category, products.c.category_id)
+            .where(products.c.id.in_(list(updates)))
+        ).all()
+        found = {row.id: row for row in rows}
+        held = dict(db.session.execute(
+            select(Reservation.product_id, func.sum(Reservation.quantity))
+            .where(Reservation.product_id.in_(list(found)))
+            .group_by(Reservation.product_id)
+        ).all()) if found else {}
+
+        params = []
+        for product_id, (price, stock) in updates.items():
+            if product_id not in found:
+                continue
+            if stock is not None:
+                stock = max(stock - held.get(product_id, 0), 0)
+            params.append({'b_id': product_id, 'b_price': price, 'b_stock': stock})
+
+        if params:
+            # Missing fields are bound as NULL and keep their current value
+            db.session.execute(
+                products.update()
+                .where(products.c.id == bindparam('b_id'))
+                .values(price=func.coalesce(bindparam('b_price'), products.c.price),
+                        stock=func.coalesce(bindparam('b_stock'), products.c.stock)),
+                params,
+            )
+            tag_session(db.session, set().union(*(product_tags(found[p['b_id']]) for p in params)))
+            if any(p['b_price'] is not None and p['b_price'] != found[p['b_id']].price for p in params):
+                notify_price_change(db.session)
+        db.session.commit()
+
+        for result in results:
+            if result['status'] == 'updated' and result['id'] not in found:
+                result['status'] = 'not_found'
+    return results
@@ -0,0 +1,252 @@
+"""
+Durable background jobs.
+
+Work that doesn't have to finish inside a request is queued as a row in the
+``jobs`` table with :func:`enqueue`. The row is written in the caller's
+transaction, so a job exists exactly when the change that asked for it was
+committed. An optional ``key`` makes enqueueing idempotent: a second job with
+the same key is silently dropped.
+
+A pool of worker threads (:class:`JobQueue`) claims due jobs one at a time
+with a compare-and-set UPDATE, runs the registered task in its own app
+context and marks the job ``done``. A task that raises is retried with
+exponential backoff and jitter until ``max_attempts``, then left ``failed``.
+Jobs whose worker died mid-run are put back after ``JOB_LOCK_TIMEOUT``
+seconds, so tasks must be safe to run more than once.
+
+Web workers start ``JOB_WORKERS`` threads the first time they queue a job;
+``python worker.py`` runs a dedicated pool. :func:`queue_stats` reports
+queue depth and lag; both are also exported on ``/metrics``.
+"""
+
+import json
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import case, delete, event, func, select, update
+from sqlalchemy.orm import Session
+
+from database import upsert_insert
+from instrumentation import Gauge, registry
+from models import db, Job
+
+log = logging.getLogger(__name__)
+
+jobs = Job.__table__
+
+TASKS = {}
+
+
+def task(name, max_attempts=5):
+    """Register a function as the handler for jobs called ``name``."""
+    def decorator(fn):
+        TASKS[name] = (fn, max_attempts)
+        return fn
+    return decorator
+
+
+def enqueue(name, payload=None, key=None, delay=0):
+    """Queue ``name(**payload)`` in the current transaction; caller commits."""
+    if name not in TASKS:
+        raise KeyError(f'Unknown task {name!r}')
+    now = datetime.utcnow()
+    row = {
+        'name': name,
+        'payload': json.dumps(payload or {}),
+        'idempotency_key': key,
+        'status': 'queued',
+        'attempts': 0,
+        'max_attempts': TASKS[name][1],
+        'run_at': now + timedelta(seconds=delay),
+        'created_at': now,
+    }
+    insert = upsert_insert(db.session.get_bind().dialect.name)
+    if key is None:
+        db.session.execute(jobs.insert().values(row))
+    elif insert is not None:
+        db.session.execute(insert(jobs).values(row).on_conflict_do_nothing(index_elements=['idempotency_key']))
+    elif db.session.execute(select(jobs.c.id).where(jobs.c.idempotency_key == key)).first() is None:
+        db.session.execute(jobs.insert().values(row))
+    db.session.info['jobs_enqueued'] = True
+
+
+def queue_stats(now=None):
+    """Queue depth per status, how many are due, and the age of the oldest due job."""
+    now = now or datetime.utcnow()
+    counts = dict(db.session.execute(select(jobs.c.status, func.count()).group_by(jobs.c.status)).all())
+    due, oldest = db.session.execute(
+        select(func.count(), func.min(jobs.c.run_at))
+        .where(jobs.c.status == 'queued', jobs.c.run_at <= now)
+    ).one()
+    stats = {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
+    stats['due'] = due
+    stats['lag_seconds'] = (now - oldest).total_seconds() if oldest is not None else 0.0
+    return stats
+
+
+registry.add(Gauge('jobs', 'Background jobs by status',
+                   lambda: [((k,), v) for k, v in queue_stats().items() if k not in ('due', 'lag_seconds')],
+                   ('status',)))
+registry.add(Gauge('jobs_due', 'Queued jobs whose run time has passed',
+                   lambda: [((), queue_stats()['due'])]))
+registry.add(Gauge('jobs_lag_seconds', 'Age of the oldest due job',
+                   lambda: [((), queue_stats()['lag_seconds'])]))
+
+
+class JobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.threads = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._last_maintenance = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', 2)
+        app.config.setdefault('JOB_POLL_INTERVAL', 1.0)
+        app.config.setdefault('JOB_RETRY_BASE', 2.0)
+        app.config.setdefault('JOB_RETRY_MAX', 3600)
+        app.config.setdefault('JOB_LOCK_TIMEOUT', 300)
+        app.config.setdefault('JOB_RETENTION', 24 * 3600)
+        self.app = app
+        app.extensions['job_queue'] = self
+
+    def notify(self):
+        """Wake idle workers; start the in-process pool on first use."""
+        if not self.threads and self.app is not None and self.app.config['JOB_WORKERS'] > 0:
+            self.start(self.app.config['JOB_WORKERS'])
+        self._wake.set()
+
+    def start(self, workers):
+        with self._lock:
+            if self.threads:
+                return
+            self._stop.clear()
+            prefix = f'{socket.gethostname()}:{os.getpid()}'
+            for i in range(workers):
+                thread = threading.Thread(target=self._run, args=(f'{prefix}:{i}',),
+                                          name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def stop(self, timeout=None):
+        """Let running jobs finish, then stop the workers."""
+        self._stop.set()
+        self._wake.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+
+    def _run(self, worker_id):
+        poll = self.app.config['JOB_POLL_INTERVAL']
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    self._maintenance()
+                    ran = self.run_once(worker_id)
+            except Exception:
+                log.exception('job worker %s failed', worker_id)
+                ran = False
+            if not ran:
+                self._wake.wait(poll)
+                self._wake.clear()
+
+    def _claim(self, worker_id, now):
+        candidate = (select(jobs.c.id)
+                     .where(jobs.c.status == 'queued', jobs.c.run_at <= now)
+                     .order_by(jobs.c.run_at, jobs.c.id)
+                     .limit(1)
+                     .scalar_subquery())
+        statement = (update(jobs)
+                     .where(jobs.c.id == candidate, jobs.c.status == 'queued')
+                     .values(status='running', locked_by=worker_id, locked_at=now,
+                             attempts=jobs.c.attempts + 1))
+        columns = (jobs.c.id, jobs.c.name, jobs.c.payload, jobs.c.attempts, jobs.c.max_attempts)
+        if db.session.get_bind().dialect.update_returning:
+            row = db.session.execute(statement.returning(*columns)).first()
+        else:
+            row = None
+            if db.session.execute(statement).rowcount:
+                row = db.session.execute(select(*columns).where(
+                    jobs.c.status == 'running', jobs.c.locked_by == worker_id, jobs.c.locked_at == now
+                )).first()
+        db.session.commit()
+        return row
+
+    def run_once(self, worker_id='inline'):
+        """Claim and run one due job. Returns False if there was none."""
+        job = self._claim(worker_id, datetime.utcnow())
+        if job is None:
+            return False
+
+        handler = TASKS.get(job.name)
+        try:
+            if handler is None:
+                raise LookupError(f'No task registered as {job.name!r}')
+            handler[0](**json.loads(job.payload))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self._failed(job, e)
+        else:
+            db.session.execute(update(jobs).where(jobs.c.id == job.id)
+                               .values(status='done', finished_at=datetime.utcnow(),
+                                       locked_by=None, last_error=None))
+            db.session.commit()
+        return True
+
+    def _failed(self, job, error):
+        now = datetime.utcnow()
+        if job.attempts >= job.max_attempts:
+            log.error('job %s (%s) failed for good: %r', job.id, job.name, error)
+            values = {'status': 'failed', 'finished_at': now}
+        else:
+            base = self.app.config['JOB_RETRY_BASE']
+            delay = min(base * 2 ** (job.attempts - 1), self.app.config['JOB_RETRY_MAX'])
+            delay *= 1 + random.random()
+            log.warning('job %s (%s) failed, retrying in %.1fs: %r', job.id, job.name, delay, error)
+            values = {'status': 'queued', 'run_at': now + timedelta(seconds=delay)}
+        db.session.execute(update(jobs).where(jobs.c.id == job.id)
+                           .values(locked_by=None, last_error=repr(error)[:2000], **values))
+        db.session.commit()
+
+    def _maintenance(self):
+        """Requeue jobs of dead workers and purge old finished ones, once per poll interval."""
+        now = datetime.utcnow()
+        poll = timedelta(seconds=self.app.config['JOB_POLL_INTERVAL'])
+        with self._lock:
+            if self._last_maintenance is not None and now - self._last_maintenance < poll:
+                return
+            self._last_maintenance = now
+        stale = now - timedelta(seconds=self.app.config['JOB_LOCK_TIMEOUT'])
+        # A job that was running when its worker died counts as a failed attempt
+        db.session.execute(
+            update(jobs)
+            .where(jobs.c.status == 'running', jobs.c.locked_at < stale)
+            .values(status=case((jobs.c.attempts >= jobs.c.max_attempts, 'failed'), else_='queued'),
+                    locked_by=None, last_error='worker lost')
+        )
+        retention = now - timedelta(seconds=self.app.config['JOB_RETENTION'])
+        db.session.execute(delete(jobs).where(jobs.c.status == 'done', jobs.c.finished_at < retention))
+        db.session.commit()
+
+
+job_queue = JobQueue()
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('jobs_enqueued', None):
+        job_queue.notify()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_enqueued(session):
+    session.info.pop('jobs_enqueued', None)
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Database schema migrations.
+
+    python migrate.py upgrade [REV]          # default: head
+    python migrate.py downgrade REV          # REV may be 'base'
+    python migrate.py current
+    python migrate.py history
+    python migrate.py stamp [REV]            # mark the database as REV without running anything
+    python migrate.py upgrade --sql [--from REV]   # print SQL instead of running it (offline)
+
+A brand-new database is created from the models and stamped at head.
+"""
+
+import argparse
+
+from sqlalchemy import inspect
+
+from app import create_app
+from models import db
+import migrations
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Database schema migrations')
+    parser.add_argument('command', choices=['upgrade', 'downgrade', 'current', 'history', 'stamp'])
+    parser.add_argument('revision', nargs='?')
+    parser.add_argument('--sql', action='store_true', help='print SQL instead of executing it')
+    parser.add_argument('--from', dest='start', help='starting revision for --sql')
+    args = parser.parse_args()
+
+    if args.command == 'history':
+        for migration in migrations.load_migrations():
+            print(f'{migration.down_revision or "base"} -> {migration.revision}: {migration.message}')
+        return
+
+    if args.sql:
+        if args.command not in ('upgrade', 'downgrade'):
+            parser.error('--sql only applies to upgrade and downgrade')
+        start = args.start
+        if args.command == 'downgrade' and start is None:
+            start = migrations.load_migrations()[-1].revision
+        target = args.revision or ('head' if args.command == 'upgrade' else 'base')
+        print(migrations.offline_sql(start=start, target=target, direction=args.command))
+        return
+
+    with create_app().app_context():
+        engine = db.engine
+        if args.command == 'current':
+            with engine.connect() as conn:
+                print(migrations.current_revision(conn) or 'base')
+        elif args.command == 'stamp':
+            migrations.stamp(engine, args.revision or 'head')
+        elif args.command == 'upgrade':
+            if 'products' not in inspect(engine).get_table_names():
+                db.create_all()
+                migrations.stamp(engine, 'head')
+                print('Created schema at head')
+                return
+            for migration in migrations.upgrade(engine, args.revision or 'head'):
+                print(f'Upgraded to {migration.revision}: {migration.message}')
+        elif args.command == 'downgrade':
+            if not args.revision:
+                parser.error('downgrade needs a target revision')
+            for migration in migrations.downgrade(engine, args.revision):
+                print(f'Downgraded {migration.revision}: {migration.message}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+"""
+Minimal versioned schema migrations.
+
+Each file in ``migrations/versions`` defines ``revision``, ``down_revision``,
+``upgrade`` and ``downgrade`` (lists of operations below). Operations are
+idempotent when run against a live database, so a schema created by
+``db.create_all()`` can be brought under version control by simply running
+``python migrate.py upgrade``. Every operation can also render itself as
+plain SQL for offline use (``python migrate.py upgrade --sql``).
+"""
+
+import importlib.util
+import os
+
+from sqlalchemy import inspect, text
+
+VERSIONS_DIR = os.path.join(os.path.dirname(__file__), 'versions')
+VERSION_TABLE = 'schema_version'
+
+
+class Operation:
+    def sql(self):
+        raise NotImplementedError
+
+    def should_run(self, conn):
+        return True
+
+    def apply(self, conn):
+        if self.should_run(conn):
+            for statement in self.sql():
+                conn.execute(text(statement))
+
+
+class Execute(Operation):
+    def __init__(self, *statements):
+        self.statements = statements
+
+    def sql(self):
+        return list(self.statements)
+
+
+class AddColumn(Operation):
+    def __init__(self, table, column, ddl):
+        self.table, self.column, self.ddl = table, column, ddl
+
+    def sql(self):
+        return [f'ALTER TABLE "{self.table}" ADD COLUMN {self.column} {self.ddl}']
+
+    def should_run(self, conn):
+        return self.column not in {c['name'] for c in inspect(conn).get_columns(self.table)}
+
+
+class DropColumn(AddColumn):
+    def __init__(self, table, column):
+        super().__init__(table, column, None)
+
+    def sql(self):
+        return [f'ALTER TABLE "{self.table}" DROP COLUMN {self.column}']
+
+    def should_run(self, conn):
+        return not super().should_run(conn)
+
+
+class AlterColumnType(Operation):
+    """Change a column's type. SQLite doesn't enforce VARCHAR lengths, so it is skipped there."""
+
+    def __init__(self, table, column, ddl):
+        self.table, self.column, self.ddl = table, column, ddl
+
+    def sql(self):
+        return [f'ALTER TABLE "{self.table}" ALTER COLUMN {self.column} TYPE {self.ddl}']
+
+    def should_run(self, conn):
+        return conn.dialect.name != 'sqlite'
+
+
+class CreateIndex(Operation):
+    def __init__(self, name, table, columns, unique=False):
+        self.name, self.table, self.columns, self.unique = name, table, columns, unique
+
+    def sql(self):
+        unique = 'UNIQUE ' if self.unique else ''
+        columns = ', '.join(self.columns)
+        return [f'CREATE {unique}INDEX IF NOT EXISTS {self.name} ON "{self.table}" ({columns})']
+
+
+class DropIndex(Operation):
+    def __init__(self, name):
+        self.name = name
+
+    def sql(self):
+        return [f'DROP INDEX IF EXISTS {self.name}']
+
+
+class Migration:
+    def __init__(self, module):
+        self.revision = module.revision
+        self.down_revision = module.down_revision
+        doc = (module.__doc__ or '').strip()
+        self.message = doc.splitlines()[0] if doc else ''
+        self.upgrade = module.upgrade
+        self.downgrade = module.downgrade
+
+
+def load_migrations():
+    """Return migrations ordered from the first to head."""
+    by_parent = {}
+    for filename in sorted(os.listdir(VERSIONS_DIR)):
+        if not filename.endswith('.py') or filename.startswith('_'):
+            continue
+        path = os.path.join(VERSIONS_DIR, filename)
+        spec = importlib.util.spec_from_file_location(f'migrations.versions.{filename[:-3]}', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        migration = Migration(module)
+        if migration.down_revision in by_parent:
+            raise RuntimeError(f'Multiple heads after revision {migration.down_revision!r}')
+        by_parent[migration.down_revision] = migration
+
+    ordered = []
+    parent = None
+    while parent in by_parent:
+        ordered.append(by_parent.pop(parent))
+        parent = ordered[-1].revision
+    if by_parent:
+        raise RuntimeError('Unreachable migrations: ' + ', '.join(m.revision for m in by_parent.values()))
+    return ordered
+
+
+def _ensure_version_table(conn):
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (revision VARCHAR(32) NOT NULL)'))
+
+
+def current_revision(conn):
+    if VERSION_TABLE not in inspect(conn).get_table_names():
+        return None
+    return conn.execute(text(f'SELECT revision FROM {VERSION_TABLE}')).scalar()
+
+
+def _set_revision_sql(revision):
+    statements = [f'DELETE FROM {VERSION_TABLE}']
+    if revision is not None:
+        statements.append(f"INSERT INTO {VERSION_TABLE} (revision) VALUES ('{revision}')")
+    return statements
+
+
+def _set_revision(conn, revision):
+    _ensure_version_table(conn)
+    for statement in _set_revision_sql(revision):
+        conn.execute(text(statement))
+
+
+def _plan(migrations, current, target, direction):
+    revisions = [None] + [m.revision for m in migrations]
+    if target == 'head':
+        target = revisions[-1]
+    elif target == 'base':
+        target = None
+    if target not in revisions:
+        raise ValueError(f'Unknown revision {target!r}')
+    if current not in revisions:
+        raise ValueError(f'Database is at unknown revision {current!r}')
+
+    start, end = revisions.index(current), revisions.index(target)
+    if direction == 'upgrade':
+        return migrations[start:end]
+    return list(reversed(migrations[end:start]))
+
+
+def upgrade(engine, target='head'):
+    migrations = load_migrations()
+    with engine.connect() as conn:
+        current = current_revision(conn)
+    applied = []
+    for migration in _plan(migrations, current, target, 'upgrade'):
+        with engine.begin() as conn:
+            for operation in migration.upgrade:
+                operation.apply(conn)
+            _set_revision(conn, migration.revision)
+        applied.append(migration)
+    return applied
+
+
+def downgrade(engine, target):
+    migrations = load_migrations()
+    with engine.connect() as conn:
+        current = current_revision(conn)
+    applied = []
+    for migration in _plan(migrations, current, target, 'downgrade'):
+        with engine.begin() as conn:
+            for operation in migration.downgrade:
+                operation.apply(conn)
+            _set_revision(conn, migration.down_revision)
+        applied.append(migration)
+    return applied
+
+
+def stamp(engine, target='head'):
+    migrations = load_migrations()
+    revision = migrations[-1].revision if target == 'head' and migrations else target
+    with engine.begin() as conn:
+        _set_revision(conn, None if revision == 'base' else revision)
+
+
+def offline_sql(start=None, target='head', direction='upgrade'):
+    """Render the SQL for a migration range without touching a database."""
+    migrations = load_migrations()
+    lines = [f'CREATE TABLE IF NOT EXISTS {VERSION_TABLE} (revision VARCHAR(32) NOT NULL);']
+    for migration in _plan(migrations, start, target, direction):
+        operations = migration.upgrade if direction == 'upgrade' else migration.downgrade
+        new_revision = migration.revision if direction == 'upgrade' else migration.down_revision
+        lines.append(f'\n-- {direction} {migration.revision}: {migration.message}')
+        lines.append('BEGIN;')
+        for operation in operations:
+            lines.extend(statement + ';' for statement in operation.sql())
+        lines.extend(statement + ';' for statement in _set_revision_sql(new_revision))
+        lines.append('COMMIT;')
+    return '\n'.join(lines)
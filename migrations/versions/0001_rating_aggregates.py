@@ -0,0 +1,29 @@
+"""Add denormalized review aggregates to products
+
+Revision: 0001
+"""
+
+from migrations import AddColumn, CreateIndex, DropColumn, DropIndex, Execute
+
+revision = '0001'
+down_revision = None
+
+upgrade = [
+    AddColumn('products', 'rating_sum', 'INTEGER NOT NULL DEFAULT 0'),
+    AddColumn('products', 'rating_count', 'INTEGER NOT NULL DEFAULT 0'),
+    AddColumn('products', 'rating_avg', 'FLOAT NOT NULL DEFAULT 0'),
+    CreateIndex('ix_products_rating_avg', 'products', ['rating_avg']),
+    Execute(
+        'UPDATE products SET '
+        'rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM product_reviews r WHERE r.product_id = products.id), '
+        'rating_count = (SELECT COUNT(*) FROM product_reviews r WHERE r.product_id = products.id), '
+        'rating_avg = (SELECT COALESCE(AVG(rating), 0) FROM product_reviews r WHERE r.product_id = products.id)'
+    ),
+]
+
+downgrade = [
+    DropIndex('ix_products_rating_avg'),
+    DropColumn('products', 'rating_avg'),
+    DropColumn('products', 'rating_count'),
+    DropColumn('products', 'rating_sum'),
+]
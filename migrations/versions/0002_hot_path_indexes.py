@@ -0,0 +1,44 @@
+"""Composite indexes for cart, review, order and catalog lookups
+
+Revision: 0002
+"""
+
+from migrations import CreateIndex, DropIndex, Execute
+
+revision = '0002'
+down_revision = '0001'
+
+upgrade = [
+    # Merge duplicate cart lines left by racing add_to_cart requests before
+    # (user_id, product_id) becomes unique
+    Execute(
+        'UPDATE cart_item SET quantity = ('
+        'SELECT SUM(c.quantity) FROM cart_item c '
+        'WHERE c.user_id = cart_item.user_id AND c.product_id = cart_item.product_id) '
+        'WHERE id IN (SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id HAVING COUNT(*) > 1)',
+        'DELETE FROM cart_item WHERE id NOT IN (SELECT MIN(id) FROM cart_item GROUP BY user_id, product_id)',
+    ),
+    CreateIndex('ux_cart_item_user_product', 'cart_item', ['user_id', 'product_id'], unique=True),
+    CreateIndex('ix_product_reviews_product_created', 'product_reviews', ['product_id', 'created_at']),
+    CreateIndex('ix_product_reviews_user_product', 'product_reviews', ['user_id', 'product_id']),
+    CreateIndex('ix_products_category_price', 'products', ['category', 'price']),
+    CreateIndex('ix_products_category_id', 'products', ['category_id']),
+    CreateIndex('ix_products_created_at_id', 'products', ['created_at', 'id']),
+    CreateIndex('ix_products_price_id', 'products', ['price', 'id']),
+    CreateIndex('ix_order_user_created', 'order', ['user_id', 'created_at']),
+    CreateIndex('ix_order_item_order_id', 'order_item', ['order_id']),
+    CreateIndex('ix_order_item_product_id', 'order_item', ['product_id']),
+]
+
+downgrade = [
+    DropIndex('ix_order_item_product_id'),
+    DropIndex('ix_order_item_order_id'),
+    DropIndex('ix_order_user_created'),
+    DropIndex('ix_products_price_id'),
+    DropIndex('ix_products_created_at_id'),
+    DropIndex('ix_products_category_id'),
+    DropIndex('ix_products_category_price'),
+    DropIndex('ix_product_reviews_user_product'),
+    DropIndex('ix_product_reviews_product_created'),
+    DropIndex('ux_cart_item_user_product'),
+]
@@ -0,0 +1,17 @@
+"""Index products.updated_at for the API's ETag version query
+
+Revision: 0003
+"""
+
+from migrations import CreateIndex, DropIndex
+
+revision = '0003'
+down_revision = '0002'
+
+upgrade = [
+    CreateIndex('ix_products_updated_at', 'products', ['updated_at']),
+]
+
+downgrade = [
+    DropIndex('ix_products_updated_at'),
+]
@@ -0,0 +1,29 @@
+"""Add the reservations table for cart stock holds
+
+Revision: 0004
+"""
+
+from migrations import CreateIndex, DropIndex, Execute
+
+revision = '0004'
+down_revision = '0003'
+
+upgrade = [
+    Execute(
+        'CREATE TABLE IF NOT EXISTS reservations ('
+        'id INTEGER NOT NULL PRIMARY KEY, '
+        'user_id INTEGER NOT NULL REFERENCES "user" (id), '
+        'product_id INTEGER NOT NULL REFERENCES products (id), '
+        'quantity INTEGER NOT NULL, '
+        'expires_at DATETIME NOT NULL, '
+        'created_at DATETIME)'
+    ),
+    CreateIndex('ux_reservation_user_product', 'reservations', ['user_id', 'product_id'], unique=True),
+    CreateIndex('ix_reservations_expires_at', 'reservations', ['expires_at']),
+]
+
+downgrade = [
+    DropIndex('ix_reservations_expires_at'),
+    DropIndex('ux_reservation_user_product'),
+    Execute('DROP TABLE IF EXISTS reservations'),
+]
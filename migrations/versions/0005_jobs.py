@@ -0,0 +1,34 @@
+"""Add the jobs table for the background job queue
+
+Revision: 0005
+"""
+
+from migrations import CreateIndex, DropIndex, Execute
+
+revision = '0005'
+down_revision = '0004'
+
+upgrade = [
+    Execute(
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        'id INTEGER NOT NULL PRIMARY KEY, '
+        'name VARCHAR(100) NOT NULL, '
+        'payload TEXT NOT NULL, '
+        'idempotency_key VARCHAR(200) UNIQUE, '
+        'status VARCHAR(20) NOT NULL, '
+        'attempts INTEGER NOT NULL, '
+        'max_attempts INTEGER NOT NULL, '
+        'run_at DATETIME NOT NULL, '
+        'locked_by VARCHAR(100), '
+        'locked_at DATETIME, '
+        'last_error TEXT, '
+        'created_at DATETIME, '
+        'finished_at DATETIME)'
+    ),
+    CreateIndex('ix_jobs_status_run_at', 'jobs', ['status', 'run_at']),
+]
+
+downgrade = [
+    DropIndex('ix_jobs_status_run_at'),
+    Execute('DROP TABLE IF EXISTS jobs'),
+]
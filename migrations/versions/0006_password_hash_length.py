@@ -0,0 +1,17 @@
+"""Widen user.password_hash for scrypt hashes
+
+Revision: 0006
+"""
+
+from migrations import AlterColumnType
+
+revision = '0006'
+down_revision = '0005'
+
+upgrade = [
+    AlterColumnType('user', 'password_hash', 'VARCHAR(255)'),
+]
+
+downgrade = [
+    AlterColumnType('user', 'password_hash', 'VARCHAR(128)'),
+]
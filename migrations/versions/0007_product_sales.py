@@ -0,0 +1,33 @@
+"""Add the product_sales table for best-seller and trending rankings
+
+Revision: 0007
+
+Existing orders are counted by ``python backfill_rankings.py``.
+"""
+
+from migrations import CreateIndex, DropIndex, Execute
+
+revision = '0007'
+down_revision = '0006'
+
+upgrade = [
+    Execute(
+        'CREATE TABLE IF NOT EXISTS product_sales ('
+        'product_id INTEGER NOT NULL PRIMARY KEY REFERENCES products (id), '
+        'category_id INTEGER, '
+        'units INTEGER NOT NULL, '
+        'trend_score FLOAT NOT NULL)'
+    ),
+    CreateIndex('ix_product_sales_units', 'product_sales', ['units']),
+    CreateIndex('ix_product_sales_trend', 'product_sales', ['trend_score']),
+    CreateIndex('ix_product_sales_category_units', 'product_sales', ['category_id', 'units']),
+    CreateIndex('ix_product_sales_category_trend', 'product_sales', ['category_id', 'trend_score']),
+]
+
+downgrade = [
+    DropIndex('ix_product_sales_category_trend'),
+    DropIndex('ix_product_sales_category_units'),
+    DropIndex('ix_product_sales_trend'),
+    DropIndex('ix_product_sales_units'),
+    Execute('DROP TABLE IF EXISTS product_sales'),
+]
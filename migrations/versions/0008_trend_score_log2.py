@@ -0,0 +1,21 @@
+"""Store trending scores as log2 so they can't overflow
+
+Revision: 0008
+
+The old linear scores can't be converted with portable SQL, so they are
+reset to "no recent sales"; ``python backfill_rankings.py`` recomputes them
+from ``order_item``.
+"""
+
+from migrations import Execute
+
+revision = '0008'
+down_revision = '0007'
+
+upgrade = [
+    Execute('UPDATE product_sales SET trend_score = -1e9'),
+]
+
+downgrade = [
+    Execute('UPDATE product_sales SET trend_score = 0'),
+]
@@ -0,0 +1,17 @@
+"""Index products by (name, id) for keyset-paginated search sorted by name
+
+Revision: 0009
+"""
+
+from migrations import CreateIndex, DropIndex
+
+revision = '0009'
+down_revision = '0008'
+
+upgrade = [
+    CreateIndex('ix_products_name_id', 'products', ['name', 'id']),
+]
+
+downgrade = [
+    DropIndex('ix_products_name_id'),
+]
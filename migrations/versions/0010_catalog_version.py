@@ -0,0 +1,26 @@
+"""Add the catalog_version counter behind the catalog API's ETag
+
+Revision: 0010
+
+Replaces the ``max(updated_at), count(id)`` scan of ``products`` on every
+catalog API request with a primary-key lookup.
+"""
+
+from migrations import Execute
+
+revision = '0010'
+down_revision = '0009'
+
+upgrade = [
+    Execute(
+        'CREATE TABLE IF NOT EXISTS catalog_version ('
+        'id INTEGER NOT NULL PRIMARY KEY, '
+        'version INTEGER NOT NULL)',
+        'INSERT INTO catalog_version (id, version) SELECT 1, 1 '
+        'WHERE NOT EXISTS (SELECT 1 FROM catalog_version WHERE id = 1)',
+    ),
+]
+
+downgrade = [
+    Execute('DROP TABLE IF EXISTS catalog_version'),
+]
@@ -1,15 +1,17 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event, inspect
 from datetime import datetime
+from database import RoutingSession, upsert_insert
+from passwords import passwords
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(80), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128))
+    password_hash = db.Column(db.String(255))
     first_name = db.Column(db.String(50))
     last_name = db.Column(db.String(50))
     phone = db.Column(db.String(20))
@@ -21,10 +23,10 @@ class User(UserMixin, db.Model):
     wishlist = db.relationship('Wishlist', backref='user', lazy=True, cascade='all, delete-orphan')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify(self.password_hash, password)
 
 class Category(db.Model):
     __tablename__ = 'categories'
@@ -50,7 +52,7 @@ class Product(db.Model):
     stock = db.Column(db.Integer, nullable=False)
     image_url = db.Column(db.String(200))
     category = db.Column(db.String(50))  # Keep for backward compatibility
-    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
+    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), index=True)
     brand = db.Column(db.String(100))
     sku = db.Column(db.String(50), unique=True)
     weight = db.Column(db.Float)
@@ -59,7 +61,12 @@ class Product(db.Model):
     is_featured = db.Column(db.Boolean, default=False)
     discount_percentage = db.Column(db.Float, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
+    
+    # Review aggregates, maintained by the ProductReview listeners below
+    rating_sum = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rating_avg = db.Column(db.Float, nullable=False, default=0, server_default='0', index=True)
     
     # Relationships
     cart_items = db.relationship('CartItem', backref='product', lazy=True)
@@ -68,6 +75,13 @@ class Product(db.Model):
     reviews = db.relationship('ProductReview', backref='product', lazy=True, cascade='all, delete-orphan')
     wishlist_items = db.relationship('Wishlist', backref='product', lazy=True, cascade='all, delete-orphan')
     
+    __table_args__ = (
+        db.Index('ix_products_category_price', 'category', 'price'),
+        db.Index('ix_products_created_at_id', 'created_at', 'id'),
+        db.Index('ix_products_price_id', 'price', 'id'),
+        db.Index('ix_products_name_id', 'name', 'id'),
+    )
+    
     @property
     def discounted_price(self):
         if self.discount_percentage > 0:
@@ -76,13 +90,11 @@ class Product(db.Model):
     
     @property
     def average_rating(self):
-        if self.reviews:
-            return sum(review.rating for review in self.reviews) / len(self.reviews)
-        return 0
+        return self.rating_avg or 0
     
     @property
     def review_count(self):
-        return len(self.reviews)
+        return self.rating_count or 0
 
 class ProductImage(db.Model):
     __tablename__ = 'product_images'
@@ -108,6 +120,11 @@ class ProductReview(db.Model):
     helpful_count = db.Column(db.Integer, default=0)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ix_product_reviews_product_created', 'product_id', 'created_at'),
+        db.Index('ix_product_reviews_user_product', 'user_id', 'product_id'),
+    )
 
 class Wishlist(db.Model):
     __tablename__ = 'wishlist'
@@ -127,10 +144,28 @@ class CartItem(db.Model):
     product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ux_cart_item_user_product', 'user_id', 'product_id', unique=True),)
 
     def get_total(self):
         return self.product.price * self.quantity
 
+class Reservation(db.Model):
+    """Units of a product held for a user's cart until ``expires_at``."""
+    __tablename__ = 'reservations'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.Index('ux_reservation_user_product', 'user_id', 'product_id', unique=True),
+        db.Index('ix_reservations_expires_at', 'expires_at'),
+    )
+
 class Order(db.Model):
     __tablename__ = 'order'
     
@@ -140,13 +175,127 @@ class Order(db.Model):
     status = db.Column(db.String(20), default='pending')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     order_items = db.relationship('OrderItem', backref='order', lazy=True)
+    
+    __table_args__ = (db.Index('ix_order_user_created', 'user_id', 'created_at'),)
+
+class Job(db.Model):
+    """A unit of background work; see ``jobs.py``."""
+    __tablename__ = 'jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    idempotency_key = db.Column(db.String(200), unique=True)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    
+    __table_args__ = (db.Index('ix_jobs_status_run_at', 'status', 'run_at'),)
 
 class OrderItem(db.Model):
     __tablename__ = 'order_item'
     
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), nullable=False, index=True)
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow) 
\ No newline at end of file
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ProductSales(db.Model):
+    """Running sales counters per product, maintained by ``rankings.py``."""
+    __tablename__ = 'product_sales'
+    
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id'), primary_key=True)
+    category_id = db.Column(db.Integer)  # the product's, as of its last sale
+    units = db.Column(db.Integer, nullable=False, default=0)
+    trend_score = db.Column(db.Float, nullable=False, default=0)  # log2 of forward-decayed units
+    
+    __table_args__ = (
+        db.Index('ix_product_sales_units', 'units'),
+        db.Index('ix_product_sales_trend', 'trend_score'),
+        db.Index('ix_product_sales_category_units', 'category_id', 'units'),
+        db.Index('ix_product_sales_category_trend', 'category_id', 'trend_score'),
+    )
+
+class CatalogVersion(db.Model):
+    """One row counting committed catalog changes; the catalog API's ETag.
+
+    Bumped by ``cache.py`` whenever a transaction invalidates the catalog tag,
+    so checking it is a primary-key lookup instead of a scan of ``products``.
+    """
+    __tablename__ = 'catalog_version'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+CATALOG_VERSION_ID = 1
+
+def bump_catalog_version(connection):
+    """Advance the catalog version inside ``connection``'s transaction."""
+    table = CatalogVersion.__table__
+    insert = upsert_insert(connection.dialect.name)
+    if insert is not None:
+        statement = insert(table).values(id=CATALOG_VERSION_ID, version=1)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[table.c.id], set_={'version': table.c.version + 1}))
+        return
+    if not connection.execute(table.update().where(table.c.id == CATALOG_VERSION_ID)
+                              .values(version=table.c.version + 1)).rowcount:
+        connection.execute(table.insert().values(id=CATALOG_VERSION_ID, version=1))
+
+def _adjust_rating(connection, product_id, delta_sum, delta_count):
+    products = Product.__table__
+    new_sum = products.c.rating_sum + delta_sum
+    new_count = products.c.rating_count + delta_count
+    connection.execute(
+        products.update()
+        .where(products.c.id == product_id)
+        .values(
+            rating_sum=new_sum,
+            rating_count=new_count,
+            rating_avg=db.case((new_count > 0, db.cast(new_sum, db.Float) / new_count), else_=0),
+        )
+    )
+
+@event.listens_for(ProductReview, 'after_insert')
+def _review_inserted(mapper, connection, review):
+    _adjust_rating(connection, review.product_id, review.rating, 1)
+
+@event.listens_for(ProductReview, 'after_delete')
+def _review_deleted(mapper, connection, review):
+    _adjust_rating(connection, review.product_id, -review.rating, -1)
+
+@event.listens_for(ProductReview, 'after_update')
+def _review_updated(mapper, connection, review):
+    state = inspect(review)
+    rating = state.attrs.rating.history
+    product = state.attrs.product_id.history
+    if not (rating.has_changes() or product.has_changes()):
+        return
+    old_rating = rating.deleted[0] if rating.deleted else review.rating
+    old_product = product.deleted[0] if product.deleted else review.product_id
+    _adjust_rating(connection, old_product, -old_rating, -1)
+    _adjust_rating(connection, review.product_id, review.rating, 1)
+
+def backfill_rating_aggregates():
+    """Recompute rating_sum/rating_count/rating_avg for every product."""
+    products = Product.__table__
+    reviews = ProductReview.__table__
+    rating_sum = (db.select(db.func.coalesce(db.func.sum(reviews.c.rating), 0))
+                  .where(reviews.c.product_id == products.c.id).scalar_subquery())
+    rating_count = (db.select(db.func.count(reviews.c.id))
+                    .where(reviews.c.product_id == products.c.id).scalar_subquery())
+    rating_avg = (db.select(db.func.coalesce(db.func.avg(reviews.c.rating), 0))
+                  .where(reviews.c.product_id == products.c.id).scalar_subquery())
+    result = db.session.execute(products.update().values(
+        rating_sum=rating_sum, rating_count=rating_count, rating_avg=rating_avg))
+    bump_catalog_version(db.session.connection())
+    db.session.commit()
+    return result.rowcount
@@ -0,0 +1,146 @@
+"""
+Checkout: turn a user's cart into an order in a single transaction.
+
+Units already held for the user at add-to-cart time (see ``reservations``)
+are claimed as they are. Anything not covered by a hold is reserved with one
+conditional UPDATE (``stock = stock - q WHERE id = :id AND stock >= q``)
+covering every such product, so two concurrent checkouts can never both take
+the last unit. If any line can't be satisfied nothing is written. Transient lock errors
+("database is locked") roll back and retry the whole transaction.
+
+Everything after the order is written runs as background jobs queued in the
+same transaction: a worker confirms the order and then fulfils it, moving
+``Order.status`` through ``pending -> confirmed -> fulfilled``.
+"""
+
+import random
+import time
+
+from sqlalchemy import case, insert, update
+from sqlalchemy.exc import OperationalError
+
+from cache import product_tags, tag_session
+from cart_store import cart_store
+from jobs import enqueue, task
+from models import db, Order, OrderItem, Product
+from rankings import record_sales
+from reservations import give_back, stock_holds
+
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.02  # seconds, doubled on every attempt
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCartError(CheckoutError):
+    def __init__(self):
+        super().__init__('Your cart is empty!')
+
+
+class OutOfStockError(CheckoutError):
+    def __init__(self, products):
+        self.products = products
+        names = ', '.join(p.name for p in products)
+        super().__init__(f'Not enough stock available for: {names}')
+
+
+def _is_lock_error(error):
+    message = str(error.orig).lower() if error.orig is not None else ''
+    return 'locked' in message or 'busy' in message or 'deadlock' in message
+
+
+def _reserve_stock(quantities):
+    """Decrement stock for every product at once; all-or-nothing."""
+    ids = list(quantities)
+    wanted = case(quantities, value=Product.id)
+    result = db.session.execute(
+        Product.__table__.update()
+        .where(Product.id.in_(ids), Product.stock >= wanted)
+        .values(stock=Product.stock - wanted)
+    )
+    return result.rowcount == len(ids)
+
+
+def _place_order(user_id):
+    quantities = cart_store.items(user_id)
+    products = {p.id: p for p in Product.query.filter(Product.id.in_(list(quantities)))} if quantities else {}
+    # Lines whose product has since been deleted are left out
+    quantities = {pid: q for pid, q in quantities.items() if pid in products}
+    if not quantities:
+        raise EmptyCartError()
+
+    held = stock_holds.claim(user_id, quantities)
+    missing = {pid: q - held.get(pid, 0) for pid, q in quantities.items() if q > held.get(pid, 0)}
+    if missing and not _reserve_stock(missing):
+        db.session.rollback()
+        products = Product.query.filter(Product.id.in_(list(missing))).all()
+        raise OutOfStockError([p for p in products if p.stock < missing[p.id]])
+    # Held more than is being ordered: the rest goes back on the shelf
+    give_back({pid: q - quantities[pid] for pid, q in held.items()})
+    # The stock UPDATE bypasses the ORM, so report the cached pages it affects
+    tag_session(db.session, set().union(*(product_tags(products[pid]) for pid in quantities)))
+
+    order = Order(user_id=user_id,
+                  total_amount=sum(products[pid].price * q for pid, q in quantities.items()))
+    db.session.add(order)
+    db.session.flush()
+    # One executemany for all lines, rather than an INSERT per line from the ORM
+    db.session.execute(insert(OrderItem), [
+        {'order_id': order.id, 'product_id': product_id, 'quantity': quantity,
+         'price': products[product_id].price}
+        for product_id, quantity in quantities.items()
+    ])
+    record_sales(db.session, quantities)
+
+    # Only the quantities read above; anything added meanwhile stays in the cart
+    cart_store.consume(user_id, quantities)
+
+    enqueue('orders.confirm', {'order_id': order.id}, key=f'order:{order.id}:confirm')
+    db.session.commit()
+    return order
+
+
+def place_order(user_id, max_attempts=MAX_ATTEMPTS):
+    """Check out ``user_id``'s cart and return the new :class:`Order`.
+
+    Raises :class:`EmptyCartError` or :class:`OutOfStockError`; in both
+    cases the session has been rolled back and the cart is untouched.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return _place_order(user_id)
+        except CheckoutError:
+            db.session.rollback()
+            raise
+        except OperationalError as e:
+            db.session.rollback()
+            if attempt == max_attempts or not _is_lock_error(e):
+                raise
+            time.sleep(RETRY_BASE_DELAY * (2 ** (attempt - 1)) * (1 + random.random()))
+        except Exception:
+            db.session.rollback()
+            raise
+
+
+def _advance(order_id, current, new):
+    """Move an order from ``current`` to ``new``; False if it wasn't ``current``."""
+    result = db.session.execute(
+        update(Order.__table__)
+        .where(Order.__table__.c.id == order_id, Order.__table__.c.status == current)
+        .values(status=new)
+    )
+    return result.rowcount == 1
+
+
+@task('orders.confirm')
+def confirm_order(order_id):
+    # Post-order work (confirmation email, invoice, analytics) hangs off here
+    if _advance(order_id, 'pending', 'confirmed'):
+        enqueue('orders.fulfil', {'order_id': order_id}, key=f'order:{order_id}:fulfil')
+
+
+@task('orders.fulfil')
+def fulfil_order(order_id):
+    _advance(order_id, 'confirmed', 'fulfilled')
@@ -0,0 +1,152 @@
+"""
+Keyset (cursor) pagination for product listings.
+
+Instead of OFFSET, each page is fetched with a ``WHERE (sort_key, id) > cursor``
+predicate, so the cost of a page stays the same no matter how deep the user pages.
+Cursors are opaque url-safe tokens; clients should pass them back unchanged.
+"""
+
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from models import Product
+
+# sort name -> (column, descending)
+SORT_KEYS = {
+    'newest': (Product.created_at, True),
+    'price_asc': (Product.price, False),
+    'price_desc': (Product.price, True),
+    'rating': (Product.rating_avg, True),
+    'name': (Product.name, False),
+}
+
+DEFAULT_SORT = 'newest'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class Page:
+    def __init__(self, items, sort, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.sort = sort
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def _dump_value(value):
+    if isinstance(value, datetime):
+        return {'dt': value.isoformat()}
+    return value
+
+
+def _load_value(value, column):
+    """The cursor's JSON key value as ``column``'s Python type; ValueError otherwise."""
+    python_type = column.type.python_type
+    if python_type is datetime:
+        if not (isinstance(value, dict) and isinstance(value.get('dt'), str)):
+            raise ValueError('expected a timestamp')
+        return datetime.fromisoformat(value['dt'])
+    if python_type is str:
+        if not isinstance(value, str):
+            raise ValueError('expected a string')
+        return value
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError('expected a number')
+    return value
+
+
+def encode_cursor(sort, direction, product):
+    column, _ = SORT_KEYS[sort]
+    payload = {
+        's': sort,
+        'd': direction,
+        'k': [_dump_value(getattr(product, column.key)), product.id],
+    }
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        sort, direction, (value, last_id) = payload['s'], payload['d'], payload['k']
+        if sort not in SORT_KEYS or direction not in ('next', 'prev'):
+            raise ValueError('unknown sort or direction')
+        if isinstance(last_id, bool) or not isinstance(last_id, int):
+            raise ValueError('expected an integer id')
+        key = (_load_value(value, SORT_KEYS[sort][0]), last_id)
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('Malformed pagination cursor')
+    return sort, direction, key
+
+
+class Keyset:
+    """Ordering and cursor predicate for one page of a listing.
+
+    When a cursor is given its own sort order wins over ``sort`` so that a
+    token always continues the listing it was issued for.
+    """
+
+    def __init__(self, sort=DEFAULT_SORT, cursor=None):
+        self.direction = 'next'
+        self.key = None
+        if cursor:
+            sort, self.direction, self.key = decode_cursor(cursor)
+        elif sort not in SORT_KEYS:
+            sort = DEFAULT_SORT
+        self.sort = sort
+        self.column, descending = SORT_KEYS[sort]
+        # Walking backwards is the same scan with the ordering flipped
+        self.backwards = self.direction == 'prev'
+        self.scan_desc = descending != self.backwards
+
+    def apply(self, query, limit):
+        """Filter, order and limit a ``Query`` or ``select()``."""
+        row = tuple_(self.column, Product.id)
+        if self.key is not None:
+            query = query.filter(row < self.key if self.scan_desc else row > self.key)
+
+        if self.scan_desc:
+            query = query.order_by(self.column.desc(), Product.id.desc())
+        else:
+            query = query.order_by(self.column.asc(), Product.id.asc())
+
+        # Fetch one extra row to find out whether another page exists
+        return query.limit(limit + 1)
+
+    def page(self, rows, limit):
+        """Build the :class:`Page` from the rows :meth:`apply` selected."""
+        rows = list(rows)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if self.backwards:
+            rows.reverse()
+
+        if self.backwards:
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, self.key is not None
+
+        next_cursor = encode_cursor(self.sort, 'next', rows[-1]) if rows and has_next else None
+        prev_cursor = encode_cursor(self.sort, 'prev', rows[0]) if rows and has_prev else None
+        return Page(rows, self.sort, next_cursor=next_cursor, prev_cursor=prev_cursor)
+
+
+def paginate_products(query, sort=DEFAULT_SORT, cursor=None, limit=24):
+    """Return one :class:`Page` of ``query`` ordered by ``(sort_key, id)``."""
+    keyset = Keyset(sort, cursor)
+    return keyset.page(keyset.apply(query, limit).all(), limit)
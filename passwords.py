@@ -0,0 +1,120 @@
+"""
+Password hashing off the request threads.
+
+Hashing a password is slow on purpose, and the work is CPU-bound. If logins
+hash in the request thread, a burst of sign-ins or sign-ups occupies every
+core and catalog pages queue up behind it. :data:`passwords` sends the work
+to a small process pool (``PASSWORD_HASH_WORKERS`` processes per server
+process), so hashing can use at most that many cores.
+
+At most ``PASSWORD_HASH_QUEUE`` hashes are in flight or waiting at once. A
+request that can't get a slot within ``PASSWORD_HASH_TIMEOUT`` seconds gets
+:class:`HashingBusy`, and the view answers ``503`` instead of piling up more
+threads.
+
+``PASSWORD_HASH_METHOD`` takes Werkzeug's method strings, e.g.
+``scrypt:32768:8:1`` (memory-hard, the default) or ``pbkdf2:sha256:600000``.
+Both run on the standard library. Stored hashes record their method, so older
+hashes keep verifying. :meth:`PasswordHasher.needs_rehash` tells the login
+view to re-hash a password with the current settings once it has been
+checked. ``PASSWORD_HASH_WORKERS = 0`` hashes inline, which suits scripts.
+Pool processes are started with ``forkserver`` and import the main module, so
+a script that hashes through the pool needs an ``if __name__ == '__main__'``
+guard.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from instrumentation import Counter, registry
+
+hashes = registry.add(Counter('password_hashes_total', 'Password hashes computed', ('op',)))
+rejected = registry.add(Counter('password_hash_rejected_total', 'Password hashes turned away as busy'))
+
+
+class HashingBusy(RuntimeError):
+    pass
+
+
+def _method_of(pwhash):
+    return pwhash.split('$', 1)[0] if pwhash else None
+
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.method = 'scrypt:32768:8:1'
+        self.workers = 0
+        self.timeout = 5
+        self._slots = threading.BoundedSemaphore(16)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+        app.config.setdefault('PASSWORD_HASH_WORKERS', 1)
+        app.config.setdefault('PASSWORD_HASH_QUEUE', 16)
+        app.config.setdefault('PASSWORD_HASH_TIMEOUT', 5)
+        # Werkzeug fills in defaults ('scrypt' -> 'scrypt:32768:8:1'); store the
+        # spelled-out form so needs_rehash() compares like with like
+        self.method = _method_of(generate_password_hash('', app.config['PASSWORD_HASH_METHOD']))
+        self.workers = app.config['PASSWORD_HASH_WORKERS']
+        self.timeout = app.config['PASSWORD_HASH_TIMEOUT']
+        self._slots = threading.BoundedSemaphore(max(app.config['PASSWORD_HASH_QUEUE'], 1))
+        self.shutdown()
+        app.extensions['passwords'] = self
+
+    def hash(self, password):
+        return self._run('hash', generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._run('verify', check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        return _method_of(pwhash) != self.method
+
+    def _run(self, op, fn, *args):
+        hashes.inc(op)
+        if self.workers <= 0:
+            return fn(*args)
+        if not self._slots.acquire(timeout=self.timeout):
+            rejected.inc()
+            raise HashingBusy('Too many password checks in progress')
+        try:
+            return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _executor(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # Forking a threaded server process is unsafe; forkserver starts
+                # the pool from a clean single-threaded process instead
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=context)
+            return self._pool
+
+    def shutdown(self, wait=True):
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=wait, cancel_futures=True)
+
+    def _forget_pool(self):
+        # The pool's processes and threads belong to the parent
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+
+passwords = PasswordHasher()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=passwords._forget_pool)
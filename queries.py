@@ -0,0 +1,55 @@
+"""
+Shared read queries for pages that render a user's items together with
+their products.
+
+Each helper joins in the rows' many-to-one targets up front, so rendering
+a cart, wishlist or product page doesn't lazy-load one product or user
+per row. :func:`user_product_flags` fetches the product ids a user has
+wishlisted or reviewed in one query, at most once per request.
+"""
+
+from flask import g
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.orm import joinedload
+
+from models import db, CartItem, ProductReview, Wishlist
+
+
+def cart_items_for(user_id):
+    return (CartItem.query
+            .options(joinedload(CartItem.product))
+            .filter_by(user_id=user_id)
+            .order_by(CartItem.created_at, CartItem.id)
+            .all())
+
+
+def wishlist_items_for(user_id):
+    return (Wishlist.query
+            .options(joinedload(Wishlist.product))
+            .filter_by(user_id=user_id)
+            .order_by(Wishlist.created_at.desc(), Wishlist.id.desc())
+            .all())
+
+
+def reviews_for_product(product_id):
+    return (ProductReview.query
+            .options(joinedload(ProductReview.user))
+            .filter_by(product_id=product_id)
+            .order_by(ProductReview.created_at.desc())
+            .all())
+
+
+def user_product_flags(user_id):
+    """``(wishlisted, reviewed)`` product id sets for the user, memoized per request."""
+    memo = g.get('_user_product_flags')
+    if memo is None or memo[0] != user_id:
+        rows = db.session.execute(union_all(
+            select(literal('w'), Wishlist.product_id).where(Wishlist.user_id == user_id),
+            select(literal('r'), ProductReview.product_id).where(ProductReview.user_id == user_id),
+        )).all()
+        memo = g._user_product_flags = (
+            user_id,
+            frozenset(pid for kind, pid in rows if kind == 'w'),
+            frozenset(pid for kind, pid in rows if kind == 'r'),
+        )
+    return memo[1], memo[2]
@@ -0,0 +1,286 @@
+"""
+Best sellers and trending products, from order history.
+
+Each order line adds to its product's row in ``product_sales`` inside the
+checkout transaction, so ranking never has to ``GROUP BY`` over
+``order_item``. The row holds two counters:
+
+* ``units``       - units ever sold ("best sellers")
+* ``trend_score`` - ``log2`` of the units weighted by
+                    ``2 ** ((t - TREND_EPOCH) / half_life)`` for a sale at
+                    time ``t``. All scores age by the same factor, so ordering
+                    by the stored value orders by exponentially decayed
+                    sales, and nothing is ever decayed in place ("trending",
+                    see ``RANKINGS_TREND_HALF_LIFE``). The weights themselves
+                    would overflow a float after ~1000 half-lives; their
+                    logarithm only grows by one per half-life, and a sale is
+                    added to it with log-sum-exp (:class:`logaddexp2`).
+
+The counters are written once per flush, for all the order lines in it
+(checkout inserts its lines with one Core statement and calls
+:func:`record_sales` itself). That write runs in a savepoint: if it fails, the error is logged and the order
+still goes through, with the counters short until the next backfill.
+
+Each process keeps the top ``RANKINGS_SIZE`` products per ranking and
+category subtree as a precomputed list, loaded with one indexed
+``ORDER BY ... LIMIT``. Committed sales drop this process's lists, and other
+processes reload theirs after ``RANKINGS_TTL`` seconds. Serving a ranking is
+a slice of that list plus a primary-key lookup of K products.
+
+``python backfill_rankings.py`` rebuilds the table from ``order_item``, e.g.
+after bulk-loading orders.
+"""
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import bindparam, event, func, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.functions import GenericFunction
+from sqlalchemy.types import Float
+
+from categories import category_tree
+from database import upsert_insert
+from models import db, OrderItem, Product, ProductSales
+
+log = logging.getLogger(__name__)
+
+RANKINGS = ('bestsellers', 'trending')
+
+# Sale weights double every half-life from here (stored as their log2)
+TREND_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc).timestamp()
+# Sales this many half-lives old weigh less than 1e-12 of a new one
+TREND_HORIZON = 40
+# log2(0): the trend score of a product with no sales within the horizon
+NO_TREND = -1e9
+
+sales = ProductSales.__table__
+products = Product.__table__
+items = OrderItem.__table__
+
+
+def trend_offset(timestamp, half_life):
+    """``log2`` of the weight of one unit sold at ``timestamp``."""
+    return (timestamp - TREND_EPOCH) / half_life
+
+
+def logaddexp2(a, b):
+    """``log2(2**a + 2**b)`` without computing either power."""
+    if a is None or b is None:
+        return b if a is None else a
+    # Past 64 the smaller term doesn't change a double, and SQL POWER() may raise on underflow
+    return max(a, b) + math.log2(1 + 2.0 ** -min(abs(a - b), 64))
+
+
+class logaddexp2_sql(GenericFunction):
+    """SQL :func:`logaddexp2`, from SQLite's registered function or LN/POWER elsewhere."""
+    name = 'logaddexp2'
+    type = Float()
+    inherit_cache = True
+
+
+@compiles(logaddexp2_sql)
+def _compile_logaddexp2(element, compiler, **kw):
+    a, b = (compiler.process(arg, **kw) for arg in element.clauses)
+    return f'(GREATEST({a}, {b}) + LN(1 + POWER(2, -LEAST(ABS({a} - {b}), 64))) / LN(2))'
+
+
+@compiles(logaddexp2_sql, 'sqlite')
+def _compile_logaddexp2_sqlite(element, compiler, **kw):
+    return 'logaddexp2(%s)' % compiler.process(element.clauses, **kw)
+
+
+@event.listens_for(Engine, 'connect')
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('logaddexp2', 2, logaddexp2, deterministic=True)
+
+
+class Rankings:
+    def __init__(self, app=None):
+        self.size = 50
+        self.ttl = 60
+        self.half_life = 3 * 24 * 3600
+        self._lists = {}  # (ranking, category_id) -> (expires, [(product_id, score)])
+        self._generation = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RANKINGS_SIZE', 50)
+        app.config.setdefault('RANKINGS_TTL', 60)
+        app.config.setdefault('RANKINGS_TREND_HALF_LIFE', 3 * 24 * 3600)
+        self.size = app.config['RANKINGS_SIZE']
+        self.ttl = app.config['RANKINGS_TTL']
+        self.half_life = app.config['RANKINGS_TREND_HALF_LIFE']
+        self.invalidate()
+        app.extensions['rankings'] = self
+
+    def ranked(self, ranking, category_id=None):
+        """The precomputed ``[(product_id, stored score)]`` list, best first."""
+        key = (ranking, category_id)
+        with self._lock:
+            entry = self._lists.get(key)
+            generation = self._generation
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        if ranking == 'bestsellers':
+            column, floor = sales.c.units, 0
+        else:
+            column, floor = sales.c.trend_score, trend_offset(time.time(), self.half_life) - TREND_HORIZON
+        query = (select(sales.c.product_id, column).where(column > floor)
+                 .order_by(column.desc(), sales.c.product_id).limit(self.size))
+        if category_id is not None:
+            query = query.where(sales.c.category_id.in_(category_tree.descendant_ids(category_id)))
+        entries = [tuple(row) for row in db.session.execute(query)]
+        with self._lock:
+            # Sales committed while loading make this list stale already
+            if generation == self._generation:
+                self._lists[key] = (time.monotonic() + self.ttl, entries)
+        return entries
+
+    def top(self, ranking, category_id=None, limit=10):
+        """``[(product, score)]``, best first.
+
+        ``score`` is units sold for ``bestsellers``, and recent units decayed
+        by ``RANKINGS_TREND_HALF_LIFE`` for ``trending``.
+        """
+        if ranking not in RANKINGS:
+            raise ValueError(f'Unknown ranking {ranking!r}')
+        entries = self.ranked(ranking, category_id)[:max(0, min(limit, self.size))]
+        if not entries:
+            return []
+        found = {p.id: p for p in Product.query.filter(Product.id.in_([pid for pid, _ in entries]))}
+        subtree = set(category_tree.descendant_ids(category_id)) if category_id is not None else None
+        if ranking == 'trending':
+            now = trend_offset(time.time(), self.half_life)
+            entries = [(pid, 2.0 ** min(score - now, 1000)) for pid, score in entries]
+        # Skip products deleted or moved out of the category since their last sale
+        return [(found[pid], score) for pid, score in entries
+                if pid in found and (subtree is None or found[pid].category_id in subtree)]
+
+    def invalidate(self):
+        with self._lock:
+            self._lists.clear()
+            self._generation += 1
+
+
+rankings = Rankings()
+
+
+def _record_sales(connection, units_by_product, trend):
+    """Add ``units_by_product`` to ``product_sales``, all sold at log2 weight ``trend``."""
+    category_id = (select(products.c.category_id).where(products.c.id == bindparam('p_id'))
+                   .scalar_subquery())
+    params = [{'p_id': product_id, 'p_units': units, 'p_trend': trend + math.log2(units)}
+              for product_id, units in units_by_product.items()]
+    insert = upsert_insert(connection.dialect.name)
+    if insert is not None:
+        statement = insert(sales).values(product_id=bindparam('p_id'), category_id=category_id,
+                                         units=bindparam('p_units'), trend_score=bindparam('p_trend'))
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=[sales.c.product_id],
+            set_={'units': sales.c.units + statement.excluded.units,
+                  'trend_score': logaddexp2_sql(sales.c.trend_score, statement.excluded.trend_score),
+                  'category_id': statement.excluded.category_id},
+        ), params)
+        return
+    existing = set(connection.execute(
+        select(sales.c.product_id).where(sales.c.product_id.in_(list(units_by_product)))
+    ).scalars())
+    updates = [p for p in params if p['p_id'] in existing]
+    inserts = [p for p in params if p['p_id'] not in existing]
+    if updates:
+        connection.execute(
+            sales.update().where(sales.c.product_id == bindparam('p_id'))
+            .values(units=sales.c.units + bindparam('p_units'),
+                    trend_score=logaddexp2_sql(sales.c.trend_score, bindparam('p_trend')),
+                    category_id=category_id),
+            updates,
+        )
+    if inserts:
+        connection.execute(
+            sales.insert().values(product_id=bindparam('p_id'), category_id=category_id,
+                                  units=bindparam('p_units'), trend_score=bindparam('p_trend')),
+            inserts,
+        )
+
+
+def record_sales(session, units_by_product):
+    """Count ``{product_id: units}`` sold now, in ``session``'s transaction.
+
+    Order lines added through the ORM are counted on flush; call this for
+    lines inserted with Core statements.
+    """
+    units_by_product = {pid: units for pid, units in units_by_product.items() if units > 0}
+    if not units_by_product:
+        return
+    connection = session.connection()
+    try:
+        # Rankings are secondary; a failure here must not cost the order
+        with connection.begin_nested():
+            _record_sales(connection, units_by_product, trend_offset(time.time(), rankings.half_life))
+    except Exception:
+        log.exception('could not record sales for products %s', sorted(units_by_product))
+    session.info['sales_changed'] = True
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_sales(session, flush_context):
+    units_by_product = defaultdict(int)
+    for obj in session.new:
+        if isinstance(obj, OrderItem):
+            units_by_product[obj.product_id] += obj.quantity
+    record_sales(session, units_by_product)
+
+
+@event.listens_for(Session, 'after_commit')
+def _drop_rankings(session):
+    if session.info.pop('sales_changed', False):
+        rankings.invalidate()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_sales(session):
+    session.info.pop('sales_changed', None)
+
+
+def rebuild_sales(half_life=None):
+    """Recompute ``product_sales`` from ``order_item``; returns the number of products."""
+    half_life = half_life or rankings.half_life
+    totals = {
+        product_id: {'product_id': product_id, 'category_id': category_id, 'units': units, 'trend_score': None}
+        for product_id, category_id, units in db.session.execute(
+            select(items.c.product_id, products.c.category_id, func.sum(items.c.quantity))
+            .join(products, products.c.id == items.c.product_id)
+            .group_by(items.c.product_id, products.c.category_id)
+        )
+    }
+    since = datetime.utcnow() - timedelta(seconds=TREND_HORIZON * half_life)
+    recent = db.session.execute(
+        select(items.c.product_id, items.c.quantity, items.c.created_at).where(items.c.created_at >= since)
+    )
+    for product_id, quantity, created_at in recent:
+        if product_id in totals and quantity > 0:
+            timestamp = created_at.replace(tzinfo=timezone.utc).timestamp()
+            totals[product_id]['trend_score'] = logaddexp2(
+                totals[product_id]['trend_score'], trend_offset(timestamp, half_life) + math.log2(quantity))
+    for row in totals.values():
+        if row['trend_score'] is None:
+            row['trend_score'] = NO_TREND
+
+    db.session.execute(sales.delete())
+    if totals:
+        db.session.execute(sales.insert(), list(totals.values()))
+    db.session.commit()
+    rankings.invalidate()
+    return len(totals)
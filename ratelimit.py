@@ -0,0 +1,197 @@
+"""
+Per-route, per-client rate limiting with token buckets.
+
+Every request to an endpoint with a limit takes one token from the bucket for
+``(endpoint, client)``. The client is the logged-in user, otherwise the remote
+address. A bucket for ``"30/minute"`` holds up to 30 tokens and refills at
+30 per minute, so short bursts are fine but the sustained rate is capped. An
+empty bucket means ``429 Too Many Requests``, with ``Retry-After`` set to the
+number of seconds until a token is back.
+
+Limits come from ``RATE_LIMITS`` (endpoint -> limit). Endpoints not listed
+there use ``RATE_LIMIT_DEFAULT``. ``None`` or ``''`` means unlimited.
+
+Backends:
+
+* ``memory`` - buckets in this process, spread over lock-striped shards so
+               request threads rarely wait on each other. Bounded by
+               ``RATE_LIMIT_MAX_KEYS``; the least recently used buckets go first.
+* ``redis``  - one small hash per bucket, updated by a Lua script so that
+               several processes share a limit atomically. Needs
+               ``RATE_LIMIT_REDIS_URL`` and a server with scripting.
+
+If the backend fails, the request is let through and the error is logged.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, request
+from flask_login import current_user
+
+from instrumentation import Counter, registry
+
+log = logging.getLogger(__name__)
+
+decisions = registry.add(Counter('rate_limit_requests_total', 'Rate-limited requests by outcome',
+                                 ('route', 'result')))
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+EXEMPT_ENDPOINTS = {'static', 'shop.healthz', 'shop.readyz'}
+
+
+class Limit:
+    """``"<count>/<period>"``: a bucket of ``count`` tokens refilled over ``period``."""
+
+    def __init__(self, spec):
+        count, _, period = spec.partition('/')
+        if period not in PERIODS or not count.strip().isdigit() or int(count) <= 0:
+            raise ValueError(f"Bad rate limit {spec!r}; expected e.g. '30/minute'")
+        self.spec = spec
+        self.capacity = int(count)
+        self.rate = self.capacity / PERIODS[period]  # tokens per second
+
+    def __repr__(self):
+        return f'Limit({self.spec!r})'
+
+
+class MemoryBuckets:
+    def __init__(self, max_keys=100000, shards=64):
+        self.shards = [(threading.Lock(), OrderedDict()) for _ in range(shards)]
+        self.max_per_shard = max(max_keys // shards, 1)
+
+    def take(self, key, limit, cost=1):
+        """``(allowed, retry_after_seconds)``"""
+        lock, buckets = self.shards[hash(key) % len(self.shards)]
+        now = time.monotonic()
+        with lock:
+            tokens, last = buckets.pop(key, (limit.capacity, now))
+            tokens = min(limit.capacity, tokens + (now - last) * limit.rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            buckets[key] = (tokens, now)
+            if len(buckets) > self.max_per_shard:
+                # Forgetting a bucket only ever hands its owner a full one
+                buckets.popitem(last=False)
+        return allowed, 0.0 if allowed else (cost - tokens) / limit.rate
+
+    def clear(self):
+        for lock, buckets in self.shards:
+            with lock:
+                buckets.clear()
+
+
+TOKEN_BUCKET_LUA = """
+if redis.replicate_commands then redis.replicate_commands() end
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local last = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+  tokens = tokens - cost
+  allowed = 1
+else
+  retry = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry)}
+"""
+
+
+class RedisBuckets:
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_LUA)
+
+    def take(self, key, limit, cost=1):
+        allowed, retry = self._script(keys=[self.prefix + key], args=[limit.capacity, limit.rate, cost])
+        return bool(allowed), float(retry)
+
+    def clear(self):
+        for key in self.client.scan_iter(match=self.prefix + '*'):
+            self.client.delete(key)
+
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.backend = None
+        self.limits = {}
+        self.default = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_ENABLED', True)
+        app.config.setdefault('RATE_LIMIT_BACKEND', 'memory')
+        app.config.setdefault('RATE_LIMIT_REDIS_URL', None)
+        app.config.setdefault('RATE_LIMIT_MAX_KEYS', 100000)
+        app.config.setdefault('RATE_LIMITS', {})
+        app.config.setdefault('RATE_LIMIT_DEFAULT', None)
+        app.extensions['rate_limiter'] = self
+        if not app.config['RATE_LIMIT_ENABLED']:
+            self.backend = None
+            return
+
+        self.limits = {endpoint: Limit(spec) if spec else None
+                       for endpoint, spec in app.config['RATE_LIMITS'].items()}
+        self.default = Limit(app.config['RATE_LIMIT_DEFAULT']) if app.config['RATE_LIMIT_DEFAULT'] else None
+        name = app.config['RATE_LIMIT_BACKEND']
+        if name == 'memory':
+            self.backend = MemoryBuckets(app.config['RATE_LIMIT_MAX_KEYS'])
+        elif name == 'redis':
+            if not app.config['RATE_LIMIT_REDIS_URL']:
+                raise ValueError('RATE_LIMIT_BACKEND=redis needs RATE_LIMIT_REDIS_URL')
+            import redis
+            self.backend = RedisBuckets(redis.Redis.from_url(app.config['RATE_LIMIT_REDIS_URL']))
+        else:
+            raise ValueError(f'Unknown RATE_LIMIT_BACKEND {name!r}')
+        app.before_request(self._check)
+
+    def limit_for(self, endpoint):
+        if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+            return None
+        return self.limits[endpoint] if endpoint in self.limits else self.default
+
+    def _check(self):
+        endpoint = request.endpoint
+        limit = self.limit_for(endpoint)
+        if limit is None or self.backend is None:
+            return None
+        who = f'user:{current_user.id}' if current_user.is_authenticated else f'ip:{request.remote_addr}'
+        try:
+            allowed, retry_after = self.backend.take(f'{endpoint}:{who}', limit)
+        except Exception:
+            log.exception('rate limiter backend failed; letting the request through')
+            decisions.inc(endpoint, 'error')
+            return None
+        if allowed:
+            decisions.inc(endpoint, 'allowed')
+            return None
+        decisions.inc(endpoint, 'limited')
+        return self._too_many(limit, max(math.ceil(retry_after), 1))
+
+    def _too_many(self, limit, retry_after):
+        message = f'Rate limit of {limit.spec} exceeded. Try again in {retry_after}s.'
+        if request.path.startswith('/api/'):
+            response = jsonify({'message': message})
+        else:
+            response = current_app.response_class(message, mimetype='text/plain')
+        response.status_code = 429
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+
+rate_limiter = RateLimiter()
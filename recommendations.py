@@ -0,0 +1,214 @@
+"""
+"Customers also bought": item-item recommendations from order history.
+
+``python build_recommendations.py`` runs offline. It builds a sparse user x
+product matrix from order lines and wishlist entries and computes the cosine
+similarity between product columns, a block of rows at a time. It then keeps
+the top ``RECOMMENDATIONS_SIZE`` neighbours of every product. The result is
+one ``.npy`` file: a ``(max product id + 1, N)`` array of ``(id, score)``
+records, indexed by product id. The new file is written next to the old one
+and renamed over it.
+
+At request time :data:`recommendations` memory-maps that file. A product's
+neighbours are then one row read, and all worker processes share the same
+pages. A rebuilt file is picked up within ``RECOMMENDATIONS_RELOAD`` seconds.
+
+NumPy and SciPy are optional (``pip install numpy scipy``). Serving only
+needs NumPy. Without them, or before the first build, products simply have
+no recommendations.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import func, select
+
+from models import db, Order, OrderItem, Product, Wishlist
+
+try:
+    import numpy as np
+except ImportError:  # optional; see the module docstring
+    np = None
+
+log = logging.getLogger(__name__)
+
+NEIGHBOR_DTYPE = [('id', '<i4'), ('score', '<f4')]
+
+ORDER_WEIGHT = 1.0
+WISHLIST_WEIGHT = 0.5
+# Users with bigger baskets add pairs quadratically and say little about any one product
+MAX_ITEMS_PER_USER = 500
+# Upper bound on similarity entries computed at once; sets the build's peak memory
+BLOCK_PAIRS = 20_000_000
+
+
+class Recommendations:
+    def __init__(self, app=None):
+        self.path = None
+        self.size = 20
+        self.reload_interval = 60
+        self._array = None
+        self._stamp = None
+        self._checked = float('-inf')
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RECOMMENDATIONS_PATH', None)
+        app.config.setdefault('RECOMMENDATIONS_SIZE', 20)
+        app.config.setdefault('RECOMMENDATIONS_RELOAD', 60)
+        self.path = app.config['RECOMMENDATIONS_PATH'] or os.path.join(app.instance_path, 'related.npy')
+        self.size = app.config['RECOMMENDATIONS_SIZE']
+        self.reload_interval = app.config['RECOMMENDATIONS_RELOAD']
+        with self._lock:
+            self._array, self._stamp, self._checked = None, None, float('-inf')
+        app.extensions['recommendations'] = self
+
+    def _current(self):
+        if time.monotonic() - self._checked < self.reload_interval:
+            return self._array
+        with self._lock:
+            if time.monotonic() - self._checked < self.reload_interval:
+                return self._array
+            self._checked = time.monotonic()
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                self._array = self._stamp = None
+                return None
+            stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            if stamp != self._stamp and np is not None:
+                try:
+                    self._array = np.load(self.path, mmap_mode='r')
+                    self._stamp = stamp
+                except (OSError, ValueError):
+                    log.exception('could not load recommendations from %s', self.path)
+            return self._array
+
+    def related(self, product_id, limit=None):
+        """``[(product_id, score)]`` most similar first; empty if there's nothing to go on."""
+        array = self._current()
+        if array is None or not 0 <= product_id < len(array):
+            return []
+        row = array[product_id][:self.size if limit is None else limit]
+        return [(pid, score) for pid, score in row.tolist() if pid > 0]
+
+    def related_products(self, product_id, limit=None):
+        """``[(product, score)]`` for :meth:`related`, with one primary-key query."""
+        ranked = self.related(product_id, limit)
+        if not ranked:
+            return []
+        found = {p.id: p for p in Product.query.filter(Product.id.in_([pid for pid, _ in ranked]))}
+        return [(found[pid], score) for pid, score in ranked if pid in found]
+
+
+recommendations = Recommendations()
+
+
+# Building
+
+def _int_columns(statement, batch=100_000):
+    """Stream a two-column integer query into two arrays."""
+    parts = [np.array(rows, dtype=np.int64).reshape(-1, 2)
+             for rows in db.session.execute(statement, execution_options={'yield_per': batch}).partitions()]
+    data = np.concatenate(parts) if parts else np.empty((0, 2), dtype=np.int64)
+    return data[:, 0], data[:, 1]
+
+
+def interaction_watermark():
+    """Changes whenever order lines or wishlist entries are added or removed."""
+    return {table.__tablename__: list(db.session.execute(select(func.max(table.id), func.count(table.id))).one())
+            for table in (OrderItem, Wishlist)}
+
+
+def load_interactions():
+    """``(user_ids, product_ids, weights, n_rows)`` from order lines and wishlists."""
+    order_users, order_products = _int_columns(
+        select(Order.user_id, OrderItem.product_id).join(Order, Order.id == OrderItem.order_id))
+    wish_users, wish_products = _int_columns(select(Wishlist.user_id, Wishlist.product_id))
+    users = np.concatenate([order_users, wish_users])
+    products = np.concatenate([order_products, wish_products])
+    weights = np.concatenate([np.full(len(order_users), ORDER_WEIGHT, dtype=np.float32),
+                              np.full(len(wish_users), WISHLIST_WEIGHT, dtype=np.float32)])
+    n_rows = (db.session.execute(select(func.max(Product.id))).scalar() or 0) + 1
+    return users, products, weights, n_rows
+
+
+def _top_n(similar, start, top_n, out):
+    """Write the ``top_n`` best neighbours of each row of the CSR block ``similar`` into ``out``."""
+    rows = np.repeat(np.arange(similar.shape[0]), np.diff(similar.indptr))
+    cols, scores = similar.indices, similar.data
+    keep = cols != rows + start  # a product isn't its own neighbour
+    rows, cols, scores = rows[keep], cols[keep], scores[keep]
+    # Best first within each row; ties go to the lower product id
+    order = np.lexsort((cols, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < top_n
+    out['id'][start + rows[keep], rank[keep]] = cols[keep]
+    out['score'][start + rows[keep], rank[keep]] = scores[keep]
+
+
+def build_similar(users, products, weights, n_rows, top_n, max_items=MAX_ITEMS_PER_USER,
+                  block_pairs=BLOCK_PAIRS):
+    """Top-``top_n`` cosine neighbours per product id, as a ``(n_rows, top_n)`` NEIGHBOR_DTYPE array."""
+    from scipy import sparse
+
+    _, user_index = np.unique(users, return_inverse=True)
+    matrix = sparse.csr_matrix((weights.astype(np.float32), (user_index, products)),
+                               shape=(int(user_index.max()) + 1 if len(users) else 0, n_rows))
+    matrix.sum_duplicates()
+    matrix.data = np.log1p(matrix.data)  # buying again counts, but less each time
+    basket = np.diff(matrix.indptr)
+    if (basket > max_items).any():
+        matrix = matrix[basket <= max_items]
+        basket = np.diff(matrix.indptr)
+
+    # Unit-length product columns, so the dot products below are cosines
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0).astype(np.float32)
+    matrix = (matrix @ sparse.diags(scale)).tocsr()
+    by_product = matrix.T.tocsr()
+
+    # Row i of the similarity matrix has at most sum(basket size) entries over
+    # the users who bought i; cut blocks so each holds about block_pairs of them
+    pairs = np.cumsum(sparse.csr_matrix((np.ones_like(by_product.data), by_product.indices, by_product.indptr),
+                                        shape=by_product.shape) @ basket.astype(np.float64))
+    bounds = np.searchsorted(pairs, np.arange(block_pairs, pairs[-1] if len(pairs) else 0, block_pairs))
+    bounds = np.unique(np.concatenate([[0], bounds, [n_rows]]))
+
+    out = np.zeros((n_rows, top_n), dtype=NEIGHBOR_DTYPE)
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        if stop > start:
+            _top_n((by_product[start:stop] @ matrix).tocsr(), start, top_n, out)
+    return out
+
+
+def write_similar(path, similar, meta=None):
+    """Atomically replace ``path`` with ``similar`` (and ``meta`` as JSON beside it)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, similar)
+    os.replace(tmp, path)
+    if meta is not None:
+        with open(tmp, 'w') as f:
+            json.dump(meta, f, indent=2, default=str)
+        os.replace(tmp, meta_path(path))
+
+
+def meta_path(path):
+    return os.path.splitext(path)[0] + '.json'
+
+
+def read_meta(path):
+    try:
+        with open(meta_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,251 @@
+"""
+Stock holds for carts.
+
+Adding to the cart places a time-limited hold: the units come off
+``Product.stock`` straight away, through one conditional UPDATE so a hold can
+never oversell, and are recorded as a :class:`models.Reservation`. Shoppers see
+what is really still available, and a sold-out product is refused at
+add-to-cart instead of failing at checkout.
+
+Checkout claims the user's holds and only touches ``stock`` for quantities a
+hold doesn't cover. Holds that run out are given back by a background sweeper
+in batches. Rows are always taken with ``DELETE ... RETURNING``, so a hold
+claimed by a checkout can't also be released by the sweeper, or the other way
+round.
+
+Each worker keeps a heap of the expiry times of the holds it placed, so its
+sweeper wakes when the next one is due instead of polling the table; holds
+placed by other workers are caught by the regular
+``RESERVATION_SWEEP_INTERVAL`` pass. ``RESERVATION_TTL = 0`` turns holds off.
+"""
+
+import heapq
+import logging
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+from sqlalchemy import bindparam, delete, select
+
+from cache import product_tag, product_tags, tag_session
+from models import db, Product, Reservation
+
+log = logging.getLogger(__name__)
+
+products = Product.__table__
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, available):
+        self.product_id = product_id
+        self.available = available
+        super().__init__('Not enough stock available')
+
+
+def _take_rows(condition):
+    """Delete the matching holds and return ``(product_id, quantity)`` rows."""
+    statement = delete(Reservation).where(condition)
+    if db.session.get_bind().dialect.delete_returning:
+        return db.session.execute(statement.returning(Reservation.product_id, Reservation.quantity)).all()
+    rows = db.session.execute(
+        select(Reservation.product_id, Reservation.quantity).where(condition).with_for_update()
+    ).all()
+    db.session.execute(statement)
+    return rows
+
+
+def give_back(quantities):
+    """Return units to stock in one executemany; caller commits."""
+    quantities = {pid: q for pid, q in quantities.items() if q > 0}
+    if not quantities:
+        return
+    db.session.execute(
+        products.update()
+        .where(products.c.id == bindparam('b_id'))
+        .values(stock=products.c.stock + bindparam('b_quantity')),
+        [{'b_id': pid, 'b_quantity': q} for pid, q in quantities.items()],
+    )
+
+
+class _ExpiryIndex:
+    """Min-heap of hold expiry times placed by this worker."""
+
+    def __init__(self):
+        self._heap = []
+        self._lock = threading.Lock()
+        self.changed = threading.Event()
+
+    def push(self, expires_at):
+        with self._lock:
+            earliest = not self._heap or expires_at < self._heap[0]
+            heapq.heappush(self._heap, expires_at)
+        if earliest:
+            self.changed.set()
+
+    def next_due(self):
+        with self._lock:
+            return self._heap[0] if self._heap else None
+
+    def pop_due(self, now):
+        with self._lock:
+            while self._heap and self._heap[0] <= now:
+                heapq.heappop(self._heap)
+
+
+class StockReservations:
+    def __init__(self, app=None):
+        self.app = None
+        self.ttl = 0
+        self.index = _ExpiryIndex()
+        self._sweeper = None
+        self._sweeper_lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RESERVATION_TTL', 15 * 60)
+        app.config.setdefault('RESERVATION_SWEEP_INTERVAL', 30)
+        app.config.setdefault('RESERVATION_SWEEP_BATCH', 500)
+        self.app = app
+        self.ttl = app.config['RESERVATION_TTL']
+        self.sweep_interval = app.config['RESERVATION_SWEEP_INTERVAL']
+        self.batch_size = app.config['RESERVATION_SWEEP_BATCH']
+        app.extensions['stock_reservations'] = self
+
+    @property
+    def enabled(self):
+        return self.ttl > 0
+
+    def hold(self, user_id, product_id, quantity):
+        """Hold ``quantity`` more units for the user (e.g. add to cart)."""
+        return self._replace(user_id, product_id, lambda held: held + quantity)
+
+    def set(self, user_id, product_id, quantity):
+        """Make the user's hold exactly ``quantity`` units; 0 releases it."""
+        return self._replace(user_id, product_id, lambda held: max(quantity, 0))
+
+    def release(self, user_id, product_id):
+        return self.set(user_id, product_id, 0)
+
+    def _replace(self, user_id, product_id, new_quantity):
+        if not self.enabled:
+            # No holds: just the old add-to-cart stock check
+            stock = db.session.execute(select(products.c.stock).where(products.c.id == product_id)).scalar()
+            wanted = new_quantity(0)
+            if wanted > 0 and (stock is None or wanted > stock):
+                raise InsufficientStock(product_id, stock or 0)
+            return wanted
+
+        # Take the current hold (if any) and put the new one in its place, with
+        # a single conditional stock change for the difference
+        held = sum(q for _, q in _take_rows((Reservation.user_id == user_id)
+                                            & (Reservation.product_id == product_id)))
+        wanted = max(new_quantity(held), 0)
+        statement = (products.update()
+                     .where(products.c.id == product_id, products.c.stock + held >= wanted)
+                     .values(stock=products.c.stock + held - wanted))
+        if db.session.get_bind().dialect.update_returning:
+            row = db.session.execute(statement.returning(
+                products.c.id, products.c.stock, products.c.category, products.c.category_id)).first()
+        else:
+            row = None
+            if db.session.execute(statement).rowcount:
+                row = db.session.execute(select(products.c.id, products.c.stock, products.c.category,
+                                                products.c.category_id)
+                                         .where(products.c.id == product_id)).first()
+        if row is None:
+            db.session.rollback()
+            stock = db.session.execute(select(products.c.stock).where(products.c.id == product_id)).scalar()
+            raise InsufficientStock(product_id, stock or 0)
+
+        expires_at = None
+        if wanted > 0:
+            expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+            db.session.add(Reservation(user_id=user_id, product_id=product_id,
+                                       quantity=wanted, expires_at=expires_at))
+
+        # Listings only show in/out of stock, so they're only invalidated when
+        # the product crosses zero; its own page always is
+        before = row.stock - held + wanted
+        tag_session(db.session, product_tags(row) if 0 in (before, row.stock) else {product_tag(product_id)})
+        db.session.commit()
+
+        if expires_at is not None:
+            self.index.push(expires_at)
+            self._start_sweeper()
+        return wanted
+
+    def claim(self, user_id, product_ids):
+        """Take the user's holds on ``product_ids`` for an order; caller commits.
+
+        Returns ``{product_id: quantity}`` of the units already set aside.
+        Expired holds that haven't been swept yet still count: their units
+        are still off the shelf.
+        """
+        if not self.enabled or not product_ids:
+            return {}
+        held = Counter()
+        for product_id, quantity in _take_rows((Reservation.user_id == user_id)
+                                               & Reservation.product_id.in_(list(product_ids))):
+            held[product_id] += quantity
+        return dict(held)
+
+    def release_expired(self, now=None):
+        """Give back every hold that expired by ``now``, a batch per transaction."""
+        now = now or datetime.utcnow()
+        released = 0
+        while True:
+            due = (select(Reservation.id)
+                   .where(Reservation.expires_at <= now)
+                   .order_by(Reservation.expires_at)
+                   .limit(self.batch_size)
+                   .scalar_subquery())
+            rows = _take_rows(Reservation.id.in_(due))
+            if not rows:
+                db.session.rollback()
+                break
+            totals = Counter()
+            for product_id, quantity in rows:
+                totals[product_id] += quantity
+            give_back(totals)
+            touched = db.session.execute(
+                select(products.c.id, products.c.category, products.c.category_id)
+                .where(products.c.id.in_(list(totals)))
+            ).all()
+            tag_session(db.session, set().union(*(product_tags(row) for row in touched)))
+            db.session.commit()
+            released += len(rows)
+            if len(rows) < self.batch_size:
+                break
+        self.index.pop_due(now)
+        return released
+
+    def _run_sweeper(self):
+        while True:
+            due = self.index.next_due()
+            wait = self.sweep_interval
+            if due is not None:
+                wait = min(wait, max((due - datetime.utcnow()).total_seconds(), 0))
+            if self.index.changed.wait(wait):
+                # A hold due sooner was placed meanwhile
+                self.index.changed.clear()
+                continue
+            try:
+                with self.app.app_context():
+                    count = self.release_expired()
+                if count:
+                    log.info('released %d expired stock holds', count)
+            except Exception:
+                log.exception('stock hold sweep failed; retrying')
+
+    def _start_sweeper(self):
+        if self._sweeper is not None or self.app is None:
+            return
+        with self._sweeper_lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._run_sweeper, name='stock-hold-sweeper',
+                                                 daemon=True)
+                self._sweeper.start()
+
+
+stock_holds = StockReservations()
@@ -0,0 +1,379 @@
+"""
+Full-text product search.
+
+Two backends are provided behind the same interface:
+
+* ``fts5``   - an SQLite FTS5 external-content table (``products_fts``) kept in
+               sync with ``products`` by triggers, ranked with BM25.
+* ``memory`` - an in-process inverted index kept in sync through ORM session
+               events, used when FTS5 is not available (or not SQLite).
+
+Both support prefix matching ("head" finds "headphones") and relevance ordering.
+Backends take an existing ``Product`` query and narrow it, so category/price
+filters keep running in SQL alongside the text match. :meth:`SearchBackend.ranked`
+returns one page in relevance order without loading the other matches.
+"""
+
+import heapq
+import json
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from sqlalchemy import DDL, Integer, bindparam, case, event, false, func, literal_column, select, table, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.orm import Session
+
+from models import db, Product
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Name matches count for more than description matches
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Ranked candidates checked against the SQL filters at first; later chunks double
+RANK_CHUNK = 500
+# Matches kept in an IN list on databases without a one-parameter id table
+MAX_IN_MATCHES = 5000
+
+
+def tokenize(value):
+    return [t.lower() for t in TOKEN_RE.findall(value or '')]
+
+
+class SearchBackend:
+    name = None
+
+    def apply(self, query, text_query, order_by_relevance=False):
+        """Restrict ``query`` to products matching ``text_query``."""
+        raise NotImplementedError
+
+    def ranked(self, query, text_query, offset, limit):
+        """Products ``offset`` to ``offset + limit`` of ``query``'s matches, most relevant first."""
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Re-index every product from the database."""
+        raise NotImplementedError
+
+
+class FTS5Backend(SearchBackend):
+    name = 'fts5'
+
+    SETUP = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5("
+        "name, description, content='products', content_rowid='id', "
+        "tokenize='unicode61', prefix='2 3')",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN "
+        "INSERT INTO products_fts(rowid, name, description) "
+        "VALUES (new.id, new.name, new.description); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); END",
+        "CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN "
+        "INSERT INTO products_fts(products_fts, rowid, name, description) "
+        "VALUES ('delete', old.id, old.name, old.description); "
+        "INSERT INTO products_fts(rowid, name, description) "
+        "VALUES (new.id, new.name, new.description); END",
+    ]
+
+    def __init__(self):
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def is_supported(engine):
+        if engine.dialect.name != 'sqlite':
+            return False
+        with engine.connect() as conn:
+            options = conn.exec_driver_sql('PRAGMA compile_options').scalars().all()
+        return 'ENABLE_FTS5' in options
+
+    def install(self, conn):
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='products_fts'"
+        ).first()
+        for statement in self.SETUP:
+            conn.exec_driver_sql(statement)
+        if not exists:
+            # Index rows that were already in products before the table existed
+            conn.exec_driver_sql("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+    def _ensure(self):
+        engine = db.engine
+        if engine.url in self._ready:
+            return
+        with self._lock:
+            if engine.url not in self._ready:
+                with engine.begin() as conn:
+                    self.install(conn)
+                self._ready.add(engine.url)
+
+    @staticmethod
+    def match_expression(text_query):
+        # Quote every token so user input can't inject FTS syntax, and make
+        # each one a prefix match
+        return ' '.join('"%s"*' % t for t in tokenize(text_query))
+
+    def apply(self, query, text_query, order_by_relevance=False):
+        match = self.match_expression(text_query)
+        if not match:
+            return query.filter(false())
+        self._ensure()
+
+        hits = (
+            select(
+                literal_column('rowid').label('product_id'),
+                literal_column('bm25(products_fts, %r, %r)' % (NAME_WEIGHT, DESCRIPTION_WEIGHT)).label('score'),
+            )
+            .select_from(table('products_fts'))
+            .where(text('products_fts MATCH :fts_match').bindparams(fts_match=match))
+            .subquery()
+        )
+        query = query.join(hits, hits.c.product_id == Product.id)
+        if order_by_relevance:
+            # bm25() is lower-is-better
+            query = query.order_by(hits.c.score.asc(), Product.id.asc())
+        return query
+
+    def ranked(self, query, text_query, offset, limit):
+        return self.apply(query, text_query, order_by_relevance=True).offset(offset).limit(limit).all()
+
+    def rebuild(self):
+        self._ensure()
+        with db.engine.begin() as conn:
+            conn.exec_driver_sql("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+
+
+class InvertedIndexBackend(SearchBackend):
+    """BM25 over an in-memory token -> postings map."""
+
+    name = 'memory'
+
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._postings = defaultdict(dict)  # token -> {product_id: weighted tf}
+        self._doc_tokens = {}               # product_id -> set of tokens
+        self._doc_len = {}                  # product_id -> weighted length
+        self._total_len = 0.0
+        self._vocab = []                    # sorted tokens, for prefix lookups
+        self._vocab_dirty = False
+
+    def _terms(self, name, description):
+        weights = defaultdict(float)
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(description):
+            weights[token] += DESCRIPTION_WEIGHT
+        return weights
+
+    def _remove(self, product_id):
+        for token in self._doc_tokens.pop(product_id, ()):
+            postings = self._postings[token]
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocab_dirty = True
+        self._total_len -= self._doc_len.pop(product_id, 0.0)
+
+    def _add(self, product_id, name, description):
+        weights = self._terms(name, description)
+        for token, weight in weights.items():
+            if token not in self._postings:
+                self._vocab_dirty = True
+            self._postings[token][product_id] = weight
+        self._doc_tokens[product_id] = set(weights)
+        self._doc_len[product_id] = sum(weights.values())
+        self._total_len += self._doc_len[product_id]
+
+    def update(self, upserts=(), deletes=()):
+        with self._lock:
+            if not self._loaded:
+                return
+            for product_id in deletes:
+                self._remove(product_id)
+            for product_id, name, description in upserts:
+                self._remove(product_id)
+                self._add(product_id, name, description)
+
+    def rebuild(self):
+        rows = db.session.execute(select(Product.id, Product.name, Product.description))
+        with self._lock:
+            self._postings.clear()
+            self._doc_tokens.clear()
+            self._doc_len.clear()
+            self._total_len = 0.0
+            for product_id, name, description in rows:
+                self._add(product_id, name, description)
+            self._vocab_dirty = True
+            self._loaded = True
+
+    def _expand(self, prefix):
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        i = bisect_left(self._vocab, prefix)
+        while i < len(self._vocab) and self._vocab[i].startswith(prefix):
+            yield self._vocab[i]
+            i += 1
+
+    def score(self, text_query):
+        """Return ``{product_id: score}`` for products matching every token."""
+        tokens = tokenize(text_query)
+        if not tokens:
+            return {}
+        if not self._loaded:
+            self.rebuild()
+
+        with self._lock:
+            n = len(self._doc_len)
+            avg_len = (self._total_len / n) if n else 0.0
+            scores = None
+            for token in tokens:
+                token_scores = defaultdict(float)
+                for term in self._expand(token):
+                    postings = self._postings[term]
+                    idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for product_id, tf in postings.items():
+                        norm = 1 - self.b + self.b * self._doc_len[product_id] / avg_len
+                        token_scores[product_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+                if scores is None:
+                    scores = token_scores
+                else:
+                    scores = {pid: s + token_scores[pid] for pid, s in scores.items() if pid in token_scores}
+                if not scores:
+                    return {}
+            return scores
+
+    def apply(self, query, text_query, order_by_relevance=False):
+        scores = self.score(text_query)
+        if not scores:
+            return query.filter(false())
+        key = lambda pid: (-scores[pid], pid)
+        ids = sorted(scores, key=key) if order_by_relevance else list(scores)
+        matches = _id_table(ids)
+        if matches is not None:
+            query = query.join(matches, matches.c.value == Product.id)
+            return query.order_by(matches.c.key) if order_by_relevance else query
+        # No single-parameter id list on this database: only the best matches
+        if len(ids) > MAX_IN_MATCHES:
+            ids = heapq.nsmallest(MAX_IN_MATCHES, scores, key=key)
+        query = query.filter(Product.id.in_(ids))
+        if order_by_relevance:
+            query = query.order_by(case({pid: i for i, pid in enumerate(ids)}, value=Product.id))
+        return query
+
+    def ranked(self, query, text_query, offset, limit):
+        scores = self.score(text_query)
+        wanted = offset + limit
+        found = []
+        # Best first, checking candidates against the SQL filters a chunk at a
+        # time, so neither the IN list nor the sort covers every match
+        for chunk in self._best_first(scores, max(wanted, RANK_CHUNK)):
+            matching = {pid for (pid,) in query.with_entities(Product.id).filter(Product.id.in_(chunk)).order_by(None)}
+            found.extend(pid for pid in chunk if pid in matching)
+            if len(found) >= wanted:
+                break
+        page = found[offset:wanted]
+        if not page:
+            return []
+        products = {p.id: p for p in Product.query.filter(Product.id.in_(page))}
+        return [products[pid] for pid in page if pid in products]
+
+    @staticmethod
+    def _best_first(scores, first):
+        """Product ids by relevance, in chunks that double in size."""
+        key = lambda pid: (-scores[pid], pid)
+        ranked = heapq.nsmallest(first, scores, key=key)
+        start, size = 0, first
+        while start < len(scores):
+            if len(ranked) < min(start + size, len(scores)):
+                # Most searches are served from the first chunk; sort the rest only if needed
+                ranked = sorted(scores, key=key)
+            yield ranked[start:start + size]
+            start, size = start + size, size * 2
+
+
+def _id_table(ids):
+    """``ids`` as a table of ``(key, value)`` = (position, product id), bound as one parameter.
+
+    A plain ``IN`` list takes a parameter per id, which a broad prefix
+    match on a large catalog pushes past SQLite's limit. None when the
+    database has no such construct.
+    """
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        return func.json_each(json.dumps(ids)).table_valued('key', 'value')
+    if dialect == 'postgresql':
+        array = bindparam('match_ids', ids, type_=ARRAY(Integer))
+        return func.unnest(array).table_valued('value', with_ordinality='key')
+    return None
+
+
+BACKENDS = {
+    FTS5Backend.name: FTS5Backend,
+    InvertedIndexBackend.name: InvertedIndexBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """Return the configured backend, falling back to ``memory`` without FTS5."""
+    global _backend
+    if _backend is None:
+        from flask import current_app
+        with _backend_lock:
+            if _backend is None:
+                name = current_app.config.get('SEARCH_BACKEND', FTS5Backend.name)
+                if name == FTS5Backend.name and not FTS5Backend.is_supported(db.engine):
+                    name = InvertedIndexBackend.name
+                _backend = BACKENDS[name]()
+    return _backend
+
+
+def reset_backend():
+    global _backend
+    _backend = None
+
+
+# Keep the FTS table alongside products when the schema is created or dropped
+for _statement in FTS5Backend.SETUP:
+    event.listen(Product.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+event.listen(Product.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS products_fts').execute_if(dialect='sqlite'))
+
+
+# Keep the in-memory index in sync with committed product changes
+@event.listens_for(Session, 'after_flush')
+def _collect_product_changes(session, flush_context):
+    pending = session.info.setdefault('search_index_changes', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Product):
+            pending[obj.id] = (obj.id, obj.name, obj.description)
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            pending[obj.id] = None
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_product_changes(session):
+    pending = session.info.pop('search_index_changes', None)
+    if pending and isinstance(_backend, InvertedIndexBackend):
+        _backend.update(
+            upserts=[row for row in pending.values() if row is not None],
+            deletes=[pid for pid, row in pending.items() if row is None],
+        )
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_product_changes(session):
+    session.info.pop('search_index_changes', None)
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+Production server: a pre-forking master with one worker process per core.
+
+    python serve.py [--bind 0.0.0.0:8000] [--workers N] [--preload]
+
+The master binds the listening socket and forks ``--workers`` processes that
+all accept from it, each running a threaded WSGI server around
+``create_app()``. Workers that die are replaced. Signals to the master:
+
+* ``SIGHUP``           - graceful reload: start a fresh set of workers and,
+                         once they are all accepting, let the old ones finish
+                         their requests and exit. If the new code can't start,
+                         the old workers keep serving.
+* ``SIGTERM``/``SIGINT`` - graceful stop
+* ``SIGTTIN``/``SIGTTOU`` - one worker more / fewer
+
+Workers import the app after the fork, so a reload picks up code changes.
+``--preload`` builds the app once in the master and shares it copy-on-write;
+workers start faster, but a reload then only restarts them. Either way each
+worker opens its own database connections (see database.py).
+
+Load balancers can use ``/healthz`` (process alive) and ``/readyz`` (database
+reachable). Any forking WSGI server works as well, e.g.
+``gunicorn -w 4 'app:create_app()'``.
+"""
+
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+from werkzeug.serving import ThreadedWSGIServer, WSGIRequestHandler
+from werkzeug.utils import import_string
+
+log = logging.getLogger('serve')
+
+MASTER_SIGNALS = (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD, signal.SIGTTIN, signal.SIGTTOU)
+
+
+class WorkerServer(ThreadedWSGIServer):
+    # Non-daemon request threads, so server_close() waits for in-flight requests
+    daemon_threads = False
+
+
+class RequestHandler(WSGIRequestHandler):
+    access_log = False
+
+    def log_request(self, *args, **kwargs):
+        if self.access_log:
+            super().log_request(*args, **kwargs)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pre-forking production server')
+    parser.add_argument('--bind', default=os.environ.get('BIND', '0.0.0.0:8000'), help='host:port')
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)))
+    parser.add_argument('--preload', action='store_true', help='build the app in the master before forking')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--keepalive', type=float, default=5.0,
+                        help='seconds an idle keep-alive connection is held open')
+    parser.add_argument('--graceful-timeout', type=float, default=30.0,
+                        help='seconds a stopping worker gets before it is killed')
+    parser.add_argument('--boot-timeout', type=float, default=60.0,
+                        help='seconds a new worker gets to start accepting')
+    parser.add_argument('--access-log', action='store_true')
+    return parser.parse_args()
+
+
+def warn_per_process_state():
+    """Point out settings that don't hold up across several processes."""
+    config = import_string(os.environ.get('ECOMMERCE_CONFIG', 'config.Config'))
+    if config.CACHE_BACKEND == 'memory' or (config.CACHE_BACKEND == 'redis' and not config.CACHE_REDIS_URL):
+        log.warning('CACHE_BACKEND is per process: other workers can serve stale pages for up to '
+                    '%ss after a change; set CACHE_REDIS_URL to share it', config.CACHE_DEFAULT_TTL)
+    if config.CART_BACKEND == 'memory' or (config.CART_BACKEND == 'redis' and not config.CART_REDIS_URL):
+        log.warning("CART_BACKEND=%s keeps carts per process; use 'database' or set CART_REDIS_URL",
+                    config.CART_BACKEND)
+    if config.RATE_LIMIT_ENABLED and config.RATE_LIMIT_BACKEND == 'memory':
+        log.warning('RATE_LIMIT_BACKEND=memory counts per process: each worker allows the full rate; '
+                    "use 'redis' with RATE_LIMIT_REDIS_URL to share limits")
+
+
+def run_worker(listener, app, ready_fd, args):
+    """Body of a worker process; returns when it has shut down."""
+    signal.set_wakeup_fd(-1)
+    for sig in MASTER_SIGNALS:
+        signal.signal(sig, signal.SIG_DFL)
+    # The master turns Ctrl+C into a graceful stop for everyone
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    if app is None:
+        from app import create_app
+        app = create_app()
+    from cart_store import cart_store
+    from jobs import job_queue
+    from passwords import passwords
+
+    handler = type('Handler', (RequestHandler,), {'timeout': args.keepalive, 'access_log': args.access_log})
+    server = WorkerServer(listener.getsockname()[0], listener.getsockname()[1], app,
+                          handler=handler, fd=listener.fileno())
+    listener.close()
+    signal.signal(signal.SIGTERM, lambda *_: threading.Thread(target=server.shutdown).start())
+    os.write(ready_fd, b'1')
+    os.close(ready_fd)
+
+    server.serve_forever()
+    server.server_close()
+    # Nothing buffered in this process may be lost
+    with app.app_context():
+        cart_store.flush()
+    job_queue.stop(args.graceful_timeout)
+    passwords.shutdown()
+
+
+class Master:
+    def __init__(self, args):
+        self.args = args
+        host, _, port = args.bind.rpartition(':')
+        self.listener = socket.create_server((host or '0.0.0.0', int(port)), backlog=args.backlog)
+        self.app = None
+        if args.preload:
+            from app import create_app
+            self.app = create_app()
+        self.count = args.workers
+        self.generation = 0
+        self.workers = {}      # pid -> generation
+        self.stopping = {}     # pid -> deadline for SIGKILL
+        self.shutting_down = False
+        self._last_spawn_failure = 0.0
+
+    def spawn(self, n):
+        """Fork ``n`` workers of the current generation; returns the pids that came up."""
+        pending = {}
+        for _ in range(n):
+            ready_r, ready_w = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                code = 0
+                try:
+                    os.close(ready_r)
+                    for fd in pending:
+                        os.close(fd)
+                    run_worker(self.listener, self.app, ready_w, self.args)
+                except BaseException:
+                    log.exception('worker %d failed', os.getpid())
+                    code = 1
+                finally:
+                    logging.shutdown()
+                    os._exit(code)
+            os.close(ready_w)
+            self.workers[pid] = self.generation
+            pending[ready_r] = pid
+
+        ready = set()
+        deadline = time.monotonic() + self.args.boot_timeout
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            for fd in select.select(list(pending), [], [], remaining)[0]:
+                pid = pending.pop(fd)
+                if os.read(fd, 1):
+                    ready.add(pid)
+                os.close(fd)
+        for fd, pid in pending.items():
+            os.close(fd)
+            self.terminate(pid)
+        return ready
+
+    def terminate(self, pid):
+        if pid in self.workers and pid not in self.stopping:
+            self.stopping[pid] = time.monotonic() + self.args.graceful_timeout
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def current(self):
+        return [pid for pid, gen in self.workers.items() if gen == self.generation and pid not in self.stopping]
+
+    def reload(self):
+        old = self.current()
+        self.generation += 1
+        log.info('reloading: starting %d new workers', self.count)
+        ready = self.spawn(self.count)
+        if len(ready) < self.count:
+            log.error('reload failed: only %d of %d new workers started; keeping the old ones',
+                      len(ready), self.count)
+            for pid in ready:
+                self.terminate(pid)
+            self.generation -= 1
+            return
+        for pid in old:
+            self.terminate(pid)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            generation = self.workers.pop(pid, None)
+            expected = self.stopping.pop(pid, None) is not None
+            if generation == self.generation and not expected and not self.shutting_down:
+                log.warning('worker %d exited unexpectedly (status %d)', pid, status)
+
+    def maintain(self):
+        now = time.monotonic()
+        for pid, deadline in list(self.stopping.items()):
+            if now > deadline:
+                log.warning('worker %d did not stop in time; killing it', pid)
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.stopping[pid] = float('inf')
+        if self.shutting_down:
+            return
+        current = self.current()
+        for pid in current[self.count:]:
+            self.terminate(pid)
+        missing = self.count - len(current)
+        # Don't spin if workers can't start at all
+        if missing > 0 and now - self._last_spawn_failure > 1.0:
+            if len(self.spawn(missing)) < missing:
+                self._last_spawn_failure = time.monotonic()
+
+    def run(self):
+        wake_r, wake_w = os.pipe()
+        os.set_blocking(wake_r, False)
+        os.set_blocking(wake_w, False)
+        signal.set_wakeup_fd(wake_w)
+        for sig in MASTER_SIGNALS:
+            signal.signal(sig, lambda *_: None)
+
+        log.info('listening on %s with %d workers (pid %d)', self.args.bind, self.count, os.getpid())
+        if not self.spawn(self.count):
+            log.error('no worker could start')
+            self.shutting_down = True
+            for pid in list(self.workers):
+                self.terminate(pid)
+
+        while not (self.shutting_down and not self.workers):
+            if select.select([wake_r], [], [], 1.0)[0]:
+                try:
+                    received = os.read(wake_r, 64)
+                except BlockingIOError:
+                    received = b''
+                for signum in received:
+                    if signum in (signal.SIGTERM, signal.SIGINT) and not self.shutting_down:
+                        log.info('stopping %d workers', len(self.workers))
+                        self.shutting_down = True
+                        for pid in list(self.workers):
+                            self.terminate(pid)
+                    elif signum == signal.SIGHUP and not self.shutting_down:
+                        self.reload()
+                    elif signum == signal.SIGTTIN:
+                        self.count += 1
+                    elif signum == signal.SIGTTOU and self.count > 1:
+                        self.count -= 1
+            self.reap()
+            self.maintain()
+        self.listener.close()
+        log.info('stopped')
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(process)d] %(levelname)s %(name)s: %(message)s')
+    if args.workers > 1:
+        warn_per_process_state()
+    Master(args).run()
+
+
+if __name__ == '__main__':
+    main()
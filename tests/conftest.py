@@ -0,0 +1,108 @@
+"""
+Shared fixtures: an application on its own SQLite file per test.
+
+Background threads (job workers, rate limiting) are off and passwords use
+a cheap hash, so tests only exercise the code under test.
+"""
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app
+from config import Config
+from models import db, Product, User
+from search_index import reset_backend
+
+
+def make_config(tmp_path, **overrides):
+    settings = {
+        'TESTING': True,
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'shop.db'}",
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+        'CACHE_BACKEND': 'null',
+        'JOB_WORKERS': 0,
+        'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+        'PASSWORD_HASH_WORKERS': 0,
+        'RATE_LIMIT_ENABLED': False,
+        'RECOMMENDATIONS_PATH': str(tmp_path / 'related.npy'),
+    }
+    settings.update(overrides)
+    return type('TestConfig', (Config,), settings)
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    """``make_app(**config)``: a fresh app with the schema created, inside its app context."""
+    contexts = []
+
+    def factory(**overrides):
+        app = create_app(make_config(tmp_path, **overrides))
+        context = app.app_context()
+        context.push()
+        contexts.append(context)
+        db.create_all()
+        return app
+
+    yield factory
+    for context in reversed(contexts):
+        db.session.remove()
+        db.engine.dispose()
+        context.pop()
+    reset_backend()
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+def add_user(username='shopper', password='password123'):
+    user = User(username=username, email=f'{username}@example.com')
+    user.set_password(password)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def add_products(count, stock=10, **fields):
+    products = [Product(name=f'Product {i}', description=f'Description {i}', price=10.0 + i,
+                        stock=stock, category='Electronics', brand='Acme', **fields)
+                for i in range(count)]
+    db.session.add_all(products)
+    db.session.commit()
+    return products
+
+
+def login(client, username='shopper', password='password123'):
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302
+    return response
+
+
+class StatementCounter:
+    """Counts cursor executions on ``engine``; an ``executemany`` counts once."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+        self.parameters = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+        self.parameters.append(parameters)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._record)
+
+    @property
+    def count(self):
+        return len(self.statements)
@@ -0,0 +1,61 @@
+"""Catalog API revalidation: 304s are cheap and ETags follow catalog changes."""
+
+from cart_store import cart_store
+from conftest import StatementCounter, add_products, add_user
+from models import db, Product, ProductReview
+from orders import place_order
+
+
+def etag(client):
+    response = client.get('/api/products')
+    assert response.status_code == 200
+    return response.headers['ETag']
+
+
+def test_not_modified_is_one_lookup(client):
+    add_products(5)
+    tag = etag(client)
+    with StatementCounter(db.engine) as counter:
+        response = client.get('/api/products', headers={'If-None-Match': tag})
+    assert response.status_code == 304
+    assert counter.count == 1
+    assert 'products' not in counter.statements[0]
+
+
+def test_etag_follows_catalog_changes(client):
+    products = add_products(2)
+    product_id = products[0].id
+    seen = [etag(client)]
+
+    def changed():
+        seen.append(etag(client))
+        return seen[-1] != seen[-2]
+
+    assert not changed()
+
+    db.session.get(Product, product_id).price = 99.0
+    db.session.commit()
+    assert changed()
+
+    user_id = add_user().id
+    assert not changed()
+    cart_store.set(user_id, product_id, 1)
+    place_order(user_id)
+    assert changed()
+
+    db.session.add(ProductReview(user_id=user_id, product_id=product_id, rating=3))
+    db.session.commit()
+    assert changed()
+
+    db.session.delete(db.session.get(Product, products[1].id))
+    db.session.commit()
+    assert changed()
+
+
+def test_rolled_back_change_keeps_etag(client):
+    product_id = add_products(1)[0].id
+    before = etag(client)
+    db.session.get(Product, product_id).price = 1.0
+    db.session.flush()
+    db.session.rollback()
+    assert etag(client) == before
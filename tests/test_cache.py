@@ -0,0 +1,44 @@
+"""Committed changes drop exactly the cached pages that show them."""
+
+import pytest
+
+from conftest import add_products, add_user
+from models import db, ProductReview
+
+PAGES = ['/', '/search', '/search?category=Electronics', '/search?q=Product']
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(CACHE_BACKEND='memory')
+
+
+def warm(client, urls):
+    for url in urls:
+        client.get(url)
+        assert client.get(url).headers['X-Cache'] == 'HIT', url
+
+
+def review(product_id, rating):
+    db.session.add(ProductReview(user_id=add_user().id, product_id=product_id, rating=rating))
+    db.session.commit()
+
+
+def test_review_invalidates_listings_with_rating_facets(client):
+    product_id = add_products(3)[0].id
+    pages = PAGES + [f'/product/{product_id}']
+    warm(client, pages)
+
+    review(product_id, 4)
+    for url in pages:
+        assert client.get(url).headers['X-Cache'] == 'MISS', url
+
+
+def test_review_keeps_other_categories_cached(client):
+    products = add_products(2)
+    products[1].category = 'Books'
+    db.session.commit()
+    warm(client, ['/search?category=Books'])
+
+    review(products[0].id, 5)
+    assert client.get('/search?category=Books').headers['X-Cache'] == 'HIT'
@@ -0,0 +1,48 @@
+"""Cart quantity updates: bad input and unknown lines are client errors, not 500s."""
+
+import pytest
+
+from cart_store import cart_store
+from conftest import add_products, add_user, login
+from models import db, Product
+
+
+@pytest.fixture
+def shopper(client):
+    products = add_products(2, stock=5)
+    user_id = add_user().id
+    login(client)
+    client.post(f'/add_to_cart/{products[0].id}', data={'quantity': 2})
+    return user_id, products[0].id, products[1].id
+
+
+def update(client, product_id, quantity):
+    return client.post(f'/update_cart/{product_id}', data={'quantity': quantity})
+
+
+def test_update_moves_the_hold(client, shopper):
+    user_id, in_cart, _ = shopper
+    response = update(client, in_cart, 4)
+    assert response.get_json() == {'success': True, 'message': 'Cart updated'}
+    assert cart_store.items(user_id) == {in_cart: 4}
+    assert db.session.get(Product, in_cart).stock == 1
+
+    assert update(client, in_cart, 9).get_json()['message'] == 'Not enough stock'
+    assert cart_store.items(user_id) == {in_cart: 4}
+
+
+@pytest.mark.parametrize('quantity', ['abc', '', '1.5', '-1'])
+def test_invalid_quantity_is_rejected(client, shopper, quantity):
+    user_id, in_cart, _ = shopper
+    response = update(client, in_cart, quantity)
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+    assert cart_store.items(user_id) == {in_cart: 2}
+
+
+def test_unknown_line_is_not_found(client, shopper):
+    user_id, in_cart, not_in_cart = shopper
+    assert update(client, not_in_cart, 1).status_code == 404
+    assert update(client, 9999, 1).status_code == 404
+    assert cart_store.items(user_id) == {in_cart: 2}
+    assert db.session.get(Product, not_in_cart).stock == 5
@@ -0,0 +1,128 @@
+"""The same cart behaviour from every ``CART_BACKEND``."""
+
+import pytest
+
+from cart_store import DatabaseCartBackend, cart_store
+from conftest import StatementCounter, add_products, add_user
+from models import db, CartItem, Product
+
+BACKENDS = ['database', 'memory', 'redis']
+
+
+@pytest.fixture(params=BACKENDS)
+def backend_app(request, make_app):
+    # The write-behind thread never wakes during a test; flush() is called explicitly
+    return make_app(CART_BACKEND=request.param, CART_FLUSH_INTERVAL=3600)
+
+
+@pytest.fixture
+def shopper(backend_app):
+    return add_user().id
+
+
+@pytest.fixture
+def products(backend_app):
+    return [p.id for p in add_products(3)]
+
+
+def persisted(user_id):
+    cart_store.flush()
+    return DatabaseCartBackend().items(user_id)
+
+
+def test_backend_selected(backend_app):
+    expected = 'database' if backend_app.config['CART_BACKEND'] == 'database' else 'redis'
+    assert cart_store.backend.name == expected
+
+
+def test_add_set_remove(shopper, products):
+    first, second, third = products
+    cart_store.add(shopper, first)
+    cart_store.add(shopper, first, 2)
+    cart_store.set(shopper, second, 5)
+    cart_store.add(shopper, third)
+    cart_store.set(shopper, second, 4)
+    cart_store.remove(shopper, third)
+    assert cart_store.items(shopper) == {first: 3, second: 4}
+
+    cart_store.set(shopper, first, 0)
+    assert cart_store.items(shopper) == {second: 4}
+    assert persisted(shopper) == {second: 4}
+
+
+def test_carts_are_per_user(shopper, products):
+    other = add_user('other').id
+    cart_store.add(shopper, products[0])
+    cart_store.add(other, products[1], 2)
+    assert cart_store.items(shopper) == {products[0]: 1}
+    assert cart_store.items(other) == {products[1]: 2}
+
+
+def test_lines_and_summary(shopper, products):
+    first, second, _ = products
+    assert cart_store.lines(shopper) == []
+    assert cart_store.summary(shopper) == (0, 0.0)
+
+    cart_store.set(shopper, first, 2)
+    cart_store.set(shopper, second, 1)
+    lines = {line.product_id: line for line in cart_store.lines(shopper)}
+    assert {pid: line.quantity for pid, line in lines.items()} == {first: 2, second: 1}
+    assert lines[first].get_total() == pytest.approx(20.0)
+    assert cart_store.summary(shopper) == (3, pytest.approx(31.0))
+
+
+def test_summary_follows_price_changes(shopper, products):
+    first = products[0]
+    cart_store.set(shopper, first, 2)
+    assert cart_store.summary(shopper) == (2, pytest.approx(20.0))
+
+    product = db.session.get(Product, first)
+    product.price = 12.5
+    db.session.commit()
+    assert cart_store.summary(shopper) == (2, pytest.approx(25.0))
+
+
+def test_consume_on_commit(shopper, products):
+    first, second, third = products
+    cart_store.set(shopper, first, 3)
+    cart_store.set(shopper, second, 1)
+    cart_store.set(shopper, third, 2)
+    persisted(shopper)
+
+    cart_store.consume(shopper, {first: 1, second: 1, third: 2})
+    db.session.commit()
+    assert cart_store.items(shopper) == {first: 2}
+    assert persisted(shopper) == {first: 2}
+    assert CartItem.query.filter_by(user_id=shopper).count() == 1
+
+
+def test_consume_is_one_update(shopper, products):
+    for product_id in products:
+        cart_store.set(shopper, product_id, 2)
+    persisted(shopper)
+
+    with StatementCounter(db.engine) as counter:
+        cart_store.consume(shopper, {pid: 1 for pid in products})
+    db.session.commit()
+    updates = [s for s in counter.statements if s.startswith('UPDATE cart_item')]
+    assert len(updates) == 1
+    assert persisted(shopper) == {pid: 1 for pid in products}
+
+
+def test_consume_rolled_back(shopper, products):
+    first, second, _ = products
+    cart_store.set(shopper, first, 3)
+    cart_store.set(shopper, second, 1)
+    persisted(shopper)
+
+    cart_store.consume(shopper, {first: 1, second: 1})
+    db.session.rollback()
+    assert cart_store.items(shopper) == {first: 3, second: 1}
+    assert persisted(shopper) == {first: 3, second: 1}
+
+
+def test_consume_nothing(shopper, products):
+    cart_store.set(shopper, products[0], 1)
+    cart_store.consume(shopper, {})
+    db.session.commit()
+    assert cart_store.items(shopper) == {products[0]: 1}
@@ -0,0 +1,50 @@
+"""Checkout under concurrency: limited stock is never oversold."""
+
+import threading
+
+from cart_store import cart_store
+from conftest import add_products, add_user
+from models import db, Order, OrderItem, Product
+from orders import OutOfStockError, place_order
+
+SHOPPERS = 24
+STOCK = 5
+
+
+def test_concurrent_checkouts_never_oversell(app):
+    product_id = add_products(1, stock=STOCK)[0].id
+    user_ids = [add_user(f'shopper{i}').id for i in range(SHOPPERS)]
+    for user_id in user_ids:
+        cart_store.set(user_id, product_id, 1)
+
+    start = threading.Barrier(SHOPPERS)
+    outcomes = []
+    lock = threading.Lock()
+
+    def shop(user_id):
+        with app.app_context():
+            start.wait()
+            try:
+                place_order(user_id)
+                outcome = 'ordered'
+            except OutOfStockError:
+                outcome = 'sold out'
+            except Exception as e:  # reported below rather than lost in the thread
+                outcome = repr(e)
+            finally:
+                db.session.remove()
+        with lock:
+            outcomes.append(outcome)
+
+    threads = [threading.Thread(target=shop, args=(user_id,)) for user_id in user_ids]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(set(outcomes)) == ['ordered', 'sold out'], outcomes
+    assert outcomes.count('ordered') == STOCK
+    db.session.expire_all()
+    assert db.session.get(Product, product_id).stock == 0
+    assert Order.query.count() == STOCK
+    assert db.session.query(db.func.sum(OrderItem.quantity)).scalar() == STOCK
@@ -0,0 +1,83 @@
+"""Facet counts from the summary tables agree with counting the products."""
+
+import random
+
+import pytest
+from sqlalchemy import String, cast
+
+from conftest import StatementCounter, add_products, add_user
+from facets import FACETS, facet_counts, pinned_facet_counts, rebuild_summary
+from models import db, Product, ProductReview
+
+BRANDS = ['Acme', 'Nordic', 'Zenith', None]
+CATEGORIES = ['Electronics', 'Books', 'Garden']
+
+
+def plain(counts):
+    return {facet: sorted((v.value, v.count) for v in values) for facet, values in counts.items()}
+
+
+def summary_rows():
+    return {table: sorted(db.session.execute(db.text(f'SELECT * FROM {table} WHERE n > 0')).all())
+            for table in ('product_facet_counts', 'product_facet_pairs')}
+
+
+def assert_pinned_counts_match():
+    for facet, expr in FACETS.items():
+        for value in {v.value for v in facet_counts(Product.query, facets=[facet])[facet]} | {'missing'}:
+            condition = cast(expr(), String) == value
+            counts, total = pinned_facet_counts(facet, value)
+            assert plain(counts) == plain(facet_counts(Product.query, {facet: [condition]})), (facet, value)
+            assert total == Product.query.filter(condition).count(), (facet, value)
+
+
+@pytest.fixture
+def catalog(app):
+    rng = random.Random(7)
+    products = add_products(60)
+    for product in products:
+        product.brand = rng.choice(BRANDS)
+        product.category = rng.choice(CATEGORIES)
+        product.price = rng.choice([9.99, 30, 75, 120, 480, 2500])
+        product.is_featured = rng.random() < 0.3
+    db.session.commit()
+    return products
+
+
+def test_pinned_counts_after_inserts(catalog):
+    assert_pinned_counts_match()
+
+
+def test_pinned_counts_follow_changes(catalog):
+    rng = random.Random(11)
+    for product in catalog[:20]:
+        # Several facet columns of one row in a single UPDATE
+        product.brand = rng.choice(BRANDS)
+        product.price = rng.choice([5, 60, 700])
+        product.is_featured = not product.is_featured
+    db.session.commit()
+
+    # Ratings move through the review hooks' Core UPDATE
+    users = [add_user(f'reviewer{i}').id for i in range(3)]
+    for product in catalog[20:30]:
+        for user_id in users:
+            db.session.add(ProductReview(user_id=user_id, product_id=product.id, rating=rng.randint(1, 5)))
+    db.session.commit()
+
+    for product in catalog[40:50]:
+        db.session.delete(product)
+    db.session.commit()
+    assert_pinned_counts_match()
+
+    maintained = summary_rows()
+    rebuild_summary(db.session.connection())
+    assert summary_rows() == maintained
+
+
+def test_search_by_one_facet_reads_the_summary(client, catalog):
+    expected = Product.query.filter_by(brand='Nordic').count()
+    with StatementCounter(db.engine) as counter:
+        response = client.get('/search?brand=Nordic')
+    assert response.status_code == 200
+    assert f'{expected} product{"s" if expected != 1 else ""}</span>'.encode() in response.data
+    assert not [s for s in counter.statements if 'GROUP BY' in s or 'count(' in s.lower()]
@@ -0,0 +1,55 @@
+"""Bulk price/stock updates: every item gets its own result, bad ones don't sink the batch."""
+
+import pytest
+
+from conftest import add_products, add_user
+from models import db, Product
+from reservations import stock_holds
+
+TOKEN = 'sync-token'
+AUTH = {'Authorization': f'Bearer {TOKEN}'}
+
+
+@pytest.fixture
+def client(make_app):
+    return make_app(API_WRITE_TOKEN=TOKEN, API_BATCH_MAX=10).test_client()
+
+
+def test_mixed_batch_reports_each_item(client):
+    first, second, held = (p.id for p in add_products(3, stock=5))
+    stock_holds.hold(add_user().id, held, 2)
+
+    response = client.patch('/api/products:batch', headers=AUTH, json={'items': [
+        {'id': first, 'price': 42.5},
+        {'id': 9999, 'stock': 1},
+        {'id': second, 'stock': -1},
+        {'id': held, 'stock': 10},
+        {'id': first, 'stock': 3},
+        {'id': second, 'colour': 'red'},
+        'junk',
+    ]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [(r['id'], r['status']) for r in body['results']] == [
+        (first, 'updated'), (9999, 'not_found'), (second, 'invalid'), (held, 'updated'),
+        (first, 'invalid'), (second, 'invalid'), (None, 'invalid'),
+    ]
+    messages = [r.get('message') for r in body['results']]
+    assert messages[2] == 'stock must be a non-negative integer'
+    assert messages[4] == 'duplicate id in batch'
+    assert messages[5] == 'unknown fields: colour'
+    assert body['updated'] == 2
+
+    db.session.expire_all()
+    assert [(p.price, p.stock) for p in db.session.scalars(db.select(Product).order_by(Product.id))] == [
+        (42.5, 5), (11.0, 5), (12.0, 8),  # 10 on hand, 2 of them held in a cart
+    ]
+
+
+def test_batch_needs_token_and_respects_size(client):
+    product_id = add_products(1)[0].id
+    items = [{'id': product_id, 'price': 1}]
+    assert client.patch('/api/products:batch', json=items).status_code == 401
+    assert client.patch('/api/products:batch', headers=AUTH, json=items * 11).status_code == 413
+    assert client.patch('/api/products:batch', headers=AUTH, json={'items': 'nope'}).status_code == 400
+    assert db.session.get(Product, product_id).price == 10.0
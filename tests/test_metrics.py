@@ -0,0 +1,28 @@
+"""Metrics endpoints stay hidden until a token is configured, then require it."""
+
+import pytest
+
+ENDPOINTS = ['/metrics', '/metrics/jobs']
+
+
+@pytest.mark.parametrize('path', ENDPOINTS)
+def test_hidden_without_token(client, path):
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={'Authorization': 'Bearer '}).status_code == 404
+
+
+@pytest.mark.parametrize('path', ENDPOINTS)
+def test_bearer_token_required(make_app, path):
+    client = make_app(METRICS_TOKEN='s3cret').test_client()
+    assert client.get(path).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Basic s3cret'}).status_code == 401
+    assert client.get(path, headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+def test_scrape_returns_prometheus_text(make_app):
+    client = make_app(METRICS_TOKEN='s3cret').test_client()
+    client.get('/healthz')
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.mimetype == 'text/plain'
+    assert b'http_requests_total{route="shop.healthz"' in response.data
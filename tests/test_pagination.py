@@ -0,0 +1,71 @@
+"""Keyset cursors: round trips, and tampered tokens are refused rather than crashing."""
+
+import base64
+import json
+
+import pytest
+
+from conftest import add_products
+from models import Product
+from pagination import SORT_KEYS, InvalidCursor, decode_cursor, paginate_products
+
+
+def token(payload):
+    raw = payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+MALFORMED = [
+    'not base64!',
+    token(b'not json'),
+    token(b'\xff\xfe'),
+    token([1, 2]),
+    token({'s': 'name', 'd': 'next'}),
+    token({'s': 'name', 'd': 'next', 'k': ['a']}),
+    token({'s': 'name', 'd': 'next', 'k': ['a', 'abc']}),
+    token({'s': 'name', 'd': 'next', 'k': ['a', None]}),
+    token({'s': 'name', 'd': 'next', 'k': ['a', True]}),
+    token({'s': 'name', 'd': 'next', 'k': ['a', 1.5]}),
+    token({'s': 'name', 'd': 'next', 'k': [7, 1]}),
+    token({'s': 'name', 'd': 'sideways', 'k': ['a', 1]}),
+    token({'s': 'bogus', 'd': 'next', 'k': ['a', 1]}),
+    token({'s': ['name'], 'd': 'next', 'k': ['a', 1]}),
+    token({'s': 'newest', 'd': 'next', 'k': [{'dt': 'junk'}, 1]}),
+    token({'s': 'newest', 'd': 'next', 'k': [{'dt': 5}, 1]}),
+    token({'s': 'newest', 'd': 'next', 'k': ['2024-01-01', 1]}),
+    token({'s': 'price_asc', 'd': 'next', 'k': [{'x': 1}, 1]}),
+    token({'s': 'price_asc', 'd': 'next', 'k': ['10', 1]}),
+    token({'s': 'price_asc', 'd': 'next', 'k': [None, 1]}),
+    token({'s': 'rating', 'd': 'prev', 'k': [False, 1]}),
+]
+
+
+@pytest.mark.parametrize('cursor', MALFORMED)
+def test_decode_rejects_malformed(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+@pytest.mark.parametrize('cursor', MALFORMED)
+def test_views_handle_malformed(client, cursor):
+    add_products(3)
+    assert client.get('/', query_string={'cursor': cursor}).status_code == 302
+    assert client.get('/search', query_string={'cursor': cursor}).status_code == 302
+    response = client.get('/api/products', query_string={'cursor': cursor})
+    assert response.status_code == 400
+    assert response.get_json() == {'message': 'Malformed pagination cursor'}
+
+
+@pytest.mark.parametrize('sort', SORT_KEYS)
+def test_cursors_walk_every_sort(app, sort):
+    add_products(7)
+    seen, cursor = [], None
+    while True:
+        page = paginate_products(Product.query, sort, cursor, limit=3)
+        seen += [p.id for p in page.items]
+        if not page.has_next:
+            break
+        cursor = page.next_cursor
+    assert sorted(seen) == sorted(p.id for p in Product.query)
+    back = paginate_products(Product.query, cursor=page.prev_cursor, limit=3)
+    assert [p.id for p in back.items] == seen[-len(page.items) - 3:-len(page.items)]
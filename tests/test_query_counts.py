@@ -0,0 +1,61 @@
+"""Pages over a user's items run as many statements for 10 items as for 1."""
+
+import pytest
+
+from cart_store import cart_store
+from conftest import StatementCounter, add_products, add_user, login
+from models import db, OrderItem, Product, ProductSales, Wishlist
+
+SIZES = (1, 10)
+
+
+def fill_cart(client, user_id, product_ids):
+    for product_id in product_ids:
+        cart_store.set(user_id, product_id, 2)
+
+
+def fill_cart_with_holds(client, user_id, product_ids):
+    for product_id in product_ids:
+        assert client.post(f'/add_to_cart/{product_id}', data={'quantity': 2}).status_code == 302
+
+
+def fill_wishlist(client, user_id, product_ids):
+    db.session.add_all(Wishlist(user_id=user_id, product_id=pid) for pid in product_ids)
+    db.session.commit()
+
+
+def count_statements(make_app, tmp_path, fill, url, size):
+    app = make_app(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / f'shop{size}.db'}")
+    client = app.test_client()
+    user_id = add_user().id
+    login(client)
+    fill(client, user_id, [p.id for p in add_products(size)])
+    # Warm up per-process caches (category tree, user cache) on a page that doesn't change anything
+    client.get('/cart')
+    with StatementCounter(db.engine) as counter:
+        response = client.get(url)
+    assert response.status_code in (200, 302)
+    return counter
+
+
+def assert_constant(make_app, tmp_path, fill, url):
+    small, large = (count_statements(make_app, tmp_path, fill, url, size) for size in SIZES)
+    assert large.count == small.count, '\n'.join(large.statements)
+    return large
+
+
+def test_cart(make_app, tmp_path):
+    assert_constant(make_app, tmp_path, fill_cart, '/cart')
+
+
+def test_wishlist(make_app, tmp_path):
+    assert_constant(make_app, tmp_path, fill_wishlist, '/wishlist')
+
+
+@pytest.mark.parametrize('fill', [fill_cart, fill_cart_with_holds], ids=['unheld', 'held'])
+def test_checkout(make_app, tmp_path, fill):
+    assert_constant(make_app, tmp_path, fill, '/checkout')
+    # The last run really ordered every line, took the stock and counted the sales
+    assert OrderItem.query.count() == SIZES[-1]
+    assert db.session.query(db.func.sum(ProductSales.units)).scalar() == SIZES[-1] * 2
+    assert db.session.query(db.func.sum(Product.stock)).scalar() == SIZES[-1] * 8
@@ -0,0 +1,109 @@
+"""The hot queries are answered from their indexes, not by scanning a table.
+
+Each test runs the real code path, captures the SELECTs it sends and asks
+SQLite for their ``EXPLAIN QUERY PLAN``.
+"""
+
+import re
+
+import pytest
+
+from cart_store import DatabaseCartBackend
+from conftest import StatementCounter, add_products, add_user
+from facets import catalog_facet_counts, facet_counts, FACETS
+from models import db, Order, OrderItem, Product
+from pagination import paginate_products
+from queries import cart_items_for
+
+# "SCAN products" reads the whole table; "SCAN products USING INDEX ..." walks an index in order
+FULL_SCAN = re.compile(r'^SCAN \S+$')
+TEMP_SORT = 'USE TEMP B-TREE FOR ORDER BY'
+
+
+def query_plans(run):
+    """``[(sql, [plan detail, ...])]`` for every SELECT ``run()`` executes."""
+    with StatementCounter(db.engine) as counter:
+        run()
+    selects = [(sql, params) for sql, params in zip(counter.statements, counter.parameters)
+               if sql.lstrip().upper().startswith('SELECT')]
+    assert selects, 'no SELECT was executed'
+    with db.engine.connect() as conn:
+        return [(sql, [row[3] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}', params)])
+                for sql, params in selects]
+
+
+def assert_indexed(run, *indexes, ordered=False):
+    """Every SELECT of ``run()`` avoids full scans and ``indexes`` are all used.
+
+    ``ordered`` also requires rows to come out of an index in order, with no sort step.
+    """
+    plans = query_plans(run)
+    report = '\n\n'.join(f'{sql}\n  ' + '\n  '.join(plan) for sql, plan in plans)
+    details = [detail for _, plan in plans for detail in plan]
+    assert not [d for d in details if FULL_SCAN.match(d)], report
+    if ordered:
+        assert TEMP_SORT not in details, report
+    for index in indexes:
+        assert any(index in d for d in details), f'{index} not used:\n{report}'
+
+
+@pytest.fixture
+def catalog(app):
+    products = add_products(30)
+    for i, product in enumerate(products):
+        product.category = ('Electronics', 'Books', 'Garden')[i % 3]
+    db.session.commit()
+    return products
+
+
+@pytest.mark.parametrize('sort, index', [
+    ('newest', 'ix_products_created_at_id'),
+    ('price_asc', 'ix_products_price_id'),
+    ('price_desc', 'ix_products_price_id'),
+    ('name', 'ix_products_name_id'),
+])
+def test_keyset_listing(catalog, sort, index):
+    first = paginate_products(Product.query, sort, limit=5)
+    assert_indexed(lambda: paginate_products(Product.query, sort, limit=5), index, ordered=True)
+    for cursor in (first.next_cursor,
+                   paginate_products(Product.query, cursor=first.next_cursor, limit=5).prev_cursor):
+        assert_indexed(lambda: paginate_products(Product.query, cursor=cursor, limit=5), index, ordered=True)
+        # Later pages start at the cursor instead of walking the index from the top
+        [(_, plan)] = query_plans(lambda: paginate_products(Product.query, cursor=cursor, limit=5))
+        assert plan[0].startswith(f'SEARCH products USING INDEX {index}'), plan
+
+
+def test_keyset_listing_within_category(catalog):
+    query = Product.query.filter(Product.category == 'Books')
+    assert_indexed(lambda: paginate_products(query, 'price_asc', limit=5), 'ix_products_category_price',
+                   ordered=True)
+
+
+def test_cart_by_user(catalog):
+    user_id = add_user().id
+    backend = DatabaseCartBackend()
+    for product in catalog[:3]:
+        backend.set(user_id, product.id, 1)
+    assert_indexed(lambda: backend.items(user_id), 'ux_cart_item_user_product')
+    assert_indexed(lambda: cart_items_for(user_id), 'ux_cart_item_user_product')
+
+
+def test_order_items_by_order(catalog):
+    user_id = add_user().id
+    order = Order(user_id=user_id, total_amount=10)
+    order.order_items.append(OrderItem(product_id=catalog[0].id, quantity=1, price=10))
+    db.session.add(order)
+    db.session.commit()
+    order_id = order.id
+    db.session.expire_all()
+    assert_indexed(lambda: db.session.get(Order, order_id).order_items, 'ix_order_item_order_id')
+
+
+def test_catalog_facet_lookup(catalog):
+    catalog_facet_counts()  # creates the summary table on first use
+    assert_indexed(catalog_facet_counts, 'sqlite_autoindex_product_facet_counts_1')
+
+
+def test_facet_counts_within_category(catalog):
+    query = Product.query.filter(Product.category == 'Books')
+    assert_indexed(lambda: facet_counts(query, facets=list(FACETS)), 'ix_products_category_price')
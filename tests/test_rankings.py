@@ -0,0 +1,56 @@
+"""Sales rankings: trend scores stay finite and never cost an order."""
+
+import math
+
+import pytest
+
+import rankings as rankings_module
+from cart_store import cart_store
+from conftest import add_products, add_user
+from models import db, Order, ProductSales
+from orders import place_order
+from rankings import TREND_EPOCH, rankings
+
+
+def buy(user_id, quantities):
+    for product_id, quantity in quantities.items():
+        cart_store.set(user_id, product_id, quantity)
+    return place_order(user_id)
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app(RANKINGS_TREND_HALF_LIFE=60)
+
+
+def test_trend_scores_survive_thousands_of_half_lives(app, monkeypatch):
+    first, second = (p.id for p in add_products(2, stock=100))
+    user_id = add_user().id
+    # Far past the point where 2 ** (age / half_life) overflows a float
+    now = TREND_EPOCH + 5000 * 60
+    monkeypatch.setattr(rankings_module.time, 'time', lambda: now)
+
+    buy(user_id, {first: 1, second: 3})
+    buy(user_id, {first: 1})
+
+    scores = dict(db.session.execute(db.select(ProductSales.product_id, ProductSales.trend_score)).all())
+    assert all(math.isfinite(score) for score in scores.values())
+    # Every sale is at the same instant: the score is its offset plus log2 of the units
+    assert scores[first] == pytest.approx(5000 + 1)
+    assert scores[second] == pytest.approx(5000 + math.log2(3))
+    assert [(p.id, round(score, 6)) for p, score in rankings.top('trending')] == [(second, 3), (first, 2)]
+    assert [(p.id, units) for p, units in rankings.top('bestsellers')] == [(second, 3), (first, 2)]
+
+
+def test_ranking_failure_keeps_the_order(app, monkeypatch):
+    product_id = add_products(1)[0].id
+    user_id = add_user().id
+
+    def broken(*args):
+        raise RuntimeError('ranking store unavailable')
+    monkeypatch.setattr(rankings_module, '_record_sales', broken)
+
+    order = buy(user_id, {product_id: 2})
+    assert db.session.get(Order, order.id) is not None
+    assert ProductSales.query.count() == 0
+    assert cart_store.items(user_id) == {}
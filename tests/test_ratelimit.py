@@ -0,0 +1,37 @@
+"""Token-bucket limits: a burst of N passes, request N+1 waits for a token."""
+
+import pytest
+
+from conftest import add_products
+
+LIMIT = 3
+
+
+@pytest.fixture
+def client(make_app):
+    app = make_app(RATE_LIMIT_ENABLED=True, RATE_LIMIT_BACKEND='memory', RATE_LIMIT_DEFAULT=None,
+                   RATE_LIMITS={'shop.productlistapi': f'{LIMIT}/minute', 'shop.healthz': '1/minute'})
+    add_products(2)
+    return app.test_client()
+
+
+def get(client, path, addr='10.0.0.1'):
+    return client.get(path, environ_base={'REMOTE_ADDR': addr})
+
+
+def test_request_over_the_limit_gets_429(client):
+    assert [get(client, '/api/products').status_code for _ in range(LIMIT)] == [200] * LIMIT
+    response = get(client, '/api/products')
+    assert response.status_code == 429
+    # One token back every 60 / LIMIT seconds
+    assert 1 <= int(response.headers['Retry-After']) <= 60 // LIMIT
+    assert 'Rate limit of 3/minute exceeded' in response.get_json()['message']
+
+
+def test_buckets_are_per_client_and_route(client):
+    for _ in range(LIMIT + 1):
+        get(client, '/api/products')
+    assert get(client, '/api/products', addr='10.0.0.2').status_code == 200
+    # Unlisted routes have no limit without a default, and health checks are exempt
+    assert all(get(client, '/api/products/1').status_code == 200 for _ in range(LIMIT + 1))
+    assert all(get(client, '/healthz').status_code == 200 for _ in range(LIMIT + 1))
@@ -0,0 +1,47 @@
+"""Stock holds: never more than the shelf, and expired holds go back on it."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import add_products, add_user
+from models import db, Product, Reservation
+from reservations import InsufficientStock, stock_holds
+
+
+def stock(product_id):
+    db.session.expire_all()
+    return db.session.get(Product, product_id).stock
+
+
+def test_hold_beyond_stock_is_refused(app):
+    product_id = add_products(1, stock=3)[0].id
+    first, second = add_user('first').id, add_user('second').id
+
+    stock_holds.hold(first, product_id, 2)
+    with pytest.raises(InsufficientStock) as excinfo:
+        stock_holds.hold(second, product_id, 2)
+    assert excinfo.value.available == 1
+    # Growing an existing hold past the shelf fails and keeps the old hold
+    with pytest.raises(InsufficientStock):
+        stock_holds.set(first, product_id, 4)
+
+    assert stock(product_id) == 1
+    assert [(r.user_id, r.quantity) for r in Reservation.query] == [(first, 2)]
+
+
+def test_expired_holds_are_given_back(make_app):
+    # One hold per sweep transaction, so the sweep has to loop
+    app = make_app(RESERVATION_SWEEP_BATCH=1)
+    products = add_products(2, stock=5)
+    user_id = add_user().id
+    stock_holds.hold(user_id, products[0].id, 2)
+    stock_holds.hold(user_id, products[1].id, 5)
+    assert [stock(p.id) for p in products] == [3, 0]
+
+    assert stock_holds.release_expired(datetime.utcnow()) == 0
+    later = datetime.utcnow() + timedelta(seconds=app.config['RESERVATION_TTL'] + 1)
+    assert stock_holds.release_expired(later) == 2
+
+    assert [stock(p.id) for p in products] == [5, 5]
+    assert Reservation.query.count() == 0
@@ -0,0 +1,48 @@
+"""Text search through the in-process index: however broad the match, SQL gets one id parameter."""
+
+import pytest
+
+from conftest import StatementCounter
+from models import db, Product
+from search_index import get_backend
+
+MATCHES = 3000
+
+
+@pytest.fixture
+def app(make_app):
+    app = make_app(SEARCH_BACKEND='memory')
+    db.session.execute(Product.__table__.insert(), [
+        {'name': f'Widget {i}', 'description': 'A widget' if i % 2 else 'A gadget', 'price': 10 + i % 50,
+         'stock': 3, 'brand': f'Brand{i % 3}', 'category': 'Tools'}
+        for i in range(MATCHES)
+    ] + [{'name': 'Lamp', 'description': 'Light', 'price': 20, 'stock': 1, 'brand': 'Brand2', 'category': 'Home'}])
+    db.session.commit()
+    return app
+
+
+def test_broad_match_binds_one_parameter(app):
+    assert get_backend().name == 'memory'
+    with StatementCounter(db.engine) as counter:
+        assert get_backend().apply(Product.query, 'wid').count() == MATCHES
+    assert max(len(params) for params in counter.parameters) < 5
+
+
+def test_apply_combines_with_filters(app):
+    query = get_backend().apply(Product.query, 'widget gadget').filter(Product.brand == 'Brand1')
+    expected = {i for i in range(0, MATCHES, 2) if i % 3 == 1}
+    assert {int(p.name.split()[1]) for p in query} == expected
+
+
+def test_apply_orders_by_relevance(app):
+    backend = get_backend()
+    scores = backend.score('widget 12')
+    ranked = [p.id for p in backend.apply(Product.query, 'widget 12', order_by_relevance=True)]
+    assert ranked == sorted(scores, key=lambda pid: (-scores[pid], pid))
+
+
+def test_search_page_with_broad_match(client):
+    response = client.get('/search', query_string={'q': 'wid', 'brand': 'Brand2'})
+    assert response.status_code == 200
+    assert f'{MATCHES // 3} products</span>'.encode() in response.data
+    assert client.get('/search', query_string={'q': 'wid', 'sort': 'relevance'}).status_code == 200
@@ -0,0 +1,109 @@
+"""
+Cache of logged-in users for ``load_user``.
+
+Flask-Login rebuilds ``current_user`` from the session cookie on every
+request. Instead of a primary-key query each time, a user's column values are
+kept in a bounded LRU with a TTL. On a hit they are turned back into a
+``User`` that is attached to the request's session without touching the
+database, so relationships still lazy-load as usual.
+
+Committing an update or delete of a user evicts it in this process. Other
+worker processes see the change within ``USER_CACHE_TTL`` seconds.
+``USER_CACHE_SIZE = 0`` turns the cache off.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from instrumentation import Counter, registry
+from models import db, User
+
+lookups = registry.add(Counter('user_cache_lookups_total', 'load_user cache lookups', ('result',)))
+
+
+class UserCache:
+    def __init__(self, app=None):
+        self.max_entries = 0
+        self.ttl = 0
+        self._entries = OrderedDict()  # user_id -> (expires, column values)
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('USER_CACHE_SIZE', 10000)
+        app.config.setdefault('USER_CACHE_TTL', 60)
+        self.max_entries = app.config['USER_CACHE_SIZE']
+        self.ttl = app.config['USER_CACHE_TTL']
+        app.extensions['user_cache'] = self
+
+    def get(self, user_id):
+        """The user, attached to the current session, or None if there is none."""
+        if self.max_entries <= 0:
+            return db.session.get(User, user_id)
+
+        values = None
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(user_id)
+                    values = entry[1]
+                else:
+                    del self._entries[user_id]
+
+        if values is not None:
+            lookups.inc('hit')
+            user = User(**values)
+            # Make it look freshly loaded, then attach it without a query
+            make_transient_to_detached(user)
+            return db.session.merge(user, load=False)
+
+        lookups.inc('miss')
+        user = db.session.get(User, user_id)
+        if user is not None:
+            self._store(user)
+        return user
+
+    def _store(self, user):
+        values = {attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs}
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def evict(self, user_ids):
+        with self._lock:
+            for user_id in user_ids:
+                self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+user_cache = UserCache()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_user_changes(session, flush_context):
+    changed = {obj.id for obj in list(session.dirty) + list(session.deleted) if isinstance(obj, User)}
+    if changed:
+        session.info.setdefault('changed_users', set()).update(changed)
+
+
+@event.listens_for(Session, 'after_commit')
+def _evict_changed_users(session):
+    changed = session.info.pop('changed_users', None)
+    if changed:
+        user_cache.evict(changed)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_changed_users(session):
+    session.info.pop('changed_users', None)
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Run background jobs (see jobs.py) in a dedicated process.
+
+    python worker.py [--workers N]
+
+Set JOB_WORKERS=0 on the web processes to leave all job processing to this
+command. SIGINT/SIGTERM let running jobs finish before exiting.
+"""
+
+import argparse
+import logging
+import signal
+import threading
+
+from app import create_app
+from jobs import job_queue
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Background job worker')
+    parser.add_argument('--workers', type=int, default=4, help='worker threads')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    signal.signal(signal.SIGINT, lambda *_: stopping.set())
+
+    create_app()
+    job_queue.start(args.workers)
+    print(f'Running {args.workers} job workers; Ctrl+C to stop')
+    stopping.wait()
+    print('Stopping after running jobs finish...')
+    job_queue.stop()
+
+
+if __name__ == '__main__':
+    main()